@@ -0,0 +1,256 @@
+# 网页资源的持久化缓存，供 jiexis.py 和 dong_jiexi.py 的内联流程使用
+# 索引按 URL 记录内容哈希、ETag/Last-Modified 和有效期，内容按 SHA-256 存成文件，不同 URL 的相同内容只存一份；
+# 过期后用条件请求重新验证，服务器返回 304 时直接复用本地内容，base64 编码结果也按内容哈希保存；
+# 重新验证时网络出错或服务器出错则使用本地的旧内容。URL 的内容变化后，不再被索引引用的旧对象在保存索引时删除
+import os
+import json
+import time
+import base64
+import hashlib
+import tempfile
+import threading
+from collections import namedtuple
+
+import requests
+
+ASSET_CACHE_DIR = 'asset_cache'   # 缓存目录
+INDEX_FILE = 'index.json'         # URL 索引文件名
+
+# 资源：content 为原始字节，encoding 为 Content-Type 声明的字符集(未声明时为 None)，digest 为内容的 SHA-256(未缓存时为 None)
+Asset = namedtuple('Asset', 'url content content_type encoding digest')
+
+def declared_charset(content_type):
+    """
+    读取 Content-Type 中声明的字符集。
+    未声明时 requests 对 text/* 默认使用 ISO-8859-1，UTF-8 的 CSS/JS 会被解码成乱码，所以只信任明确声明的值
+    :param content_type: Content-Type 响应头
+    :return: 字符集名称，未声明时返回 None
+    """
+    for param in (content_type or '').split(';')[1:]:
+        name, _, value = param.strip().partition('=')
+        value = value.strip('"\' ')
+        if name.lower() == 'charset' and value:
+            return value
+    return None
+
+def parse_max_age(cache_control):
+    """
+    解析 Cache-Control
+    :return: 可直接使用的秒数，no-cache/no-store 或未声明时为 0
+    """
+    max_age = 0
+    for directive in (cache_control or '').lower().split(','):
+        name, _, value = directive.strip().partition('=')
+        if name in ('no-cache', 'no-store'):
+            return 0
+        if name == 'max-age' and value.strip('"').isdigit():
+            max_age = int(value.strip('"'))
+    return max_age
+
+def _write_atomic(path, data):
+    """先写临时文件再替换，多个线程或进程写同一个对象时不会读到半个文件"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+class AssetCache:
+    """按 URL 和内容哈希索引的资源缓存，可在多个线程中共享"""
+
+    def __init__(self, cache_dir=ASSET_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.objects_dir = os.path.join(cache_dir, 'objects')
+        self.index_file = os.path.join(cache_dir, INDEX_FILE)
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self.entries = self._load_index()
+        self._replaced = set()   # 本次运行中被替换掉的内容哈希，保存索引时删除不再引用的对象
+        self.stats = {'fresh': 0, 'revalidated': 0, 'downloaded': 0, 'stale': 0, 'failed': 0}
+
+    def _load_index(self):
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f"资源缓存索引损坏，已忽略: {e}")
+            return {}
+
+    def _object_path(self, digest, suffix=''):
+        return os.path.join(self.objects_dir, digest[:2], digest + suffix)
+
+    def _read_object(self, digest):
+        try:
+            with open(self._object_path(digest), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write_object(self, content):
+        """
+        按内容哈希保存
+        :return: SHA-256 十六进制字符串
+        """
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            _write_atomic(path, content)
+        return digest
+
+    def _remove_object(self, digest):
+        """删除对象及其 base64 编码结果"""
+        for suffix in ('', '.b64'):
+            try:
+                os.remove(self._object_path(digest, suffix))
+            except FileNotFoundError:
+                pass
+
+    def _set_entry(self, url, entry):
+        """更新或删除 URL 的索引项，调用方持有 _lock"""
+        old = self.entries.pop(url, None)
+        if entry is not None:
+            self.entries[url] = entry
+        if old and (entry is None or old['digest'] != entry['digest']):
+            self._replaced.add(old['digest'])
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _stale(self, url, entry, content, reason):
+        """重新验证失败时使用本地的旧内容"""
+        print(f"请求资源 {url} 失败({reason})，使用缓存中的旧内容")
+        self._count('stale')
+        return Asset(url, content, entry.get('content_type'), declared_charset(entry.get('content_type')),
+                     entry['digest'])
+
+    def fetch(self, session, url, timeout=None):
+        """
+        获取资源：未过期时直接读本地，过期时发送条件请求，没有缓存时正常下载；
+        重新验证时网络出错或返回 5xx 则使用本地的旧内容
+        :param session: requests.Session(或 requests 模块)
+        :param url: 资源 URL
+        :param timeout: 请求超时
+        :return: Asset，失败时返回 None
+        """
+        with self._lock:
+            entry = self.entries.get(url)
+        content = self._read_object(entry['digest']) if entry else None
+        if content is not None and time.time() < entry.get('fresh_until', 0):
+            self._count('fresh')
+            return Asset(url, content, entry.get('content_type'), declared_charset(entry.get('content_type')),
+                         entry['digest'])
+
+        headers = {}
+        if content is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        try:
+            response = session.get(url, headers=headers, timeout=timeout)
+        except requests.exceptions.RequestException as e:
+            if content is not None:
+                return self._stale(url, entry, content, e)
+            print(f"请求资源 {url} 时出错: {e}")
+            self._count('failed')
+            return None
+
+        max_age = parse_max_age(response.headers.get('Cache-Control'))
+        if response.status_code == 304 and content is not None:
+            with self._lock:
+                entry['fresh_until'] = time.time() + max_age
+                self.stats['revalidated'] += 1
+            return Asset(url, content, entry.get('content_type'), declared_charset(entry.get('content_type')),
+                         entry['digest'])
+        if response.status_code >= 500 and content is not None:
+            return self._stale(url, entry, content, f"HTTP {response.status_code}")
+        if response.status_code != 200:
+            print(f"请求资源 {url} 失败: HTTP {response.status_code}")
+            self._count('failed')
+            return None
+
+        content_type = response.headers.get('Content-Type')
+        if 'no-store' in (response.headers.get('Cache-Control') or '').lower():
+            with self._lock:
+                self._set_entry(url, None)
+                self.stats['downloaded'] += 1
+            return Asset(url, response.content, content_type, declared_charset(content_type), None)
+
+        digest = self._write_object(response.content)
+        new_entry = {
+            'digest': digest,
+            'content_type': content_type,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'fresh_until': time.time() + max_age
+        }
+        with self._lock:
+            self._set_entry(url, new_entry)
+            self.stats['downloaded'] += 1
+        return Asset(url, response.content, content_type, declared_charset(content_type), digest)
+
+    def get_base64(self, asset):
+        """
+        返回资源的 base64 编码，同一内容只编码一次，结果在多次运行之间复用
+        :param asset: Asset
+        :return: base64 字符串
+        """
+        if not asset.digest:
+            return base64.b64encode(asset.content).decode('utf-8')
+        path = self._object_path(asset.digest, '.b64')
+        try:
+            with open(path, 'r', encoding='ascii') as f:
+                return f.read()
+        except OSError:
+            pass
+        encoded = base64.b64encode(asset.content).decode('utf-8')
+        _write_atomic(path, encoded.encode('ascii'))
+        return encoded
+
+    def _referenced(self):
+        """索引引用的内容哈希，调用方持有 _lock"""
+        return {entry['digest'] for entry in self.entries.values()}
+
+    def save(self):
+        """保存 URL 索引，并删除本次运行中被替换且不再引用的对象"""
+        with self._lock:
+            data = json.dumps(self.entries, ensure_ascii=False).encode('utf-8')
+            orphans = self._replaced - self._referenced()
+            self._replaced.clear()
+        _write_atomic(self.index_file, data)
+        for digest in orphans:
+            self._remove_object(digest)
+
+    def prune(self):
+        """
+        清理整个对象目录中索引没有引用的对象(例如以前运行中残留的旧内容)
+        :return: 删除的对象数
+        """
+        with self._lock:
+            referenced = self._referenced()
+        removed = 0
+        for root, _, files in os.walk(self.objects_dir):
+            for name in files:
+                # 跳过其他线程或进程正在写入的临时文件
+                if name.startswith('.tmp-'):
+                    continue
+                if name.split('.')[0] not in referenced:
+                    os.remove(os.path.join(root, name))
+                    removed += not name.endswith('.b64')
+        return removed
+
+    def summary(self):
+        """
+        :return: 本次运行的命中统计，例如 '未过期 10, 304 20, 下载 3, 旧内容 0, 失败 0'
+        """
+        with self._lock:
+            return (f"未过期 {self.stats['fresh']}, 304 {self.stats['revalidated']}, "
+                    f"下载 {self.stats['downloaded']}, 旧内容 {self.stats['stale']}, 失败 {self.stats['failed']}")
@@ -0,0 +1,174 @@
+# 基于本地模拟API的可复现吞吐量基准
+# 测量 get_user_tweets(线程池或 asyncio 引擎)和 export_tweets 的 推文/秒、每条推文的API调用次数和峰值内存，
+# 可与保存的基线比较，超出容差时以非零状态退出，用于部署前发现性能回退
+import io
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import tracemalloc
+from contextlib import redirect_stdout
+
+import twitter_scraper as ts
+from twitter_async import scrape_users_async
+from mock_twitter_api import MockTwitterAPI, MockTwitterServer
+
+# 指标名 -> 数值越大越好(True) 还是越小越好(False)
+METRIC_DIRECTIONS = {
+    'tweets_per_sec': True,
+    'api_calls_per_tweet': False,
+    'peak_memory_mb': False
+}
+
+def make_accounts(count):
+    """生成模拟账号配置"""
+    return [{
+        'name': f'bench{i}',
+        'bearer_token': f'bench-token-{i}',
+        'api_key': f'bench-key-{i}',
+        'api_key_secret': 'secret',
+        'access_token': f'{i}-token',  # tweepy 从令牌前缀解析出用户ID
+        'access_token_secret': 'secret'
+    } for i in range(count)]
+
+def measure(func):
+    """
+    运行函数并记录耗时和峰值内存
+    :return: (返回值, 耗时秒数, 峰值内存MB)
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        with redirect_stdout(io.StringIO()):
+            result = func()
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, elapsed, peak / 1024 / 1024
+
+def bench_get_user_tweets(server, usernames, accounts, engine='threads'):
+    """
+    基准：抓取用户推文及评论
+    :param engine: threads 逐个用户调用 get_user_tweets，async 用 scrape_users_async 在一个事件循环里并发抓取
+    """
+    calls_before = sum(server.api.calls.values())
+
+    if engine == 'async':
+        def run():
+            results = asyncio.run(scrape_users_async(usernames, accounts=accounts, api_base_url=server.base_url))
+            return [tweet for username in usernames for tweet in results[username] or []]
+    else:
+        client = ts.RetryableTwitterClient(accounts=accounts, api_base_url=server.base_url)
+
+        def run():
+            tweets = []
+            for username in usernames:
+                tweets.extend(ts.get_user_tweets(client, username))
+            return tweets
+
+    tweets, elapsed, peak = measure(run)
+    api_calls = sum(server.api.calls.values()) - calls_before
+    replies = sum(len(tweet.replies) for tweet in tweets)
+    return tweets, {
+        'tweets': len(tweets),
+        'replies': replies,
+        'seconds': round(elapsed, 3),
+        'tweets_per_sec': round(len(tweets) / elapsed, 1) if elapsed else 0,
+        'api_calls': api_calls,
+        'api_calls_per_tweet': round(api_calls / len(tweets), 4) if tweets else 0,
+        'throttled': server.api.throttled,
+        'peak_memory_mb': round(peak, 2)
+    }
+
+def bench_export(tweets, format_type, output_dir):
+    """基准：导出推文"""
+    filename = os.path.join(output_dir, f'bench.{format_type}')
+    path, elapsed, peak = measure(lambda: ts.export_tweets(tweets, format_type, filename))
+    return {
+        'tweets': len(tweets),
+        'seconds': round(elapsed, 3),
+        'tweets_per_sec': round(len(tweets) / elapsed, 1) if elapsed else 0,
+        'file_size_kb': round(os.path.getsize(path) / 1024, 1) if path else None,
+        'peak_memory_mb': round(peak, 2)
+    }
+
+def compare_with_baseline(report, baseline, tolerance):
+    """
+    与基线比较
+    :return: 回退描述列表
+    """
+    regressions = []
+    for name, result in report['results'].items():
+        base = baseline.get('results', {}).get(name)
+        if not base:
+            continue
+        for metric, higher_is_better in METRIC_DIRECTIONS.items():
+            if metric not in result or not base.get(metric):
+                continue
+            change = (result[metric] - base[metric]) / base[metric]
+            if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+                regressions.append(f"{name}.{metric}: {base[metric]} -> {result[metric]} ({change:+.1%})")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='基于本地模拟API的吞吐量基准')
+    parser.add_argument('--users', type=int, default=3, help='抓取的用户数')
+    parser.add_argument('--tweets-per-user', type=int, default=500)
+    parser.add_argument('--accounts', type=int, default=2, help='模拟的API账号数')
+    parser.add_argument('--latency', type=float, default=0.02, help='模拟API每个请求的延迟(秒)')
+    parser.add_argument('--page-delay', type=float, default=0, help='翻页等待时间(秒)，默认不等待')
+    parser.add_argument('--engine', choices=['threads', 'async'], default='threads', help='抓取引擎')
+    parser.add_argument('--formats', nargs='+', default=['json', 'jsonl', 'csv'], choices=ts.EXPORT_FORMATS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='把结果写入JSON文件')
+    parser.add_argument('--baseline', help='基线结果文件，超出容差时退出码为1')
+    parser.add_argument('--save-baseline', help='把本次结果保存为基线')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='允许的相对回退比例')
+    args = parser.parse_args(argv)
+
+    ts.logger.setLevel('WARNING')
+    ts.PAGE_DELAY = args.page_delay
+
+    api = MockTwitterAPI(users=args.users, tweets_per_user=args.tweets_per_user,
+                         latency=args.latency, seed=args.seed)
+    usernames = [f'user{i}' for i in range(args.users)]
+    report = {
+        'config': vars(args),
+        'results': {}
+    }
+
+    with MockTwitterServer(api) as server, tempfile.TemporaryDirectory() as output_dir:
+        # 两种引擎的结果分开记录，不与另一种引擎的基线比较
+        name = 'get_user_tweets' if args.engine == 'threads' else f'get_user_tweets_{args.engine}'
+        tweets, report['results'][name] = bench_get_user_tweets(
+            server, usernames, make_accounts(args.accounts), args.engine)
+        for format_type in args.formats:
+            report['results'][f'export_{format_type}'] = bench_export(tweets, format_type, output_dir)
+
+    print(json.dumps(report['results'], ensure_ascii=False, indent=2))
+    report['metrics'] = ts.METRICS.to_dict()
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(report, baseline, args.tolerance)
+        if regressions:
+            print("\n性能回退:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("\n未发现超出容差的性能回退")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,102 +1,283 @@
+# 用无头 Chrome 渲染动态网页，再把渲染后的 HTML 交给 jiexis.py 内联 CSS、JS、图片和字体
+# 批量模式下保持一个预热的浏览器池，页面按显式条件判断渲染完成，
+# 渲染好的页面立即交给内联线程池处理，浏览器继续渲染下一个网址
+import os
+import re
+import sys
+import time
+import queue
+import argparse
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
 from selenium import webdriver
+from selenium.common.exceptions import TimeoutException, WebDriverException
 from selenium.webdriver.chrome.service import Service
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin  # 新增导入
-import base64  # 新增导入
-import requests
-
-# 设置 ChromeDriver 的路径
-# 请将 'path/to/chromedriver' 替换为实际的 ChromeDriver 路径
-service = Service('C:/Users/29742/AppData/Local/Google/Chrome/Application/chrome.exe')
-driver = webdriver.Chrome(service=service)
-
-# 打开网页
-url = "https://www.huggingface.co"  # 替换为实际的网页 URL
-driver.get(url)
-
-# 等待页面加载完成（可根据实际情况调整等待时间）
-driver.implicitly_wait(10)
-
-# 获取完整的 HTML 内容
-html_content = driver.page_source
-
-# 使用 BeautifulSoup 解析 HTML 内容
-soup = BeautifulSoup(html_content, "html.parser")
-
-# Step 3: 下载并内联所有 CSS 文件
-css_files = []
-for link in soup.find_all('link', {'rel': 'stylesheet'}):
-    css_url = link.get('href')
-    if css_url:
-        full_css_url = urljoin(url, css_url)
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+
+from asset_cache import AssetCache, ASSET_CACHE_DIR
+from jiexis import inline_page, create_session, FETCH_WORKERS
+
+DEFAULT_URL = "https://www.huggingface.co"
+BROWSER_POOL_SIZE = 2      # 同时保持的浏览器数
+INLINE_WORKERS = 4         # 同时内联的页面数
+PAGE_LOAD_TIMEOUT = 30     # driver.get 的超时(秒)
+READY_TIMEOUT = 15         # 等待页面就绪的超时(秒)
+QUIET_PERIOD = 0.5         # 资源请求数保持不变多久视为加载完毕(秒)
+
+def create_driver(driver_path=None, headless=True):
+    """
+    启动一个 Chrome
+    :param driver_path: ChromeDriver 路径，为 None 时由 Selenium 自动查找
+    :param headless: 是否无头运行
+    :return: WebDriver
+    """
+    options = webdriver.ChromeOptions()
+    if headless:
+        options.add_argument('--headless=new')
+    options.add_argument('--disable-gpu')
+    options.add_argument('--no-sandbox')
+    options.add_argument('--disable-dev-shm-usage')
+    options.add_argument('--window-size=1366,900')
+    service = Service(driver_path) if driver_path else Service()
+    driver = webdriver.Chrome(service=service, options=options)
+    driver.set_page_load_timeout(PAGE_LOAD_TIMEOUT)
+    return driver
+
+class BrowserPool:
+    """预热的浏览器池，浏览器在多个页面之间复用，出错的浏览器会被替换"""
+
+    def __init__(self, size=BROWSER_POOL_SIZE, driver_factory=create_driver):
+        self.size = size
+        self.driver_factory = driver_factory
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._drivers = []
+        # 并行启动，浏览器启动时间只付一次；任一浏览器启动失败时关闭已启动的浏览器，避免残留 Chrome 进程
+        with ThreadPoolExecutor(max_workers=size) as executor:
+            futures = [executor.submit(driver_factory) for _ in range(size)]
+        error = None
+        for future in futures:
+            try:
+                self._drivers.append(future.result())
+            except Exception as e:
+                error = error or e
+        if error is not None:
+            self.close()
+            raise error
+        for driver in self._drivers:
+            self._idle.put(driver)
+
+    @contextmanager
+    def browser(self):
+        """借出一个浏览器，用完归还；浏览器崩溃时换一个新的"""
+        while True:
+            try:
+                driver = self._idle.get(timeout=1)
+                break
+            except queue.Empty:
+                with self._lock:
+                    if not self._drivers:
+                        raise RuntimeError("浏览器池中没有可用的浏览器")
+        try:
+            yield driver
+        except WebDriverException:
+            self._replace(driver)
+            driver = None
+            raise
+        finally:
+            if driver is not None:
+                self._idle.put(driver)
+
+    def _replace(self, driver):
+        with self._lock:
+            self._drivers.remove(driver)
+        try:
+            driver.quit()
+        except Exception:
+            pass
+        try:
+            new_driver = self.driver_factory()
+        except Exception as e:
+            print(f"重新启动浏览器失败: {e}")
+            return
+        with self._lock:
+            self._drivers.append(new_driver)
+        self._idle.put(new_driver)
+
+    def close(self):
+        with self._lock:
+            drivers, self._drivers = self._drivers, []
+        for driver in drivers:
+            try:
+                driver.quit()
+            except Exception:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def network_quiet(period=QUIET_PERIOD):
+    """
+    等待条件：页面加载的资源数在 period 秒内不再变化(脚本异步加载的内容也已完成)
+    :return: 供 WebDriverWait.until 使用的函数
+    """
+    state = {'count': -1, 'since': 0.0}
+
+    def condition(driver):
+        count = driver.execute_script("return performance.getEntriesByType('resource').length")
+        now = time.monotonic()
+        if count != state['count']:
+            state['count'], state['since'] = count, now
+            return False
+        return now - state['since'] >= period
+
+    return condition
+
+def wait_until_ready(driver, timeout=READY_TIMEOUT, selector=None, quiet_period=QUIET_PERIOD):
+    """
+    用显式条件等待页面渲染完成：文档加载完毕、指定元素出现、资源请求停止增加
+    :param driver: WebDriver
+    :param timeout: 超时(秒)，超时后按当前内容继续
+    :param selector: 可选的 CSS 选择器，出现后才视为就绪
+    :param quiet_period: 资源请求数保持不变的时长，0 表示不等待
+    :return: 是否在超时前就绪
+    """
+    wait = WebDriverWait(driver, timeout, poll_frequency=0.1)
+    try:
+        wait.until(lambda d: d.execute_script('return document.readyState') == 'complete')
+        if selector:
+            wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, selector)))
+        if quiet_period:
+            wait.until(network_quiet(quiet_period))
+        return True
+    except TimeoutException:
+        return False
+
+def render_page(pool, url, selector=None, timeout=READY_TIMEOUT):
+    """
+    用池中的浏览器打开网页并等待渲染完成
+    :return: (渲染后的 HTML, 最终地址)
+    """
+    with pool.browser() as driver:
         try:
-            css_response = requests.get(full_css_url)
-            if css_response.status_code == 200:
-                css_files.append(css_response.text)
-                # 替换 link 标签为内联样式
-                style_tag = soup.new_tag("style")
-                style_tag.string = css_response.text
-                link.insert_before(style_tag)
-                link.decompose()  # 移除原来的 <link> 标签
-        except requests.exceptions.RequestException as e:
-            print(f"请求 CSS 文件 {full_css_url} 时出错: {e}")
-
-# Step 4: 下载并内联所有 JS 文件
-js_files = []
-for script in soup.find_all('script', {'src': True}):
-    js_url = script.get('src')
-    if js_url:
-        full_js_url = urljoin(url, js_url)
+            driver.get(url)
+        except TimeoutException:
+            print(f"加载 {url} 超时，使用已渲染的内容")
+        if not wait_until_ready(driver, timeout, selector):
+            print(f"等待 {url} 就绪超时，使用已渲染的内容")
+        return driver.page_source, driver.current_url
+
+def snapshot_filename(url, output_dir, used):
+    """
+    由网址生成不重复的文件名
+    :param used: 已使用的文件名集合
+    """
+    parsed = urlparse(url)
+    name = re.sub(r'[^A-Za-z0-9._-]+', '_', f"{parsed.netloc}{parsed.path}").strip('_') or 'page'
+    filename = os.path.join(output_dir, f"{name[:100]}.html")
+    index = 1
+    while filename in used:
+        index += 1
+        filename = os.path.join(output_dir, f"{name[:100]}_{index}.html")
+    used.add(filename)
+    return filename
+
+def snapshot_urls(urls, output_dir, pool, cache=None, inline_workers=INLINE_WORKERS, selector=None,
+                  timeout=READY_TIMEOUT):
+    """
+    批量渲染并内联网页，浏览器渲染和资源内联并行进行
+    :param urls: 网址列表
+    :param output_dir: 保存目录
+    :param pool: BrowserPool
+    :param cache: 可选的 AssetCache
+    :param inline_workers: 同时内联的页面数
+    :param selector: 可选的 CSS 选择器，出现后才视为渲染完成
+    :param timeout: 等待页面就绪的超时(秒)
+    :return: {网址: 保存的文件名，失败时为 None}
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    used = set()
+    filenames = {url: snapshot_filename(url, output_dir, used) for url in urls}
+    session = create_session()
+    results = {}
+
+    def inline(url, html, final_url):
         try:
-            js_response = requests.get(full_js_url)
-            if js_response.status_code == 200:
-                js_files.append(js_response.text)
-                # 替换 script 标签为内联脚本
-                script_tag = soup.new_tag("script")
-                script_tag.string = js_response.text
-                script.insert_before(script_tag)
-                script.decompose()  # 移除原来的 <script> 标签
-        except requests.exceptions.RequestException as e:
-            print(f"请求 JS 文件 {full_js_url} 时出错: {e}")
-
-# Step 5: 下载并内联所有图片和字体资源
-def convert_to_base64(resource_url):
+            inline_page(final_url or url, filenames[url], html=html, session=session,
+                        max_workers=FETCH_WORKERS, cache=cache)
+            return filenames[url]
+        except Exception as e:
+            print(f"内联 {url} 失败: {e}")
+            return None
+
     try:
-        response = requests.get(resource_url)
-        if response.status_code == 200:
-            content_type = response.headers.get('Content-Type')
-            if content_type:
-                # 提取文件类型
-                file_type = content_type.split('/')[-1]
-                return base64.b64encode(response.content).decode('utf-8'), file_type
-    except requests.exceptions.RequestException as e:
-        print(f"请求资源 {resource_url} 时出错: {e}")
-    return None, None
-
-# 处理所有的图片资源
-for img_tag in soup.find_all('img', {'src': True}):
-    img_url = img_tag.get('src')
-    if img_url:
-        full_img_url = urljoin(url, img_url)
-        img_base64, img_type = convert_to_base64(full_img_url)
-        if img_base64 and img_type:
-            img_tag['src'] = f"data:image/{img_type};base64,{img_base64}"
-
-# 处理所有的字体资源
-for font_tag in soup.find_all('link', {'rel': 'stylesheet', 'type': 'font/woff2'}):
-    font_url = font_tag.get('href')
-    if font_url:
-        full_font_url = urljoin(url, font_url)
-        font_base64, font_type = convert_to_base64(full_font_url)
-        if font_base64 and font_type:
-            font_tag['href'] = f"data:font/{font_type};base64,{font_base64}"
-
-# Step 6: 保存合并后的 HTML 文件
-output_file = "huggingface_complete_page.html"
-with open(output_file, "w", encoding="utf-8") as f:
-    f.write(soup.prettify())
-
-print(f"完整的 HTML 文件已保存为: {output_file}")
-
-# 关闭浏览器
-driver.quit()
\ No newline at end of file
+        with ThreadPoolExecutor(max_workers=inline_workers, thread_name_prefix='inline') as inliner, \
+                ThreadPoolExecutor(max_workers=pool.size, thread_name_prefix='render') as renderer:
+            def render(url):
+                try:
+                    html, final_url = render_page(pool, url, selector, timeout)
+                except Exception as e:
+                    print(f"渲染 {url} 失败: {e}")
+                    return None
+                # 渲染完立即交给内联线程，浏览器归还后继续渲染下一个网址
+                return inliner.submit(inline, url, html, final_url)
+
+            render_futures = {url: renderer.submit(render, url) for url in urls}
+            for url, future in render_futures.items():
+                inline_future = future.result()
+                results[url] = inline_future.result() if inline_future else None
+    finally:
+        session.close()
+    return results
+
+def load_urls(urls=None, urls_file=None):
+    """从命令行参数和文件读取网址，去掉空行、注释和重复项"""
+    names = list(urls or [])
+    if urls_file:
+        with open(urls_file, 'r', encoding='utf-8') as f:
+            names.extend(line.split('#', 1)[0] for line in f)
+    return list(dict.fromkeys(name.strip() for name in names if name.strip()))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='用无头 Chrome 渲染网页并内联成单个 HTML 文件，支持批量')
+    parser.add_argument('urls', nargs='*', help=f'网址，默认 {DEFAULT_URL}')
+    parser.add_argument('-f', '--urls-file', help='网址列表文件，每行一个，# 之后为注释')
+    parser.add_argument('-o', '--output-dir', default='snapshots', help='保存目录')
+    parser.add_argument('-b', '--browsers', type=int, default=BROWSER_POOL_SIZE, help='同时保持的浏览器数')
+    parser.add_argument('-w', '--workers', type=int, default=INLINE_WORKERS, help='同时内联的页面数')
+    parser.add_argument('--ready-selector', help='该 CSS 选择器对应的元素出现后才视为渲染完成')
+    parser.add_argument('--timeout', type=float, default=READY_TIMEOUT, help='等待页面就绪的超时(秒)')
+    parser.add_argument('--driver', help='ChromeDriver 路径，默认由 Selenium 自动查找')
+    parser.add_argument('--show-browser', action='store_true', help='显示浏览器窗口')
+    parser.add_argument('--cache-dir', default=ASSET_CACHE_DIR, help='资源缓存目录')
+    parser.add_argument('--no-cache', action='store_true', help='不使用资源缓存')
+    parser.add_argument('--prune-cache', action='store_true', help='完成后清理缓存中不再被引用的旧内容')
+    args = parser.parse_args(argv)
+
+    urls = load_urls(args.urls, args.urls_file) or [DEFAULT_URL]
+    cache = None if args.no_cache else AssetCache(args.cache_dir)
+    start = time.perf_counter()
+    size = max(1, min(args.browsers, len(urls)))
+    with BrowserPool(size, lambda: create_driver(args.driver, headless=not args.show_browser)) as pool:
+        results = snapshot_urls(urls, args.output_dir, pool, cache, args.workers, args.ready_selector, args.timeout)
+
+    failed = [url for url, filename in results.items() if filename is None]
+    print(f"完成 {len(results) - len(failed)}/{len(results)} 个网页，耗时 {time.perf_counter() - start:.2f} 秒")
+    if cache:
+        print(f"资源缓存: {cache.summary()}")
+        if args.prune_cache:
+            print(f"清理资源缓存中不再引用的对象 {cache.prune()} 个")
+    for url in failed:
+        print(f"失败: {url}")
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
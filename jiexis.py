@@ -1,84 +1,230 @@
 # 代码实现了请求 HTML、CSS 和 JS 文件，并将它们内联到 HTML 文件中的功能
 # 虽然没有直接涉及浏览器的渲染流程，但为后续在浏览器中渲染提供了整合后的 HTML 文件
-import os
+# 资源先统一收集、按 URL 去重，再通过共享连接池的 Session 并发下载，最后按原顺序替换到页面中；
+# 提供 AssetCache 时资源经过本地缓存和条件请求获取，重复抓取同一网站几乎不需要重新下载
+import sys
+import time
+import base64
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlparse
+
 import requests
 from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse
-import base64
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-# Step 1: 下载网页 HTML 内容
-url = "https://www.gamer520.com/"
-response = requests.get(url)
-html_content = response.text
-
-# Step 2: 使用 BeautifulSoup 解析 HTML 内容
-soup = BeautifulSoup(html_content, "html.parser")
-
-# Step 3: 下载并内联所有 CSS 文件
-css_files = []
-for link in soup.find_all('link', {'rel': 'stylesheet'}):
-    css_url = link.get('href')
-    if css_url:
-        full_css_url = urljoin(url, css_url)
-        css_response = requests.get(full_css_url)
-        if css_response.status_code == 200:
-            css_files.append(css_response.text)
-            # 替换 link 标签为内联样式
-            style_tag = soup.new_tag("style")
-            style_tag.string = css_response.text
-            link.insert_before(style_tag)
-            link.decompose()  # 移除原来的 <link> 标签
-
-# Step 4: 下载并内联所有 JS 文件
-js_files = []
-for script in soup.find_all('script', {'src': True}):
-    js_url = script.get('src')
-    if js_url:
-        full_js_url = urljoin(url, js_url)
-        js_response = requests.get(full_js_url)
-        if js_response.status_code == 200:
-            js_files.append(js_response.text)
-            # 替换 script 标签为内联脚本
-            script_tag = soup.new_tag("script")
-            script_tag.string = js_response.text
-            script.insert_before(script_tag)
-            script.decompose()  # 移除原来的 <script> 标签
-
-# Step 5: 下载并内联所有图片和字体资源
-def convert_to_base64(resource_url):
+from asset_cache import Asset, AssetCache, ASSET_CACHE_DIR, declared_charset
+
+FETCH_WORKERS = 16           # 同时下载的资源数
+PER_HOST_CONNECTIONS = 6     # 每个域名最多同时打开的连接数(与浏览器的限制相同)
+REQUEST_TIMEOUT = (5, 30)    # (连接超时, 读取超时) 秒
+FETCH_RETRIES = 2            # 连接失败或 5xx 时的重试次数
+
+def create_session(per_host=PER_HOST_CONNECTIONS, retries=FETCH_RETRIES):
+    """
+    创建带连接池的 Session，同一域名的连接复用，并限制每个域名的并发连接数
+    :param per_host: 每个域名的最大连接数，连接用完时请求等待而不是新建连接
+    :param retries: 重试次数
+    :return: requests.Session
+    """
+    session = requests.Session()
+    retry = Retry(total=retries, backoff_factor=0.3, status_forcelist=[500, 502, 503, 504],
+                  allowed_methods=['GET'])
+    adapter = HTTPAdapter(pool_connections=32, pool_maxsize=per_host, pool_block=True, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def fetch_asset(session, url, timeout=REQUEST_TIMEOUT, cache=None):
+    """
+    下载一个资源
+    :param cache: 可选的 AssetCache
+    :return: Asset，请求失败或状态码不是 200 时返回 None
+    """
+    if cache:
+        return cache.fetch(session, url, timeout)
     try:
-        response = requests.get(resource_url)
+        response = session.get(url, timeout=timeout)
         if response.status_code == 200:
             content_type = response.headers.get('Content-Type')
-            if content_type:
-                # 提取文件类型
-                file_type = content_type.split('/')[-1]
-                return base64.b64encode(response.content).decode('utf-8'), file_type
-    except requests.exceptions.RequestException:
+            return Asset(url, response.content, content_type, declared_charset(content_type), None)
+        print(f"请求资源 {url} 失败: HTTP {response.status_code}")
+    except requests.exceptions.RequestException as e:
+        print(f"请求资源 {url} 时出错: {e}")
+    return None
+
+def fetch_assets(session, urls, max_workers=FETCH_WORKERS, timeout=REQUEST_TIMEOUT, cache=None):
+    """
+    并发下载资源，相同的 URL 只下载一次
+    :param session: create_session 创建的 Session
+    :param urls: 资源 URL 列表(可以重复)
+    :param max_workers: 同时下载的资源数
+    :param cache: 可选的 AssetCache
+    :return: {URL: Asset 或 None}
+    """
+    unique_urls = list(dict.fromkeys(urls))
+    if not unique_urls:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(unique_urls))) as executor:
+        assets = executor.map(lambda url: fetch_asset(session, url, timeout, cache), unique_urls)
+        return dict(zip(unique_urls, assets))
+
+def asset_text(asset):
+    """按 Content-Type 声明的字符集解码 CSS/JS；未声明时按 UTF-8，内容不是合法的 UTF-8 时按检测到的编码"""
+    if asset.encoding:
+        try:
+            return asset.content.decode(asset.encoding, errors='replace')
+        except LookupError:
+            pass
+    try:
+        return asset.content.decode('utf-8')
+    except UnicodeDecodeError:
+        guessed = requests.compat.chardet.detect(asset.content)['encoding']
+        return asset.content.decode(guessed or 'utf-8', errors='replace')
+
+def encode_base64(asset, cache=None):
+    """
+    :param cache: 可选的 AssetCache，同一内容的编码结果只计算一次
+    :return: (base64 字符串, 文件类型)，没有 Content-Type 时返回 (None, None)
+    """
+    if not asset or not asset.content_type:
         return None, None
-    return None, None
-
-# 处理所有的图片资源
-for img_tag in soup.find_all('img', {'src': True}):
-    img_url = img_tag.get('src')
-    if img_url:
-        full_img_url = urljoin(url, img_url)
-        img_base64, img_type = convert_to_base64(full_img_url)
-        if img_base64 and img_type:
-            img_tag['src'] = f"data:image/{img_type};base64,{img_base64}"
-
-# 处理所有的字体资源
-for font_tag in soup.find_all('link', {'rel': 'stylesheet', 'type': 'font/woff2'}):
-    font_url = font_tag.get('href')
-    if font_url:
-        full_font_url = urljoin(url, font_url)
-        font_base64, font_type = convert_to_base64(full_font_url)
-        if font_base64 and font_type:
-            font_tag['href'] = f"data:font/{font_type};base64,{font_base64}"
-
-# Step 6: 保存合并后的 HTML 文件
-output_file = "huggingface_complete_page.html"
-with open(output_file, "w", encoding="utf-8") as f:
-    f.write(soup.prettify())
-
-print(f"完整的 HTML 文件已保存为: {output_file}")
+    # 提取文件类型
+    file_type = asset.content_type.split(';')[0].split('/')[-1].strip()
+    if cache:
+        return cache.get_base64(asset), file_type
+    return base64.b64encode(asset.content).decode('utf-8'), file_type
+
+def convert_to_base64(resource_url, session=None, timeout=REQUEST_TIMEOUT, cache=None):
+    """
+    下载单个资源并转换为 base64
+    :return: (base64 字符串, 文件类型)，失败时返回 (None, None)
+    """
+    return encode_base64(fetch_asset(session or requests, resource_url, timeout, cache), cache)
+
+def collect_assets(soup, base_url):
+    """
+    收集页面中需要内联的资源
+    :param soup: BeautifulSoup 对象
+    :param base_url: 页面地址，用于解析相对路径
+    :return: (类型 css/js/img/font, 标签, 完整 URL) 列表，按文档顺序
+    """
+    assets = []
+    for tag in soup.find_all(['link', 'script', 'img']):
+        if tag.name == 'link' and 'stylesheet' in (tag.get('rel') or []) and tag.get('href'):
+            kind = 'font' if tag.get('type') == 'font/woff2' else 'css'
+            assets.append((kind, tag, urljoin(base_url, tag['href'])))
+        elif tag.name == 'script' and tag.get('src'):
+            assets.append(('js', tag, urljoin(base_url, tag['src'])))
+        elif tag.name == 'img' and tag.get('src') and not tag['src'].startswith('data:'):
+            assets.append(('img', tag, urljoin(base_url, tag['src'])))
+    # data: 等非 HTTP 地址不需要下载
+    return [asset for asset in assets if urlparse(asset[2]).scheme in ('http', 'https')]
+
+def inline_assets(soup, assets, fetched, cache=None):
+    """
+    把下载好的资源替换到页面中
+    :param soup: BeautifulSoup 对象
+    :param assets: collect_assets 的结果
+    :param fetched: fetch_assets 的结果
+    :param cache: 可选的 AssetCache，复用 base64 编码结果
+    :return: 成功内联的资源数
+    """
+    inlined = 0
+    for kind, tag, full_url in assets:
+        asset = fetched.get(full_url)
+        if asset is None:
+            continue
+        if kind == 'css':
+            # 替换 link 标签为内联样式
+            style_tag = soup.new_tag("style")
+            style_tag.string = asset_text(asset)
+            tag.insert_before(style_tag)
+            tag.decompose()
+        elif kind == 'js':
+            # 替换 script 标签为内联脚本，保留 type 等属性
+            script_tag = soup.new_tag("script", attrs={k: v for k, v in tag.attrs.items() if k != 'src'})
+            script_tag.string = asset_text(asset)
+            tag.insert_before(script_tag)
+            tag.decompose()
+        else:
+            data, file_type = encode_base64(asset, cache)
+            if not data:
+                continue
+            if kind == 'img':
+                tag['src'] = f"data:image/{file_type};base64,{data}"
+            else:
+                tag['href'] = f"data:font/{file_type};base64,{data}"
+        inlined += 1
+    return inlined
+
+def inline_page(url, output_file=None, html=None, session=None, max_workers=FETCH_WORKERS,
+                timeout=REQUEST_TIMEOUT, cache=None):
+    """
+    下载网页并把 CSS、JS、图片和字体内联成一个 HTML 文件
+    :param url: 网页地址(html 给出时只用于解析相对路径)
+    :param output_file: 保存的文件名，为 None 时不保存
+    :param html: 已获取的 HTML(例如浏览器渲染后的页面)，为 None 时下载 url
+    :param session: 可复用的 Session，为 None 时新建
+    :param max_workers: 同时下载的资源数
+    :param timeout: (连接超时, 读取超时) 秒
+    :param cache: 可选的 AssetCache，资源经过本地缓存获取
+    :return: 内联后的 HTML
+    """
+    start = time.perf_counter()
+    own_session = session is None
+    session = session or create_session()
+    try:
+        # Step 1: 下载网页 HTML 内容
+        if html is None:
+            response = session.get(url, timeout=timeout)
+            response.raise_for_status()
+            # 没有声明字符集时交给 BeautifulSoup 按 <meta charset> 检测，不使用 requests 默认的 ISO-8859-1
+            html = response.text if declared_charset(response.headers.get('Content-Type')) else response.content
+
+        # Step 2: 使用 BeautifulSoup 解析 HTML 内容
+        soup = BeautifulSoup(html, "html.parser")
+
+        # Step 3: 收集资源并并发下载，重复的 URL 只下载一次
+        assets = collect_assets(soup, url)
+        fetched = fetch_assets(session, [asset[2] for asset in assets], max_workers, timeout, cache)
+
+        # Step 4: 按文档顺序内联 CSS、JS、图片和字体
+        inlined = inline_assets(soup, assets, fetched, cache)
+    finally:
+        if own_session:
+            session.close()
+        if cache:
+            cache.save()
+
+    result = soup.prettify()
+    # Step 5: 保存合并后的 HTML 文件
+    if output_file:
+        with open(output_file, "w", encoding="utf-8") as f:
+            f.write(result)
+    print(f"{url}: 资源 {len(assets)} 个(去重后 {len(fetched)} 个)，内联 {inlined} 个，"
+          f"耗时 {time.perf_counter() - start:.2f} 秒")
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='下载网页并把 CSS、JS、图片和字体内联成一个 HTML 文件')
+    parser.add_argument('url', nargs='?', default="https://www.gamer520.com/", help='网页地址')
+    parser.add_argument('-o', '--output', default="huggingface_complete_page.html", help='保存的文件名')
+    parser.add_argument('-w', '--workers', type=int, default=FETCH_WORKERS, help='同时下载的资源数')
+    parser.add_argument('--cache-dir', default=ASSET_CACHE_DIR, help='资源缓存目录')
+    parser.add_argument('--no-cache', action='store_true', help='不使用资源缓存')
+    parser.add_argument('--prune-cache', action='store_true', help='完成后清理缓存中不再被引用的旧内容')
+    args = parser.parse_args(argv)
+
+    cache = None if args.no_cache else AssetCache(args.cache_dir)
+    inline_page(args.url, args.output, max_workers=args.workers, cache=cache)
+    if cache:
+        print(f"资源缓存: {cache.summary()}")
+        if args.prune_cache:
+            print(f"清理资源缓存中不再引用的对象 {cache.prune()} 个")
+    print(f"完整的 HTML 文件已保存为: {args.output}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,494 @@
+# 本地模拟 Twitter API v2，用于离线测试和性能基准
+# 支持 get_user / get_users_tweets / get_home_timeline / search_recent_tweets，
+# 分页、可配置延迟、按账号和端点计算的 x-rate-limit-* 响应头以及 429，
+# 以及过滤流规则和过滤流(用 publish_tweet/publish_reply 发布新推文，disconnect_streams 模拟断线)
+import re
+import json
+import time
+import queue
+import random
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+TWEET_ID_BASE = 1900000000000000000
+REPLY_ID_BASE = 1950000000000000000
+PUBLISHED_ID_BASE = 1960000000000000000  # 运行中发布的推文ID，大于所有预先生成的推文
+STREAM_KEEP_ALIVE = 1.0                  # 过滤流没有数据时发送空行的间隔(秒)
+MAX_QUERY_LENGTH = 512
+
+# 各端点每个窗口的请求上限(与官方 Basic 级别大致相当)
+DEFAULT_RATE_LIMITS = {
+    'get_user': 300,
+    'get_users': 300,
+    'get_me': 75,
+    'get_users_tweets': 1500,
+    'get_home_timeline': 180,
+    'search_recent_tweets': 450,
+    'get_rules': 450,
+    'update_rules': 450,
+    'filter': 50
+}
+
+ROUTES = [
+    (re.compile(r'^/2/users/by/username/(?P<username>\w+)$'), 'get_user'),
+    (re.compile(r'^/2/users/by$'), 'get_users'),
+    (re.compile(r'^/2/users/me$'), 'get_me'),
+    (re.compile(r'^/2/users/(?P<user_id>\d+)/tweets$'), 'get_users_tweets'),
+    (re.compile(r'^/2/users/(?P<user_id>\d+)/timelines/reverse_chronological$'), 'get_home_timeline'),
+    (re.compile(r'^/2/tweets/search/recent$'), 'search_recent_tweets'),
+    (re.compile(r'^/2/tweets/search/stream/rules$'), 'get_rules'),
+    (re.compile(r'^/2/tweets/search/stream$'), 'filter'),
+]
+POST_ROUTES = [
+    (re.compile(r'^/2/tweets/search/stream/rules$'), 'update_rules'),
+]
+
+def format_time(dt):
+    return dt.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+class MockTwitterAPI:
+    """模拟API的数据和状态：确定性生成的用户、推文和评论，以及速率限制计数"""
+
+    def __init__(self, users=10, tweets_per_user=300, max_replies=8, latency=0.0,
+                 rate_limits=None, window=900, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.window = window
+        self.error_rate = error_rate
+        self.rate_limits = dict(DEFAULT_RATE_LIMITS, **(rate_limits or {}))
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = {}         # 端点 -> 请求次数
+        self.windows = {}       # (账号, 端点) -> [窗口开始时间, 已用次数]
+        self.throttled = 0
+
+        self.users = {}         # 小写用户名 -> 用户数据
+        self.users_by_id = {}
+        self.timelines = {}     # 用户ID -> 按时间倒序的推文
+        self.conversations = {} # 会话ID -> 评论列表
+        self.stream_rules = {}  # 规则ID -> {'id', 'value', 'tag'}
+        self.subscribers = []   # 每个过滤流连接一个队列
+        self.stream_generation = 0
+        self._next_rule_id = 1
+        self._next_published_id = PUBLISHED_ID_BASE
+        self._generate(users, tweets_per_user, max_replies)
+
+    def _generate(self, user_count, tweets_per_user, max_replies):
+        now = datetime.now(timezone.utc)
+        reply_id = REPLY_ID_BASE
+        for index in range(user_count):
+            user_id = str(1000 + index)
+            user = {'id': user_id, 'name': f'User {index}', 'username': f'user{index}'}
+            self.users[user['username']] = user
+            self.users_by_id[user_id] = user
+
+            tweets = []
+            for i in range(tweets_per_user):
+                tweet_id = str(TWEET_ID_BASE + index * 10_000_000 + i)
+                created_at = now - timedelta(minutes=(tweets_per_user - i) * 10)
+                # 大部分推文没有评论，少数推文评论较多
+                reply_count = 0 if self.random.random() < 0.6 else self.random.randint(1, max_replies)
+                replies = []
+                for j in range(reply_count):
+                    reply_id += 1
+                    # 部分评论回复的是之前的评论，形成嵌套结构
+                    parent = replies[self.random.randrange(len(replies))] if replies and self.random.random() < 0.3 else None
+                    replies.append({
+                        'id': str(reply_id),
+                        'text': f'reply {j} to {tweet_id}',
+                        'author_id': str(5000 + self.random.randrange(1000)),
+                        'created_at': format_time(created_at + timedelta(minutes=j + 1)),
+                        'conversation_id': tweet_id,
+                        'in_reply_to_user_id': parent['author_id'] if parent else user_id,
+                        'referenced_tweets': [{'type': 'replied_to', 'id': parent['id'] if parent else tweet_id}],
+                        'public_metrics': {'retweet_count': 0, 'reply_count': 0, 'like_count': 0, 'quote_count': 0},
+                        'edit_history_tweet_ids': [str(reply_id)]
+                    })
+                self.conversations[tweet_id] = replies
+                tweets.append({
+                    'id': tweet_id,
+                    'text': f'tweet {i} from {user["username"]}',
+                    'author_id': user_id,
+                    'created_at': format_time(created_at),
+                    'conversation_id': tweet_id,
+                    'public_metrics': {
+                        'retweet_count': self.random.randrange(5),
+                        'reply_count': reply_count,
+                        'like_count': self.random.randrange(50),
+                        'quote_count': 0
+                    },
+                    'edit_history_tweet_ids': [tweet_id]
+                })
+            tweets.reverse()
+            self.timelines[user_id] = tweets
+
+        # 首页时间线：所有用户的推文按时间倒序合并
+        self.home_timeline = sorted((tweet for tweets in self.timelines.values() for tweet in tweets),
+                                    key=lambda tweet: tweet['created_at'], reverse=True)
+
+    def _published_id(self):
+        with self.lock:
+            self._next_published_id += 1
+            return str(self._next_published_id)
+
+    def publish_tweet(self, username, text):
+        """
+        用户发布一条新推文：加入时间线，并推送给匹配规则的过滤流
+        :param username: 用户名
+        :param text: 内容
+        :return: 推文数据
+        """
+        user = self.users[username.lower()]
+        tweet_id = self._published_id()
+        tweet = {
+            'id': tweet_id,
+            'text': text,
+            'author_id': user['id'],
+            'created_at': format_time(datetime.now(timezone.utc)),
+            'conversation_id': tweet_id,
+            'public_metrics': {'retweet_count': 0, 'reply_count': 0, 'like_count': 0, 'quote_count': 0},
+            'edit_history_tweet_ids': [tweet_id]
+        }
+        with self.lock:
+            self.timelines[user['id']].insert(0, tweet)
+            self.home_timeline.insert(0, tweet)
+            self.conversations[tweet_id] = []
+        self._push(tweet)
+        return tweet
+
+    def publish_reply(self, conversation_id, text, author_id='5000'):
+        """
+        发布一条对会话根推文的评论，并推送给匹配规则的过滤流
+        :param conversation_id: 会话ID(原推文ID)
+        :param text: 内容
+        :param author_id: 评论者ID
+        :return: 评论数据
+        """
+        conversation_id = str(conversation_id)
+        reply_id = self._published_id()
+        reply = {
+            'id': reply_id,
+            'text': text,
+            'author_id': str(author_id),
+            'created_at': format_time(datetime.now(timezone.utc)),
+            'conversation_id': conversation_id,
+            'referenced_tweets': [{'type': 'replied_to', 'id': conversation_id}],
+            'public_metrics': {'retweet_count': 0, 'reply_count': 0, 'like_count': 0, 'quote_count': 0},
+            'edit_history_tweet_ids': [reply_id]
+        }
+        with self.lock:
+            self.conversations.setdefault(conversation_id, []).insert(0, reply)
+        self._push(reply)
+        return reply
+
+    def _rule_matches(self, rule, tweet):
+        """只支持 from:用户名 和 conversation_id:ID 用 OR 组合的规则"""
+        author = self.users_by_id.get(tweet.get('author_id'), {}).get('username', '').lower()
+        for term in rule['value'].split(' OR '):
+            kind, _, value = term.strip().strip('()').partition(':')
+            if kind == 'from' and value.lower() == author:
+                return True
+            if kind == 'conversation_id' and value == tweet['conversation_id']:
+                return True
+        return False
+
+    def _push(self, tweet):
+        with self.lock:
+            matched = [{'id': rule['id'], 'tag': rule.get('tag', '')}
+                       for rule in self.stream_rules.values() if self._rule_matches(rule, tweet)]
+            subscribers = list(self.subscribers) if matched else []
+        for subscriber in subscribers:
+            subscriber.put((tweet, matched))
+
+    def disconnect_streams(self):
+        """断开所有过滤流连接，用于测试重连"""
+        with self.lock:
+            self.stream_generation += 1
+            for subscriber in self.subscribers:
+                subscriber.put(None)
+
+    def update_rules(self, body):
+        """
+        添加或删除过滤流规则
+        :param body: {'add': [...]} 或 {'delete': {'ids': [...]}}
+        :return: (HTTP状态码, 响应体)
+        """
+        with self.lock:
+            if 'add' in body:
+                created = []
+                for rule in body['add']:
+                    if len(rule.get('value', '')) > MAX_QUERY_LENGTH:
+                        return 400, {'title': 'Invalid Request', 'detail': f'rule is longer than {MAX_QUERY_LENGTH} characters'}
+                    rule_id = str(self._next_rule_id)
+                    self._next_rule_id += 1
+                    self.stream_rules[rule_id] = dict(rule, id=rule_id)
+                    created.append(self.stream_rules[rule_id])
+                return 201, {'data': created, 'meta': {'summary': {'created': len(created), 'not_created': 0}}}
+            if 'delete' in body:
+                ids = [rule_id for rule_id in body['delete'].get('ids', []) if rule_id in self.stream_rules]
+                for rule_id in ids:
+                    del self.stream_rules[rule_id]
+                return 200, {'meta': {'summary': {'deleted': len(ids), 'not_deleted': 0}}}
+        return 400, {'title': 'Invalid Request', 'detail': 'add or delete is required'}
+
+    @staticmethod
+    def _select_fields(item, fields):
+        """只返回请求的字段，与官方API一致(id/text/edit_history_tweet_ids 总是返回)"""
+        keep = {'id', 'text', 'edit_history_tweet_ids', 'name', 'username'} | set(fields)
+        return {key: value for key, value in item.items() if key in keep}
+
+    def check_rate_limit(self, account, endpoint):
+        """
+        计算速率限制
+        :return: (是否允许, 响应头)
+        """
+        now = time.time()
+        limit = self.rate_limits[endpoint]
+        with self.lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+            window = self.windows.setdefault((account, endpoint), [now, 0])
+            if now - window[0] >= self.window:
+                window[0], window[1] = now, 0
+            reset = int(window[0] + self.window)
+            allowed = window[1] < limit and self.random.random() >= self.error_rate
+            if allowed:
+                window[1] += 1
+            else:
+                self.throttled += 1
+            headers = {
+                'x-rate-limit-limit': str(limit),
+                'x-rate-limit-remaining': str(max(0, limit - window[1])),
+                'x-rate-limit-reset': str(reset)
+            }
+        return allowed, headers
+
+    def _paginate(self, items, query, token_param, fields):
+        try:
+            max_results = int(query.get('max_results', 10))
+        except ValueError:
+            return 400, {'title': 'Invalid Request', 'detail': 'max_results must be an integer'}
+        if not 5 <= max_results <= 100:
+            return 400, {'title': 'Invalid Request', 'detail': 'max_results must be between 5 and 100'}
+
+        offset = int(query.get(token_param, 't0')[1:] or 0)
+        page = items[offset:offset + max_results]
+        meta = {'result_count': len(page)}
+        if page:
+            meta['newest_id'] = page[0]['id']
+            meta['oldest_id'] = page[-1]['id']
+        if offset + max_results < len(items):
+            meta['next_token'] = f't{offset + max_results}'
+        body = {'meta': meta}
+        if page:
+            body['data'] = [self._select_fields(item, fields) for item in page]
+        return 200, body
+
+    def handle(self, endpoint, params, query):
+        """
+        处理一次API请求
+        :return: (HTTP状态码, 响应体)
+        """
+        fields = query.get('tweet.fields', '').split(',') if query.get('tweet.fields') else []
+
+        if endpoint == 'get_user':
+            user = self.users.get(params['username'].lower())
+            if not user:
+                return 200, {'errors': [{'title': 'Not Found Error', 'detail': f"Could not find user with username: [{params['username']}]."}]}
+            return 200, {'data': user}
+
+        if endpoint == 'get_users':
+            names = [name for name in query.get('usernames', '').split(',') if name]
+            if not 1 <= len(names) <= 100:
+                return 400, {'title': 'Invalid Request', 'detail': 'usernames must contain 1-100 names'}
+            found = [self.users[name.lower()] for name in names if name.lower() in self.users]
+            missing = [{'value': name, 'title': 'Not Found Error'} for name in names if name.lower() not in self.users]
+            body = {'data': found} if found else {}
+            if missing:
+                body['errors'] = missing
+            return 200, body
+
+        if endpoint == 'get_me':
+            return 200, {'data': next(iter(self.users_by_id.values()))}
+
+        if endpoint in ('get_users_tweets', 'get_home_timeline'):
+            if endpoint == 'get_users_tweets':
+                items = self.timelines.get(params['user_id'], [])
+            else:
+                items = self.home_timeline
+            if query.get('since_id'):
+                items = [tweet for tweet in items if int(tweet['id']) > int(query['since_id'])]
+            return self._paginate(items, query, 'pagination_token', fields)
+
+        if endpoint == 'search_recent_tweets':
+            search = query.get('query', '')
+            if len(search) > MAX_QUERY_LENGTH:
+                return 400, {'title': 'Invalid Request', 'detail': f'query is longer than {MAX_QUERY_LENGTH} characters'}
+            items = []
+            for conversation_id in re.findall(r'conversation_id:(\d+)', search):
+                items.extend(self.conversations.get(conversation_id, []))
+            items.sort(key=lambda reply: int(reply['id']), reverse=True)
+            return self._paginate(items, query, 'next_token', fields)
+
+        if endpoint == 'get_rules':
+            rules = list(self.stream_rules.values())
+            body = {'meta': {'result_count': len(rules)}}
+            if rules:
+                body['data'] = rules
+            return 200, body
+
+        return 404, {'title': 'Not Found'}
+
+def make_handler(api):
+    class MockTwitterHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _account(self):
+            auth = self.headers.get('Authorization', '')
+            match = re.search(r'oauth_consumer_key="([^"]*)"', auth)
+            return match.group(1) if match else auth
+
+        def _send(self, status, body, headers=None):
+            payload = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _route(self, routes):
+            """
+            匹配路由并计算速率限制，失败时已发送错误响应
+            :return: (端点, 路由匹配结果, 查询参数, 速率限制响应头)，失败时全为 None
+            """
+            url = urlparse(self.path)
+            query = {key: values[0] for key, values in parse_qs(url.query).items()}
+            for pattern, endpoint in routes:
+                match = pattern.match(url.path)
+                if match:
+                    break
+            else:
+                self._send(404, {'title': 'Not Found'})
+                return None, None, None, None
+
+            if api.latency:
+                time.sleep(api.latency)
+            allowed, headers = api.check_rate_limit(self._account(), endpoint)
+            if not allowed:
+                self._send(429, {'title': 'Too Many Requests', 'detail': 'Too Many Requests'}, headers)
+                return None, None, None, None
+            return endpoint, match, query, headers
+
+        def do_GET(self):
+            endpoint, match, query, headers = self._route(ROUTES)
+            if endpoint == 'filter':
+                self._stream(query)
+            elif endpoint:
+                status, body = api.handle(endpoint, match.groupdict(), query)
+                self._send(status, body, headers)
+
+        def do_POST(self):
+            endpoint, match, query, headers = self._route(POST_ROUTES)
+            if endpoint:
+                length = int(self.headers.get('Content-Length', 0))
+                body = json.loads(self.rfile.read(length) or b'{}')
+                status, body = api.update_rules(body)
+                self._send(status, body, headers)
+
+        def _write_chunk(self, data):
+            self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+            self.wfile.flush()
+
+        def _stream(self, query):
+            """按行推送匹配规则的新推文(分块传输，每行一个块)，空闲时发送空行保活，断线或写入失败时结束"""
+            fields = query.get('tweet.fields', '').split(',') if query.get('tweet.fields') else []
+            subscriber = queue.Queue()
+            with api.lock:
+                api.subscribers.append(subscriber)
+                generation = api.stream_generation
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.close_connection = True
+            try:
+                while api.stream_generation == generation:
+                    try:
+                        item = subscriber.get(timeout=STREAM_KEEP_ALIVE)
+                    except queue.Empty:
+                        self._write_chunk(b'\r\n')
+                        continue
+                    if item is None:
+                        break
+                    tweet, matched = item
+                    line = {'data': api._select_fields(tweet, fields), 'matching_rules': matched}
+                    self._write_chunk(json.dumps(line).encode('utf-8') + b'\r\n')
+                self._write_chunk(b'')
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                with api.lock:
+                    api.subscribers.remove(subscriber)
+
+    return MockTwitterHandler
+
+class MockTwitterServer:
+    """在后台线程运行的模拟API服务器，可用作上下文管理器"""
+
+    def __init__(self, api=None, host='127.0.0.1', port=0):
+        self.api = api or MockTwitterAPI()
+        self.httpd = ThreadingHTTPServer((host, port), make_handler(self.api))
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='mock-twitter-api', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.api.disconnect_streams()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟 Twitter API v2')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--users', type=int, default=10, help='生成的用户数')
+    parser.add_argument('--tweets-per-user', type=int, default=300)
+    parser.add_argument('--latency', type=float, default=0.05, help='每个请求的延迟(秒)')
+    parser.add_argument('--window', type=int, default=900, help='速率限制窗口(秒)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='随机返回 429 的比例')
+    args = parser.parse_args()
+
+    api = MockTwitterAPI(users=args.users, tweets_per_user=args.tweets_per_user, latency=args.latency,
+                         window=args.window, error_rate=args.error_rate)
+    server = MockTwitterServer(api, args.host, args.port)
+    print(f"模拟 Twitter API 已启动: {server.base_url} (用户 user0 ~ user{args.users - 1})")
+    print(f"在 config.json 中设置 \"api_base_url\": \"{server.base_url}\" 即可让爬虫使用模拟API")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+import requests
+from selenium.common.exceptions import WebDriverException
+
+from asset_cache import AssetCache
+from dong_jiexi import BrowserPool, snapshot_urls
+
+PAGES = {
+    '/index.html': ('text/html; charset=utf-8',
+                    '<html><head><link rel="stylesheet" href="/style.css"><script src="/app.js"></script></head>'
+                    '<body><h1>首页</h1><img src="/logo.png"></body></html>'.encode('utf-8')),
+    '/about.html': ('text/html; charset=utf-8',
+                    '<html><head><link rel="stylesheet" href="/style.css"></head><body>关于</body></html>'.encode('utf-8')),
+    '/style.css': ('text/css', 'h1::before { content: "标题"; }'.encode('utf-8')),
+    '/app.js': ('application/javascript', b'console.log("ok");'),
+    '/logo.png': ('image/png', b'\x89PNG\r\n\x1a\nfake'),
+}
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path not in PAGES:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        content_type, body = PAGES[self.path]
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class FakeDriver:
+    """用 requests 代替 Chrome 的 WebDriver，页面不执行脚本"""
+
+    def __init__(self, started):
+        self.page_source = ''
+        self.current_url = None
+        self.closed = False
+        started.append(self)
+
+    def get(self, url):
+        if url.endswith('/crash'):
+            raise WebDriverException('浏览器崩溃')
+        response = requests.get(url, timeout=5)
+        self.page_source, self.current_url = response.text, response.url
+
+    def execute_script(self, script):
+        return 'complete' if 'readyState' in script else 1
+
+    def quit(self):
+        self.closed = True
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{httpd.server_port}'
+    httpd.shutdown()
+    httpd.server_close()
+
+def test_snapshot_urls_inlines_rendered_pages(server, tmp_path):
+    started = []
+    urls = [f'{server}/index.html', f'{server}/about.html', f'{server}/crash']
+    cache = AssetCache(str(tmp_path / 'cache'))
+    with BrowserPool(2, lambda: FakeDriver(started)) as pool:
+        results = snapshot_urls(urls, str(tmp_path / 'out'), pool, cache)
+
+    assert results[urls[2]] is None
+    with open(results[urls[0]], encoding='utf-8') as f:
+        html = f.read()
+    assert '标题' in html and 'console.log' in html and 'data:image/png;base64,' in html
+    assert 'style.css' not in html
+    with open(results[urls[1]], encoding='utf-8') as f:
+        assert '关于' in f.read()
+    # 崩溃的浏览器被替换，关闭池后所有浏览器都已退出
+    assert len(started) == 3
+    assert all(driver.closed for driver in started)
+    assert cache.stats['failed'] == 0 and len(cache.entries) == 3
+
+def test_browser_pool_quits_started_drivers_when_startup_fails():
+    started = []
+    lock = threading.Lock()
+
+    def factory():
+        with lock:
+            if len(started) == 2:
+                raise WebDriverException('启动失败')
+            return FakeDriver(started)
+
+    with pytest.raises(WebDriverException):
+        BrowserPool(3, factory)
+    assert len(started) == 2
+    assert all(driver.closed for driver in started)
@@ -0,0 +1,53 @@
+import os
+import asyncio
+import shutil
+
+import pytest
+
+from mock_twitter_api import MockTwitterAPI, MockTwitterServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    # twitter_scraper 从当前目录读取 config.json，日志、缓存和导出文件也写在当前目录
+    shutil.copy(os.path.join(ROOT, 'config.json'), tmp_path)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+@pytest.fixture
+def server():
+    with MockTwitterServer(MockTwitterAPI(users=2, tweets_per_user=150, latency=0)) as server:
+        yield server
+
+def test_scrape_users_async_fetches_timelines_and_replies(workdir, server):
+    from benchmark import make_accounts
+    from twitter_async import scrape_users_async
+
+    results = asyncio.run(scrape_users_async(['user0', 'user1', 'nobody'], accounts=make_accounts(2),
+                                             api_base_url=server.base_url))
+
+    assert results['nobody'] is None
+    for username in ('user0', 'user1'):
+        timeline = server.api.timelines[server.api.users[username]['id']]
+        tweets = results[username]
+        assert [tweet.id for tweet in tweets] == [int(tweet['id']) for tweet in timeline]
+        for tweet in tweets:
+            expected = server.api.conversations[str(tweet.id)]
+            assert sorted(reply.id for reply in tweet.replies) == sorted(int(reply['id']) for reply in expected)
+
+def test_run_batch_async_exports_and_stores(workdir, server):
+    from benchmark import make_accounts
+    from tweet_store import TweetStore
+    from twitter_async import run_batch_async
+
+    store = TweetStore(str(workdir / 'tweets.db'))
+    try:
+        results = asyncio.run(run_batch_async(['user0', 'nobody'], 'jsonl', str(workdir / 'out'), store=store,
+                                              accounts=make_accounts(1), api_base_url=server.base_url))
+        assert results['nobody'] is None
+        with open(results['user0'], encoding='utf-8') as f:
+            assert sum(1 for _ in f) == 150
+        assert store.conn.execute('SELECT COUNT(*) FROM tweets').fetchone()[0] == 150
+    finally:
+        store.close()
@@ -0,0 +1,271 @@
+# 本地全文检索：在 SQLite 推文库中维护 FTS5 倒排索引，按关键词、作者和时间范围查询推文和评论，不调用API
+# FTS5 自带的 unicode61 分词器不切分中日韩文字，写入索引前把连续的中日韩文字拆成相邻二字组，
+# 单个字另存一列，这样任意长度的中文关键词都能命中
+import re
+import sys
+import time
+import argparse
+
+from twitter_scraper import logger, CONFIG
+
+SEARCH_DEFAULT_LIMIT = CONFIG.get('search_default_limit', 50)   # 默认返回的结果数
+SEARCH_REBUILD_BATCH = 5000                                      # 重建索引时每批读取的行数
+
+# 中日韩文字(假名、汉字、谚文)
+CJK_RUN = re.compile('[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]+')
+
+# 推文和评论各用一张索引表：作者自己的串推同时出现在推文表和评论表中且ID相同，rowid 只能在各自的表内唯一。
+# terms: 拉丁文字的词和中日韩二字组；chars: 中日韩单字，用于单字查询；author: 作者ID，按作者过滤时直接与关键词求交集。
+# 其余列不建索引，只用于过滤和返回结果，rowid 为推文或评论ID
+SEARCH_TABLES = {'tweet': 'search_tweets', 'reply': 'search_replies'}
+LEGACY_SEARCH_TABLE = 'search_index'   # 旧版本推文和评论共用的索引表，打开旧库时删除并重建
+
+SEARCH_SCHEMA = ''.join(f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5(
+    terms,
+    chars,
+    author,
+    tweet_id UNINDEXED,
+    created_at UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+""" for table in SEARCH_TABLES.values())
+
+def split_cjk(text):
+    """
+    把文本切分成中日韩文字段和其他文字段
+    :param text: 原始文本
+    :return: (是否中日韩文字, 文字段) 的列表
+    """
+    parts = []
+    pos = 0
+    for match in CJK_RUN.finditer(text):
+        if match.start() > pos:
+            parts.append((False, text[pos:match.start()]))
+        parts.append((True, match.group()))
+        pos = match.end()
+    if pos < len(text):
+        parts.append((False, text[pos:]))
+    return parts
+
+def cjk_bigrams(run):
+    """把一段连续的中日韩文字拆成相邻二字组，只有一个字时原样返回"""
+    if len(run) == 1:
+        return run
+    return ' '.join(run[i:i + 2] for i in range(len(run) - 1))
+
+def index_terms(text):
+    """
+    生成写入索引的两列内容
+    :param text: 推文或评论文本
+    :return: (terms, chars)
+    """
+    terms = []
+    chars = []
+    for is_cjk, part in split_cjk(text or ''):
+        if is_cjk:
+            terms.append(cjk_bigrams(part))
+            chars.append(' '.join(part))
+        else:
+            terms.append(part)
+    return ' '.join(terms), ' '.join(chars)
+
+def _quote(value):
+    return '"' + value.replace('"', '""') + '"'
+
+def build_match_query(keywords):
+    """
+    把关键词转换成 FTS5 查询，多个关键词之间为 AND，同一个关键词内的文字必须连续出现
+    :param keywords: 用空格分隔的关键词
+    :return: MATCH 表达式，没有可检索的内容时返回 None
+    """
+    clauses = []
+    for keyword in keywords.split():
+        terms = []
+        for is_cjk, part in split_cjk(keyword):
+            if not is_cjk:
+                terms.append(part)
+            elif len(part) > 1:
+                terms.append(cjk_bigrams(part))
+            else:
+                clauses.append(f'chars : {_quote(part)}')
+        # 去掉标点后为空的部分(例如单独的 # 或 @)不参与查询
+        phrase = ' '.join(terms)
+        if re.search(r'\w', phrase):
+            clauses.append(f'terms : {_quote(phrase)}')
+    return ' AND '.join(clauses) if clauses else None
+
+def index_documents(conn, docs):
+    """
+    增量更新索引：只重写新增或有变化的文档，调用方负责事务
+    :param conn: sqlite3 连接
+    :param docs: (ID, 类型 tweet/reply, 所属推文ID, 作者ID, 发布时间, 文本) 列表
+    :return: 重写的文档数
+    """
+    count = 0
+    for kind, table in SEARCH_TABLES.items():
+        kind_docs = [doc for doc in docs if doc[1] == kind]
+        if kind_docs:
+            count += _index_table(conn, table, kind_docs)
+    return count
+
+def _index_table(conn, table, docs):
+    placeholders = ','.join('?' * len(docs))
+    existing = {row[0]: row[1:] for row in conn.execute(
+        f'SELECT rowid, terms, author, created_at FROM {table} WHERE rowid IN ({placeholders})',
+        [doc[0] for doc in docs]
+    )}
+
+    changed = {}
+    for doc_id, _, tweet_id, author_id, created_at, text in docs:
+        terms, chars = index_terms(text)
+        # 与库中的 COALESCE 写入一致：新数据缺少作者或时间时保留原值
+        previous = existing.get(doc_id, (None, '', None))
+        author = str(author_id) if author_id is not None else previous[1]
+        created_at = created_at or previous[2]
+        if existing.get(doc_id) != (terms, author, created_at):
+            changed[doc_id] = (doc_id, terms, chars, author, tweet_id, created_at)
+    if changed:
+        conn.executemany(f'DELETE FROM {table} WHERE rowid = ?',
+                         [(doc_id,) for doc_id in changed if doc_id in existing])
+        conn.executemany(INSERT_DOCUMENT.format(table=table), list(changed.values()))
+    return len(changed)
+
+INSERT_DOCUMENT = """
+INSERT INTO {table} (rowid, terms, chars, author, tweet_id, created_at) VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+# 重建索引时每张索引表读取的文档：(ID, 所属推文ID, 作者ID, 发布时间, 文本)
+REBUILD_QUERIES = {
+    'tweet': "SELECT id, id, author_id, created_at, text FROM tweets",
+    'reply': "SELECT id, tweet_id, author_id, created_at, text FROM replies"
+}
+
+def rebuild_index(conn, batch_size=SEARCH_REBUILD_BATCH):
+    """
+    按库中已有的推文和评论重建索引
+    :param conn: sqlite3 连接
+    :param batch_size: 每个事务写入的行数
+    :return: 索引的文档数
+    """
+    count = 0
+    for kind, table in SEARCH_TABLES.items():
+        with conn:
+            conn.execute(f'DELETE FROM {table}')
+        cursor = conn.execute(REBUILD_QUERIES[kind])
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            with conn:
+                conn.executemany(INSERT_DOCUMENT.format(table=table), [
+                    (row[0],) + index_terms(row[4]) + (str(row[2]) if row[2] is not None else '', row[1], row[3])
+                    for row in rows
+                ])
+            count += len(rows)
+        with conn:
+            conn.execute(f"INSERT INTO {table} ({table}) VALUES ('optimize')")
+    logger.info(f"全文索引重建完成，共 {count} 条")
+    return count
+
+def search(conn, keywords, author_id=None, since=None, until=None, kind=None, order='recent',
+           limit=SEARCH_DEFAULT_LIMIT):
+    """
+    按关键词检索推文和评论
+    :param conn: sqlite3 连接
+    :param keywords: 用空格分隔的关键词
+    :param author_id: 作者ID
+    :param since: 起始时间(包含)，ISO 日期或时间字符串
+    :param until: 结束时间(不包含)
+    :param kind: 只查 tweet 或 reply，默认都查
+    :param order: recent 按ID倒序(推文ID随发布时间递增)，relevance 按相关度
+    :param limit: 最多返回的结果数
+    :return: 结果字典列表，包含 id、kind、tweet_id、author_id、created_at、text
+    """
+    match = build_match_query(keywords)
+    if match is None:
+        return []
+    if author_id is not None:
+        match = f'author : {_quote(str(int(author_id)))} AND ({match})'
+
+    filters = []
+    params = [match]
+    if since:
+        filters.append('created_at >= ?')
+        params.append(since)
+    if until:
+        filters.append('created_at < ?')
+        params.append(until)
+    relevance = order == 'relevance'
+
+    # 每张索引表各取 limit 条再合并；按 rowid 倒序时 FTS5 边扫描边过滤，取够 limit 条即停止
+    hits = []
+    for hit_kind, table in SEARCH_TABLES.items():
+        if kind and kind != hit_kind:
+            continue
+        conditions = ' AND '.join([f'{table} MATCH ?'] + filters)
+        hits.extend((hit_kind,) + row for row in conn.execute(
+            f"SELECT rowid, tweet_id, author, created_at, {'rank' if relevance else '0'} FROM {table} "
+            f"WHERE {conditions} ORDER BY {'rank' if relevance else 'rowid DESC'} LIMIT ?", params + [limit]
+        ))
+    # rank 越小越相关
+    hits.sort(key=(lambda hit: hit[5]) if relevance else (lambda hit: -hit[1]))
+    hits = hits[:limit]
+
+    texts = {}
+    for hit_kind, table in (('tweet', 'tweets'), ('reply', 'replies')):
+        ids = [hit[1] for hit in hits if hit[0] == hit_kind]
+        if ids:
+            placeholders = ','.join('?' * len(ids))
+            texts.update({(hit_kind, row[0]): row[1] for row in conn.execute(
+                f'SELECT id, text FROM {table} WHERE id IN ({placeholders})', ids)})
+    return [{
+        'id': hit[1],
+        'kind': hit[0],
+        'tweet_id': hit[2],
+        'author_id': int(hit[3]) if hit[3] else None,
+        'created_at': hit[4] or '',
+        'text': texts.get((hit[0], hit[1]), '')
+    } for hit in hits]
+
+def main(argv=None):
+    """命令行：在本地推文库中检索"""
+    parser = argparse.ArgumentParser(description='在本地 SQLite 推文库中全文检索推文和评论，不调用API')
+    parser.add_argument('keywords', nargs='?', default='', help='关键词，多个关键词用空格分隔且需同时出现')
+    parser.add_argument('--db', default=CONFIG.get('store_file', 'tweets.db'), help='数据库文件')
+    parser.add_argument('-u', '--user', help='只查该用户(需曾经抓取过)')
+    parser.add_argument('--since', help='起始时间，例如 2025-03-01')
+    parser.add_argument('--until', help='结束时间(不包含)')
+    parser.add_argument('--kind', choices=['tweet', 'reply'], help='只查推文或评论')
+    parser.add_argument('--order', choices=['recent', 'relevance'], default='recent', help='结果排序')
+    parser.add_argument('-n', '--limit', type=int, default=SEARCH_DEFAULT_LIMIT, help='最多返回的结果数')
+    parser.add_argument('--rebuild', action='store_true', help='按库中数据重建索引')
+    args = parser.parse_args(argv)
+
+    from tweet_store import TweetStore
+    with TweetStore(args.db) as store:
+        if args.rebuild:
+            store.rebuild_search_index()
+            if not args.keywords:
+                return 0
+
+        author_id = None
+        if args.user:
+            author_id = store.get_user_id(args.user.lstrip('@'))
+            if author_id is None:
+                logger.error(f"库中没有用户 {args.user} 的记录")
+                return 1
+
+        start = time.perf_counter()
+        results = store.search(args.keywords, author_id=author_id, since=args.since, until=args.until,
+                               kind=args.kind, order=args.order, limit=args.limit)
+        elapsed = (time.perf_counter() - start) * 1000
+        for result in results:
+            text = ' '.join(result['text'].split())
+            print(f"{result['created_at'][:19]}  {result['kind']:<5} {result['id']}  "
+                  f"作者 {result['author_id']}  {text[:120]}")
+        print(f"\n共 {len(results)} 条结果，耗时 {elapsed:.1f} 毫秒")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,380 @@
+# SQLite 推文存储：按ID去重写入推文和评论，导出变成对本地库的查询而不是重新抓取
+import sys
+import sqlite3
+import argparse
+import threading
+from datetime import datetime, timezone
+
+from twitter_scraper import logger, CONFIG, EXPORT_FORMATS, TweetRecord, ConversationIndex, open_export_writer
+from tweet_search import (
+    SEARCH_SCHEMA, SEARCH_TABLES, LEGACY_SEARCH_TABLE, SEARCH_DEFAULT_LIMIT, index_documents, rebuild_index, search
+)
+
+STORE_FILE = CONFIG.get('store_file', 'tweets.db')        # SQLite 数据库文件
+STORE_BATCH_SIZE = CONFIG.get('store_batch_size', 500)   # 每个事务写入的行数
+STORE_BUSY_TIMEOUT = 30  # 多个进程同时写入时等待写锁的秒数
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    username TEXT NOT NULL,
+    updated_at TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_users_username ON users(username COLLATE NOCASE);
+
+CREATE TABLE IF NOT EXISTS tweets (
+    id INTEGER PRIMARY KEY,
+    author_id INTEGER,
+    conversation_id INTEGER,
+    created_at TEXT,
+    text TEXT NOT NULL,
+    reply_count INTEGER NOT NULL DEFAULT 0,
+    source TEXT,
+    fetched_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_tweets_author ON tweets(author_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_tweets_conversation ON tweets(conversation_id);
+CREATE INDEX IF NOT EXISTS idx_tweets_created ON tweets(created_at);
+
+CREATE TABLE IF NOT EXISTS replies (
+    id INTEGER PRIMARY KEY,
+    tweet_id INTEGER NOT NULL,
+    conversation_id INTEGER,
+    author_id INTEGER,
+    created_at TEXT,
+    text TEXT NOT NULL,
+    fetched_at TEXT,
+    in_reply_to_id INTEGER,
+    in_reply_to_user_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_replies_tweet ON replies(tweet_id);
+CREATE INDEX IF NOT EXISTS idx_replies_conversation ON replies(conversation_id);
+CREATE INDEX IF NOT EXISTS idx_replies_author ON replies(author_id);
+CREATE INDEX IF NOT EXISTS idx_replies_created ON replies(created_at);
+"""
+
+UPSERT_TWEET = """
+INSERT INTO tweets (id, author_id, conversation_id, created_at, text, reply_count, source, fetched_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(id) DO UPDATE SET
+    author_id = COALESCE(excluded.author_id, tweets.author_id),
+    conversation_id = COALESCE(excluded.conversation_id, tweets.conversation_id),
+    created_at = COALESCE(excluded.created_at, tweets.created_at),
+    text = excluded.text,
+    reply_count = MAX(excluded.reply_count, tweets.reply_count),
+    source = COALESCE(tweets.source, excluded.source),
+    fetched_at = excluded.fetched_at
+"""
+
+UPSERT_REPLY = """
+INSERT INTO replies (id, tweet_id, conversation_id, author_id, created_at, text, fetched_at, in_reply_to_id,
+                     in_reply_to_user_id)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(id) DO UPDATE SET
+    text = excluded.text,
+    fetched_at = excluded.fetched_at,
+    in_reply_to_id = COALESCE(excluded.in_reply_to_id, replies.in_reply_to_id),
+    in_reply_to_user_id = COALESCE(excluded.in_reply_to_user_id, replies.in_reply_to_user_id)
+"""
+
+# 旧库补充的列：(表, 列, 类型)
+MIGRATIONS = (
+    ('replies', 'in_reply_to_id', 'INTEGER'),
+    ('replies', 'in_reply_to_user_id', 'INTEGER'),
+)
+
+def format_api_time(value):
+    """把 datetime 转成 API 使用的时间格式(可按字典序排序)"""
+    if not value:
+        return None
+    return value.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+def parse_api_time(value):
+    """把库中的 API 时间字符串转回 datetime"""
+    return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.000Z').replace(tzinfo=timezone.utc) if value else None
+
+class TweetStore:
+    """SQLite 推文存储，同时实现导出写入器的 write_page/close 接口，可直接接入流式导出"""
+
+    def __init__(self, path=STORE_FILE, source=None, batch_size=STORE_BATCH_SIZE):
+        self.path = path
+        self.source = source
+        self.batch_size = batch_size
+        self.count = 0
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=STORE_BUSY_TIMEOUT, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+        self._migrate()
+        tables = {row[0] for row in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        has_index = all(table in tables for table in SEARCH_TABLES.values())
+        self.conn.executescript(SEARCH_SCHEMA)
+        if LEGACY_SEARCH_TABLE in tables:
+            with self.conn:
+                self.conn.execute(f'DROP TABLE {LEGACY_SEARCH_TABLE}')
+        # 旧库第一次打开时补建全文索引
+        if not has_index and self.conn.execute('SELECT 1 FROM tweets LIMIT 1').fetchone():
+            logger.info(f"{path} 还没有全文索引，正在按已有数据建立")
+            self.rebuild_search_index()
+
+    def _migrate(self):
+        """给旧库补充新增的列"""
+        with self.conn:
+            for table, column, column_type in MIGRATIONS:
+                columns = {row[1] for row in self.conn.execute(f'PRAGMA table_info({table})')}
+                if column not in columns:
+                    self.conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_replies_parent ON replies(in_reply_to_id)')
+
+    def upsert_user(self, user_id, username):
+        """
+        记录用户名和用户ID的对应关系
+        :param user_id: 用户ID
+        :param username: 用户名
+        """
+        with self._lock, self.conn:
+            self.conn.execute('DELETE FROM users WHERE username = ? COLLATE NOCASE AND id != ?', (username, int(user_id)))
+            self.conn.execute(
+                'INSERT INTO users (id, username, updated_at) VALUES (?, ?, ?) '
+                'ON CONFLICT(id) DO UPDATE SET username = excluded.username, updated_at = excluded.updated_at',
+                (int(user_id), username, datetime.now(timezone.utc).isoformat())
+            )
+
+    def get_user_id(self, username):
+        """
+        按用户名查询已记录的用户ID
+        :param username: 用户名
+        :return: 用户ID，没有记录时返回 None
+        """
+        with self._lock:
+            row = self.conn.execute('SELECT id FROM users WHERE username = ? COLLATE NOCASE', (username,)).fetchone()
+        return row[0] if row else None
+
+    def write_page(self, tweets, source=None):
+        """
+        按ID去重写入一页推文及其评论，每 batch_size 行一个事务
+        :param tweets: TweetRecord 列表(评论挂在 tweet.replies 上)
+        :param source: 数据来源，例如 user:<id> 或 home
+        """
+        fetched_at = datetime.now(timezone.utc).isoformat()
+        source = source or self.source
+        tweet_rows = []
+        reply_rows = []
+        for tweet in tweets:
+            tweet_rows.append((
+                tweet.id,
+                tweet.author_id,
+                tweet.conversation_id,
+                format_api_time(tweet.created_at),
+                tweet.text,
+                len(tweet.replies),
+                source,
+                fetched_at
+            ))
+            for reply in tweet.replies:
+                reply_rows.append((
+                    reply.id,
+                    tweet.id,
+                    reply.conversation_id or tweet.id,
+                    reply.author_id,
+                    format_api_time(reply.created_at),
+                    reply.text,
+                    fetched_at,
+                    ConversationIndex.parent_of(reply) or tweet.id,
+                    reply.in_reply_to_user_id
+                ))
+
+        with self._lock:
+            for start in range(0, max(len(tweet_rows), len(reply_rows)), self.batch_size):
+                tweet_batch = tweet_rows[start:start + self.batch_size]
+                reply_batch = reply_rows[start:start + self.batch_size]
+                with self.conn:
+                    self.conn.executemany(UPSERT_TWEET, tweet_batch)
+                    self.conn.executemany(UPSERT_REPLY, reply_batch)
+                    index_documents(self.conn,
+                                    [(row[0], 'tweet', row[0], row[1], row[3], row[4]) for row in tweet_batch] +
+                                    [(row[0], 'reply', row[1], row[3], row[4], row[5]) for row in reply_batch])
+        self.count += len(tweets)
+
+    def upsert_replies(self, replies_by_id):
+        """
+        写入按会话刷新的评论
+        :param replies_by_id: {推文ID: 评论列表}
+        """
+        fetched_at = datetime.now(timezone.utc).isoformat()
+        rows = [(
+            reply.id,
+            int(tweet_id),
+            reply.conversation_id or int(tweet_id),
+            reply.author_id,
+            format_api_time(reply.created_at),
+            reply.text,
+            fetched_at,
+            ConversationIndex.parent_of(reply) or int(tweet_id),
+            reply.in_reply_to_user_id
+        ) for tweet_id, replies in replies_by_id.items() for reply in replies]
+        with self._lock:
+            for start in range(0, len(rows), self.batch_size):
+                batch = rows[start:start + self.batch_size]
+                with self.conn:
+                    self.conn.executemany(UPSERT_REPLY, batch)
+                    index_documents(self.conn, [(row[0], 'reply', row[1], row[3], row[4], row[5]) for row in batch])
+                    self.conn.executemany(
+                        'UPDATE tweets SET reply_count = (SELECT COUNT(*) FROM replies WHERE replies.tweet_id = tweets.id) WHERE id = ?',
+                        [(int(tweet_id),) for tweet_id in replies_by_id]
+                    )
+
+    def iter_tweets(self, author_id=None, since=None, until=None, conversation_id=None, batch_size=1000):
+        """
+        按条件查询推文，逐条产出挂好评论的推文对象
+        :param author_id: 作者ID
+        :param since: 起始时间(包含)，ISO 日期或时间字符串
+        :param until: 结束时间(不包含)
+        :param conversation_id: 会话ID
+        :param batch_size: 每次从数据库读取的行数
+        :return: TweetRecord 生成器，按发布时间倒序
+        """
+        conditions = []
+        params = []
+        if author_id is not None:
+            conditions.append('author_id = ?')
+            params.append(int(author_id))
+        if conversation_id is not None:
+            conditions.append('conversation_id = ?')
+            params.append(int(conversation_id))
+        if since:
+            conditions.append('created_at >= ?')
+            params.append(since)
+        if until:
+            conditions.append('created_at < ?')
+            params.append(until)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        query = (f'SELECT id, author_id, conversation_id, created_at, text FROM tweets {where} '
+                 f'ORDER BY created_at DESC, id DESC')
+
+        with self._lock:
+            cursor = self.conn.execute(query, params)
+            rows = cursor.fetchmany(batch_size)
+        while rows:
+            ids = [row[0] for row in rows]
+            replies_by_id = self._load_replies(ids)
+            for row in rows:
+                yield TweetRecord(row[0], row[4], parse_api_time(row[3]), row[1], row[2],
+                                  tuple(replies_by_id.get(row[0], ())))
+            with self._lock:
+                rows = cursor.fetchmany(batch_size)
+
+    def _load_replies(self, tweet_ids):
+        """
+        读取一批推文的评论，并按回复树先序排列
+        :return: {推文ID: 评论列表}
+        """
+        placeholders = ','.join('?' * len(tweet_ids))
+        with self._lock:
+            rows = self.conn.execute(
+                f'SELECT id, tweet_id, conversation_id, author_id, created_at, text, in_reply_to_id, '
+                f'in_reply_to_user_id FROM replies WHERE tweet_id IN ({placeholders}) ORDER BY id', tweet_ids
+            ).fetchall()
+        index = ConversationIndex()
+        for row in rows:
+            referenced = (('replied_to', row[6]),) if row[6] is not None else ()
+            index.add(TweetRecord(row[0], row[5], parse_api_time(row[4]), row[3], row[2] or row[1],
+                                  referenced_tweets=referenced, in_reply_to_user_id=row[7]))
+        return {tweet_id: index.thread(tweet_id) for tweet_id in {row[1] for row in rows}}
+
+    def export(self, format_type, filename, page_size=1000, **filters):
+        """
+        把查询结果流式导出到文件，不消耗API调用
+        :param format_type: 导出格式
+        :param filename: 文件名
+        :param page_size: 每次写入的推文数
+        :param filters: 传给 iter_tweets 的查询条件
+        :return: 导出的推文数
+        """
+        with open_export_writer(format_type, filename) as writer:
+            page = []
+            for tweet in self.iter_tweets(**filters):
+                page.append(tweet)
+                if len(page) >= page_size:
+                    writer.write_page(page)
+                    page = []
+            if page:
+                writer.write_page(page)
+            return writer.count
+
+    def latest_tweet_id(self, author_id):
+        """
+        查询作者在库中最新的推文ID，可作为增量抓取的 since_id
+        :param author_id: 作者ID
+        :return: 推文ID，没有记录时返回 None
+        """
+        with self._lock:
+            row = self.conn.execute('SELECT MAX(id) FROM tweets WHERE author_id = ?', (int(author_id),)).fetchone()
+        return row[0]
+
+    def search(self, keywords, author_id=None, since=None, until=None, kind=None, order='recent',
+               limit=SEARCH_DEFAULT_LIMIT):
+        """
+        全文检索库中的推文和评论，参数见 tweet_search.search
+        :return: 结果字典列表
+        """
+        with self._lock:
+            return search(self.conn, keywords, author_id, since, until, kind, order, limit)
+
+    def rebuild_search_index(self):
+        """按库中已有的推文和评论重建全文索引"""
+        with self._lock:
+            return rebuild_index(self.conn, self.batch_size)
+
+    def stats(self):
+        """返回库中的推文、评论和用户数量"""
+        with self._lock:
+            return {
+                table: self.conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                for table in ('tweets', 'replies', 'users')
+            }
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def main(argv=None):
+    """命令行：从本地库导出推文"""
+    parser = argparse.ArgumentParser(description='从本地 SQLite 推文库查询并导出，不调用API')
+    parser.add_argument('--db', default=STORE_FILE, help='数据库文件')
+    parser.add_argument('-u', '--user', help='用户名(需曾经抓取过)')
+    parser.add_argument('--since', help='起始时间，例如 2025-03-01')
+    parser.add_argument('--until', help='结束时间(不包含)')
+    parser.add_argument('--conversation', type=int, help='会话ID')
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='json')
+    parser.add_argument('-o', '--output', help='导出文件名')
+    parser.add_argument('--stats', action='store_true', help='只显示库中的数据量')
+    args = parser.parse_args(argv)
+
+    with TweetStore(args.db) as store:
+        if args.stats:
+            print(store.stats())
+            return 0
+
+        author_id = None
+        if args.user:
+            author_id = store.get_user_id(args.user.lstrip('@'))
+            if author_id is None:
+                logger.error(f"库中没有用户 {args.user} 的记录")
+                return 1
+
+        filename = args.output or f"store_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{args.format}"
+        count = store.export(args.format, filename, author_id=author_id, since=args.since,
+                             until=args.until, conversation_id=args.conversation)
+        print(f"已从 {args.db} 导出 {count} 条推文到 {filename}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,474 @@
+import os
+import time
+import asyncio
+import contextvars
+from datetime import datetime
+
+import aiohttp
+import tweepy
+from tweepy.asynchronous import AsyncClient
+from yarl import URL
+
+from twitter_scraper import (
+    logger, CONFIG, TWITTER_ACCOUNTS, API_BASE_URL, MAX_CONCURRENT_PER_CLIENT, REPLY_FETCH_WORKERS,
+    CACHEABLE_TIMELINES, METRICS, RateLimitScheduler, build_conversation_queries, get_tweet_params,
+    make_cache_key, record_quota, serialize_tweet, deserialize_tweet, to_records, ProgressReporter, UserResolver,
+    select_reply_candidates, ConversationIndex, REPLY_TWEET_FIELDS, export_tweets
+)
+
+ASYNC_CONNECTION_LIMIT = CONFIG.get('async_connection_limit', 100)  # 共享连接池的最大连接数
+ASYNC_USER_CONCURRENCY = CONFIG.get('async_user_concurrency', 10)   # 同时抓取的用户数
+
+# 当前任务最近一次响应的HTTP头(由 aiohttp 的请求追踪回调写入)
+_last_headers = contextvars.ContextVar('last_headers', default=None)
+
+async def metered_sleep(seconds, reason, endpoint=''):
+    """非阻塞休眠并记录休眠时间"""
+    METRICS.inc('twitter_sleep_seconds_total', {'reason': reason, 'endpoint': endpoint}, seconds)
+    await asyncio.sleep(seconds)
+
+async def _on_request_end(session, trace_config_ctx, params):
+    """aiohttp请求追踪回调，保存响应头供速率限制调度使用"""
+    _last_headers.set(params.response.headers)
+
+class ApiRedirectSession:
+    """把发往 api.twitter.com 的请求转发到其他地址(如本地模拟服务)，与同步版本的 ApiRedirectAdapter 对应"""
+
+    def __init__(self, session, base_url):
+        self.session = session
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, url, **kwargs):
+        # tweepy 用户认证时传入已编码的 URL，替换地址后保持原编码
+        url = str(url).replace('https://api.twitter.com', self.base_url, 1)
+        return self.session.request(method, URL(url, encoded=True), **kwargs)
+
+class AsyncRetryableTwitterClient:
+    """基于 tweepy.asynchronous.AsyncClient 的异步客户端，所有账号共享一个连接池"""
+
+    def __init__(self, cache=None, accounts=None, api_base_url=API_BASE_URL):
+        self.clients = []
+        self.cache = cache
+        self.api_base_url = api_base_url
+        self.session = None
+        self.initialize_clients(accounts or TWITTER_ACCOUNTS)
+        self.clients_by_name = {client['name']: client for client in self.clients}
+        self.scheduler = RateLimitScheduler(self.clients_by_name)
+        self.user_resolver = AsyncUserResolver(self)
+
+    def initialize_clients(self, accounts):
+        """初始化多个异步Twitter API客户端"""
+        for account in accounts:
+            try:
+                client = AsyncClient(
+                    bearer_token=account['bearer_token'],
+                    consumer_key=account['api_key'],
+                    consumer_secret=account['api_key_secret'],
+                    access_token=account['access_token'],
+                    access_token_secret=account['access_token_secret']
+                )
+                self.clients.append({
+                    'name': account['name'],
+                    'client': client,
+                    'is_active': True,
+                    'semaphore': asyncio.Semaphore(MAX_CONCURRENT_PER_CLIENT)
+                })
+            except Exception as e:
+                logger.error(f"异步客户端 {account['name']} 初始化失败: {str(e)}")
+
+    async def open(self):
+        """创建共享的 aiohttp 会话并分配给所有客户端"""
+        if self.session is None:
+            trace_config = aiohttp.TraceConfig()
+            trace_config.on_request_end.append(_on_request_end)
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=ASYNC_CONNECTION_LIMIT),
+                trace_configs=[trace_config]
+            )
+            session = ApiRedirectSession(self.session, self.api_base_url) if self.api_base_url else self.session
+            for client in self.clients:
+                client['client'].session = session
+
+    async def close(self):
+        """关闭共享会话"""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+            for client in self.clients:
+                client['client'].session = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def make_request(self, func, endpoint, *args, **kwargs):
+        """
+        发送异步API请求并处理速率限制，等待时不阻塞事件循环
+        :param func: API调用协程函数
+        :param endpoint: API端点名称
+        :return: API响应
+        """
+        retries = 0
+        max_retries = 3
+
+        while retries < max_retries:
+            name, wait_time = self.scheduler.acquire(endpoint)
+            if name is None:
+                logger.warning(f"所有客户端的 {endpoint} 配额都已用完，等待 {wait_time} 秒")
+                await metered_sleep(wait_time, 'quota_wait', endpoint)
+                continue
+
+            current_client = self.clients_by_name[name]
+            labels = {'endpoint': endpoint, 'account': name}
+            if retries:
+                METRICS.inc('twitter_retries_total', {'endpoint': endpoint})
+            started = time.perf_counter()
+            try:
+                _last_headers.set(None)
+                async with current_client['semaphore']:
+                    response = await func(current_client['client'], *args, **kwargs)
+                METRICS.observe('twitter_request_duration_seconds', labels, time.perf_counter() - started)
+                METRICS.inc('twitter_requests_total', dict(labels, status='ok'))
+
+                headers = _last_headers.get()
+                if headers:
+                    self.scheduler.update(name, endpoint, headers)
+                    record_quota(endpoint, name, headers)
+                    limit = int(headers.get('x-rate-limit-limit', 0))
+                    remaining = int(headers.get('x-rate-limit-remaining', 0))
+                    if limit > 0 and remaining < limit * 0.2:
+                        logger.warning(f"客户端 {name} 的 {endpoint} 请求次数即将用完，剩余: {remaining}/{limit}")
+
+                return response
+
+            except tweepy.TooManyRequests as e:
+                retries += 1
+                METRICS.observe('twitter_request_duration_seconds', labels, time.perf_counter() - started)
+                METRICS.inc('twitter_requests_total', dict(labels, status='rate_limited'))
+                METRICS.inc('twitter_rate_limited_total', labels)
+                current_time = int(time.time())
+                reset_time = 0
+                if hasattr(e, 'response') and hasattr(e.response, 'headers'):
+                    reset_time = int(e.response.headers.get('x-rate-limit-reset', 0))
+                    record_quota(endpoint, name, e.response.headers)
+                if reset_time <= current_time:
+                    reset_time = current_time + min(300, (2 ** retries) * 5)
+                self.scheduler.mark_exhausted(name, endpoint, reset_time)
+                logger.warning(f"客户端 {name} 在 {endpoint} 遇到速率限制，切换客户端重试")
+
+            except tweepy.Unauthorized as e:
+                retries += 1
+                METRICS.inc('twitter_requests_total', dict(labels, status='unauthorized'))
+                logger.error(f"客户端 {name} 认证失败，已停用: {str(e)}")
+                current_client['is_active'] = False
+                self.scheduler.deactivate(name)
+                if retries >= max_retries:
+                    raise
+
+            except Exception as e:
+                retries += 1
+                METRICS.observe('twitter_request_duration_seconds', labels, time.perf_counter() - started)
+                METRICS.inc('twitter_requests_total', dict(labels, status='error'))
+                logger.error(f"请求失败: {str(e)}")
+                if retries >= max_retries:
+                    raise
+                await metered_sleep(5, 'error_backoff', endpoint)
+
+            finally:
+                self.scheduler.release(name)
+
+        raise Exception(f"达到最大重试次数 ({max_retries})")
+
+class AsyncUserResolver(UserResolver):
+    """UserResolver 的协程版本，缓存格式与同步版本相同，同一事件循环内的重复查询合并为一次请求"""
+
+    async def _lookup(self, keys):
+        found = {}
+        for start in range(0, len(keys), self.batch_size):
+            chunk = keys[start:start + self.batch_size]
+            response = await self.client.make_request(AsyncClient.get_users, 'get_users', usernames=chunk)
+            for user in (response.data or []) if response else []:
+                found[user.username.lower()] = int(user.id)
+        return {key: found.get(key) for key in keys}
+
+    async def resolve_many(self, usernames):
+        keys = {username: username.lstrip('@').lower() for username in usernames}
+        results = {}
+        waiting = {}
+        owned = []
+        for key in dict.fromkeys(keys.values()):
+            entry = self._cached(key)
+            if entry is not None:
+                results[key] = entry['id']
+            elif key in self._inflight:
+                waiting[key] = self._inflight[key]
+            else:
+                self._inflight[key] = asyncio.get_running_loop().create_future()
+                owned.append(key)
+
+        if owned:
+            try:
+                found = await self._lookup(owned)
+            except Exception as e:
+                for key in owned:
+                    self._inflight.pop(key).set_exception(e)
+                raise
+            for key, user_id in found.items():
+                self._store(key, user_id)
+                self._inflight.pop(key).set_result(user_id)
+            results.update(found)
+
+        for key, future in waiting.items():
+            results[key] = await future
+        return {username: results[key] for username, key in keys.items()}
+
+    async def resolve(self, username):
+        return (await self.resolve_many([username]))[username]
+
+async def get_conversation_replies_async(client, query, tweet_ids):
+    """
+    分页执行一条合并后的会话查询，每页结果加入回复树，并按 conversation_id 把评论分配给原推文
+    :param client: 异步Twitter客户端
+    :param query: 合并后的查询字符串
+    :param tweet_ids: 查询中包含的推文ID列表
+    :return: {推文ID: 按回复树先序排列的评论列表}，任何一页请求失败时抛出异常，不返回不完整的结果
+    """
+    index = ConversationIndex()
+    wanted = set(tweet_ids)
+    params = {
+        'query': query,
+        'tweet_fields': REPLY_TWEET_FIELDS,
+        'max_results': 100
+    }
+    while True:
+        replies = await client.make_request(AsyncClient.search_recent_tweets, 'search_recent_tweets', **params)
+        index.add_many(reply for reply in to_records(replies.data if replies else None)
+                       if reply.id != reply.conversation_id and reply.conversation_id in wanted)
+
+        next_token = replies.meta.get('next_token') if replies and replies.meta else None
+        if not next_token:
+            break
+        params['next_token'] = next_token
+    return {tweet_id: index.thread(tweet_id) for tweet_id in tweet_ids}
+
+async def fetch_replies_async(client, tweets):
+    """
+    并发获取一页推文的评论
+    :param client: 异步Twitter客户端
+    :param tweets: 推文列表
+    :return: 与推文顺序一致的评论列表
+    """
+    if not tweets:
+        return []
+
+    replies_by_id = {}
+    pending_ids = []
+    for tweet_id in select_reply_candidates(tweets):
+        cached = client.cache.get(f'replies:{tweet_id}') if client.cache else None
+        if cached is not None:
+            replies_by_id[tweet_id] = [deserialize_tweet(reply) for reply in cached]
+        else:
+            pending_ids.append(tweet_id)
+
+    if pending_ids:
+        semaphore = asyncio.Semaphore(REPLY_FETCH_WORKERS)
+
+        async def run_batch(batch):
+            async with semaphore:
+                try:
+                    return await get_conversation_replies_async(client, *batch)
+                except Exception as e:
+                    logger.error(f"批量获取 {len(batch[1])} 个会话的评论失败，下次重新获取: {str(e)}")
+                    return {}
+
+        # 失败的批次不返回结果也不写缓存
+        results = await asyncio.gather(*(run_batch(batch) for batch in build_conversation_queries(pending_ids)))
+        for result in results:
+            replies_by_id.update(result)
+            if client.cache:
+                for tweet_id, replies in result.items():
+                    client.cache.set(f'replies:{tweet_id}', [serialize_tweet(reply) for reply in replies])
+    return [replies_by_id.get(tweet.id, []) for tweet in tweets]
+
+async def request_timeline_page_async(client, get_tweets_func, params):
+    """
+    获取一页推文，可缓存的时间线优先读取缓存
+    :return: (data 已转换为 TweetRecord 的API响应, 是否来自缓存)
+    """
+    endpoint = get_tweets_func.__name__
+    cache_key = None
+    if client.cache and endpoint in CACHEABLE_TIMELINES:
+        cache_key = make_cache_key(endpoint, params)
+        cached = client.cache.get(cache_key)
+        if cached is not None:
+            data = [deserialize_tweet(tweet) for tweet in cached['data']]
+            return tweepy.Response(data, {}, [], cached['meta']), True
+
+    tweets = await client.make_request(get_tweets_func, endpoint, **params)
+    if tweets and tweets.data:
+        tweets = tweets._replace(data=to_records(tweets.data))
+    if cache_key and tweets and tweets.data:
+        client.cache.set(cache_key, {
+            'data': [serialize_tweet(tweet) for tweet in tweets.data],
+            'meta': tweets.meta or {}
+        })
+    return tweets, False
+
+async def get_tweets_with_pagination_async(client, get_tweets_func, params, status=None):
+    """
+    分页获取推文及其评论
+    :param client: 异步Twitter客户端
+    :param get_tweets_func: 获取推文的协程函数(AsyncClient 的未绑定方法)
+    :param params: API参数
+    :param status: 可选字典，分页全部完成时写入 status['complete'] = True
+    :return: 推文列表
+    """
+    tweets_data = []
+    retry_count = 0
+    max_retries = 3
+    progress = ProgressReporter(get_tweets_func.__name__)
+
+    while retry_count < max_retries:
+        try:
+            tweets, from_cache = await request_timeline_page_async(client, get_tweets_func, params)
+            if not tweets or not tweets.data:
+                if status is not None:
+                    status['complete'] = True
+                break
+
+            page_replies = await fetch_replies_async(client, tweets.data)
+            for tweet, replies in zip(tweets.data, page_replies):
+                tweet.replies = tuple(replies)
+            tweets_data.extend(tweets.data)
+            progress.update(len(tweets.data), sum(len(replies) for replies in page_replies))
+
+            if tweets.meta and tweets.meta.get('next_token'):
+                params['pagination_token'] = tweets.meta['next_token']
+            else:
+                if status is not None:
+                    status['complete'] = True
+                break
+
+        except Exception as e:
+            logger.error(f"获取推文时发生错误: {str(e)}")
+            retry_count += 1
+            if retry_count >= max_retries:
+                break
+            await metered_sleep(5, 'error_backoff', get_tweets_func.__name__)
+
+    progress.done()
+    return tweets_data
+
+async def get_user_tweets_async(client, username, checkpoints=None):
+    """
+    获取指定用户的推文
+    :param client: 异步Twitter客户端
+    :param username: 用户名
+    :param checkpoints: 可选的 CheckpointStore，提供时只抓取上次之后的新推文
+    :return: 推文列表，找不到用户或出错时返回 None
+    """
+    try:
+        user_id = await client.user_resolver.resolve(username)
+        if not user_id:
+            logger.warning(f"未找到用户: {username}")
+            return None
+
+        tweet_params = get_tweet_params()
+        tweet_params['id'] = user_id
+        since_id = checkpoints.get_since_id(user_id) if checkpoints else None
+        if since_id:
+            tweet_params['since_id'] = since_id
+
+        status = {}
+        tweets_data = await get_tweets_with_pagination_async(client, AsyncClient.get_users_tweets, tweet_params, status)
+        if checkpoints and status.get('complete'):
+            checkpoints.update(user_id, tweets_data)
+        logger.info(f"用户 {username} 共获取 {len(tweets_data)} 条推文")
+        return tweets_data
+
+    except Exception as e:
+        logger.error(f"获取用户 {username} 的推文时发生错误: {str(e)}")
+        return None
+
+async def get_home_timeline_async(client):
+    """
+    获取首页时间线推文
+    :param client: 异步Twitter客户端
+    :return: 推文列表
+    """
+    return await get_tweets_with_pagination_async(client, AsyncClient.get_home_timeline, get_tweet_params())
+
+async def scrape_users_async(usernames, cache=None, checkpoints=None, concurrency=ASYNC_USER_CONCURRENCY,
+                             accounts=None, api_base_url=API_BASE_URL):
+    """
+    在一个事件循环里并发抓取多个用户
+    :param usernames: 用户名列表
+    :param cache: 可选的 TweetCache
+    :param checkpoints: 可选的 CheckpointStore
+    :param concurrency: 同时抓取的用户数
+    :param accounts: 账号配置，默认使用配置文件中的账号
+    :param api_base_url: 可选的API地址
+    :return: {用户名: 推文列表，失败时为 None}
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with AsyncRetryableTwitterClient(cache=cache, accounts=accounts, api_base_url=api_base_url) as client:
+        if not client.clients:
+            logger.error("异步API客户端初始化失败")
+            return {username: None for username in usernames}
+        try:
+            await client.user_resolver.resolve_many(usernames)
+        except Exception as e:
+            logger.error(f"批量解析用户名失败: {str(e)}")
+
+        async def scrape(username):
+            async with semaphore:
+                return await get_user_tweets_async(client, username, checkpoints)
+
+        results = await asyncio.gather(*(scrape(username) for username in usernames))
+
+    if cache:
+        cache.save()
+    if checkpoints:
+        checkpoints.save()
+    return dict(zip(usernames, results))
+
+async def run_batch_async(usernames, format_type, output_dir, cache=None, checkpoints=None, store=None,
+                          concurrency=ASYNC_USER_CONCURRENCY, accounts=None, api_base_url=API_BASE_URL):
+    """
+    run_batch 的异步版本：在一个事件循环里并发抓取多个用户并分别导出，不记录抓取日志，也不刷新旧会话的评论
+    :param usernames: 用户名列表
+    :param format_type: 导出格式
+    :param output_dir: 导出目录
+    :param cache: 可选的 TweetCache
+    :param checkpoints: 可选的 CheckpointStore，提供时只抓取上次之后的新推文
+    :param store: 可选的 TweetStore，抓取结果同时写入本地库
+    :param concurrency: 同时抓取的用户数
+    :param accounts: 账号配置，默认使用配置文件中的账号
+    :param api_base_url: 可选的API地址
+    :return: {用户名: 导出文件路径，没有新推文时为 ''，失败时为 None}
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    tweets_by_user = await scrape_users_async(usernames, cache, checkpoints, concurrency, accounts, api_base_url)
+
+    results = {}
+    for username, tweets in tweets_by_user.items():
+        if not tweets:
+            # 增量模式下没有新推文也算成功
+            results[username] = None if tweets is None else ''
+            continue
+        if store:
+            store.upsert_user(tweets[0].author_id, username)
+            store.write_page(tweets, source=f'user:{tweets[0].author_id}')
+        filename = os.path.join(output_dir, f"{username}_{timestamp}.{format_type}")
+        results[username] = export_tweets(tweets, format_type, filename)
+
+    failed = [username for username, filename in results.items() if filename is None]
+    logger.info(f"异步批量抓取完成: 成功 {len(results) - len(failed)} 个, 失败 {len(failed)} 个")
+    if failed:
+        logger.warning(f"抓取失败的用户: {', '.join(failed)}")
+    return results
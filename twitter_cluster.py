@@ -0,0 +1,434 @@
+# 多进程分片抓取：协调进程把抓取任务放入持久化队列，每个工作进程只使用分配给它的账号，
+# 从队列领取任务(用户、时间线页、评论批次)并写入同一个 SQLite 推文库。
+# 队列通过 WorkQueue 接口访问，目前提供 SQLite 实现(单机多进程)，以后可以换成跨机器的实现
+import os
+import sys
+import json
+import time
+import socket
+import sqlite3
+import argparse
+import threading
+import multiprocessing
+from collections import namedtuple
+from datetime import datetime
+
+import tweepy
+
+from twitter_scraper import (
+    logger, CONFIG, TWITTER_ACCOUNTS, API_BASE_URL, RetryableTwitterClient, load_usernames,
+    get_tweet_params, request_timeline_page, select_reply_candidates,
+    build_conversation_queries, get_conversation_replies
+)
+from tweet_store import TweetStore, STORE_FILE
+
+QUEUE_FILE = CONFIG.get('cluster_queue_file', 'crawl_queue.db')   # 任务队列数据库
+LEASE_SECONDS = CONFIG.get('cluster_lease_seconds', 300)          # 任务租约时长，工作进程崩溃后任务到期重新分配
+LEASE_RENEW_INTERVAL = LEASE_SECONDS / 3                          # 执行中的任务续约间隔，任务可能因速率限制等待很久
+MAX_TASK_ATTEMPTS = CONFIG.get('cluster_max_attempts', 3)         # 任务最多尝试次数
+IDLE_POLL_SECONDS = 1.0                                           # 队列暂时为空时的等待间隔
+
+# 任务优先级：先展开用户和时间线页，让更多工作进程尽早有事可做
+PRIORITY_USER = 2
+PRIORITY_PAGE = 1
+PRIORITY_REPLIES = 0
+
+Task = namedtuple('Task', 'id kind payload attempts')
+
+class WorkQueue:
+    """任务队列接口，实现需要支持多个进程同时领取任务"""
+
+    def put(self, kind, payload, key, priority=0):
+        """
+        添加任务，key 相同的任务只保留一个
+        :param kind: 任务类型
+        :param payload: 可JSON序列化的任务参数
+        :param key: 去重键
+        :param priority: 优先级，越大越先执行
+        """
+        raise NotImplementedError
+
+    def lease(self, worker_id, lease_seconds=LEASE_SECONDS):
+        """
+        领取一个任务
+        :return: Task，没有可领取的任务时返回 None
+        """
+        raise NotImplementedError
+
+    def renew(self, task_id, worker_id, lease_seconds=LEASE_SECONDS):
+        """
+        延长租约
+        :return: 租约是否仍属于 worker_id
+        """
+        raise NotImplementedError
+
+    def complete(self, task_id, worker_id=None):
+        """
+        标记任务完成
+        :param worker_id: 提供时只有租约仍属于该工作线程才更新
+        :return: 是否更新成功
+        """
+        raise NotImplementedError
+
+    def fail(self, task_id, error, worker_id=None):
+        """
+        任务失败：未达到最大尝试次数时放回队列
+        :param worker_id: 提供时只有租约仍属于该工作线程才更新
+        :return: 是否更新成功
+        """
+        raise NotImplementedError
+
+    def stats(self):
+        """
+        :return: {状态: 任务数}
+        """
+        raise NotImplementedError
+
+    def is_drained(self):
+        """没有待执行和执行中的任务"""
+        stats = self.stats()
+        return not stats.get('pending') and not stats.get('leased')
+
+    def close(self):
+        pass
+
+class SqliteWorkQueue(WorkQueue):
+    """基于 SQLite 的持久化队列，用 BEGIN IMMEDIATE 保证多个进程不会领到同一个任务"""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS tasks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        task_key TEXT NOT NULL UNIQUE,
+        priority INTEGER NOT NULL DEFAULT 0,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        leased_by TEXT,
+        lease_expires REAL,
+        error TEXT,
+        updated_at REAL
+    );
+    CREATE INDEX IF NOT EXISTS idx_tasks_ready ON tasks(status, priority DESC, id);
+    """
+
+    def __init__(self, path=QUEUE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(self.SCHEMA)
+
+    def put(self, kind, payload, key, priority=0):
+        with self._lock:
+            self.conn.execute(
+                'INSERT OR IGNORE INTO tasks (kind, payload, task_key, priority, updated_at) VALUES (?, ?, ?, ?, ?)',
+                (kind, json.dumps(payload, ensure_ascii=False), key, priority, time.time())
+            )
+
+    def lease(self, worker_id, lease_seconds=LEASE_SECONDS):
+        now = time.time()
+        with self._lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self.conn.execute(
+                    "SELECT id, kind, payload, attempts FROM tasks "
+                    "WHERE status = 'pending' OR (status = 'leased' AND lease_expires < ?) "
+                    "ORDER BY priority DESC, id LIMIT 1", (now,)
+                ).fetchone()
+                if row:
+                    self.conn.execute(
+                        "UPDATE tasks SET status = 'leased', leased_by = ?, lease_expires = ?, "
+                        "attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                        (worker_id, now + lease_seconds, now, row[0])
+                    )
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+        if not row:
+            return None
+        return Task(row[0], row[1], json.loads(row[2]), row[3] + 1)
+
+    @staticmethod
+    def _owner_clause(worker_id):
+        """租约已过期并被其他工作线程领走时，原工作线程的更新不生效"""
+        if worker_id is None:
+            return '', ()
+        return " AND status = 'leased' AND leased_by = ?", (worker_id,)
+
+    def renew(self, task_id, worker_id, lease_seconds=LEASE_SECONDS):
+        now = time.time()
+        clause, params = self._owner_clause(worker_id)
+        with self._lock:
+            cursor = self.conn.execute(
+                f"UPDATE tasks SET lease_expires = ?, updated_at = ? WHERE id = ?{clause}",
+                (now + lease_seconds, now, task_id) + params
+            )
+        return cursor.rowcount > 0
+
+    def complete(self, task_id, worker_id=None):
+        clause, params = self._owner_clause(worker_id)
+        with self._lock:
+            cursor = self.conn.execute(
+                f"UPDATE tasks SET status = 'done', updated_at = ? WHERE id = ?{clause}",
+                (time.time(), task_id) + params
+            )
+        return cursor.rowcount > 0
+
+    def fail(self, task_id, error, worker_id=None):
+        clause, params = self._owner_clause(worker_id)
+        with self._lock:
+            cursor = self.conn.execute(
+                "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                f"error = ?, updated_at = ? WHERE id = ?{clause}",
+                (MAX_TASK_ATTEMPTS, str(error), time.time(), task_id) + params
+            )
+        return cursor.rowcount > 0
+
+    def stats(self):
+        with self._lock:
+            return dict(self.conn.execute('SELECT status, COUNT(*) FROM tasks GROUP BY status').fetchall())
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+# 队列类型 -> 实现，open_work_queue 按地址前缀选择
+WORK_QUEUES = {
+    'sqlite': SqliteWorkQueue
+}
+
+def open_work_queue(address):
+    """
+    打开任务队列
+    :param address: 队列地址，例如 sqlite://crawl_queue.db；没有前缀时按 SQLite 文件处理
+    :return: WorkQueue
+    """
+    scheme, sep, location = address.partition('://')
+    if not sep:
+        scheme, location = 'sqlite', address
+    if scheme not in WORK_QUEUES:
+        raise ValueError(f"不支持的任务队列: {scheme}")
+    return WORK_QUEUES[scheme](location)
+
+def split_accounts(accounts, workers):
+    """
+    把账号轮流分配给工作进程，每个账号只属于一个进程
+    :param accounts: 账号配置列表
+    :param workers: 工作进程数
+    :return: 每个工作进程的账号列表(不含空列表)
+    """
+    groups = [accounts[i::workers] for i in range(workers)]
+    return [group for group in groups if group]
+
+def enqueue_users(queue, usernames, run_id, incremental=False):
+    """
+    为每个用户添加抓取任务
+    :param queue: WorkQueue
+    :param usernames: 用户名列表
+    :param run_id: 本次运行的ID，不同运行的任务互不去重
+    :param incremental: 是否只抓取库中最新推文之后的推文
+    """
+    for username in usernames:
+        queue.put('user', {'run': run_id, 'username': username, 'incremental': incremental},
+                  f'{run_id}:user:{username.lower()}', PRIORITY_USER)
+
+def handle_task(client, store, queue, task):
+    """
+    执行一个任务，需要继续抓取的部分作为新任务放回队列
+    :param client: Twitter客户端
+    :param store: TweetStore
+    :param queue: WorkQueue
+    :param task: Task
+    """
+    payload = task.payload
+    run_id = payload['run']
+
+    if task.kind == 'user':
+        # 查询出错时抛出异常由队列重试，只有确认用户不存在时才结束任务
+        user_id = client.user_resolver.resolve(payload['username'])
+        if not user_id:
+            logger.error(f"未找到用户 {payload['username']}，跳过该用户")
+            return
+        store.upsert_user(user_id, payload['username'])
+        params = get_tweet_params()
+        params['id'] = user_id
+        since_id = store.latest_tweet_id(user_id) if payload.get('incremental') else None
+        if since_id:
+            params['since_id'] = since_id
+        queue.put('page', {'run': run_id, 'user_id': user_id, 'params': params},
+                  f'{run_id}:page:{user_id}:first', PRIORITY_PAGE)
+
+    elif task.kind == 'page':
+        params = payload['params']
+        user_id = payload['user_id']
+        tweets, _ = request_timeline_page(client, tweepy.Client.get_users_tweets, params)
+        if not tweets or not tweets.data:
+            return
+        store.write_page(tweets.data, source=f'user:{user_id}')
+        for query, tweet_ids in build_conversation_queries(select_reply_candidates(tweets.data)):
+            queue.put('replies', {'run': run_id, 'query': query, 'tweet_ids': tweet_ids},
+                      f'{run_id}:replies:{tweet_ids[0]}', PRIORITY_REPLIES)
+        next_token = tweets.meta.get('next_token') if tweets.meta else None
+        if next_token:
+            queue.put('page', {'run': run_id, 'user_id': user_id, 'params': dict(params, pagination_token=next_token)},
+                      f'{run_id}:page:{user_id}:{next_token}', PRIORITY_PAGE)
+
+    elif task.kind == 'replies':
+        # 搜索失败时抛出异常，由队列按最大尝试次数重试，不写入空结果
+        replies_by_id = get_conversation_replies(client, payload['query'], payload['tweet_ids'])
+        store.upsert_replies(replies_by_id)
+
+    else:
+        raise ValueError(f"未知的任务类型: {task.kind}")
+
+def run_worker(queue_address, store_path, accounts, worker_id=None, threads=None, exit_when_drained=True,
+               api_base_url=API_BASE_URL):
+    """
+    工作进程：用自己的账号领取并执行任务
+    :param queue_address: 任务队列地址
+    :param store_path: 推文库文件
+    :param accounts: 本进程使用的账号配置
+    :param worker_id: 工作进程名称
+    :param threads: 同时执行的任务数，默认等于账号数
+    :param exit_when_drained: 队列中没有待执行和执行中的任务时退出
+    :param api_base_url: 可选的API地址
+    :return: 完成的任务数
+    """
+    worker_id = worker_id or f'{socket.gethostname()}-{os.getpid()}'
+    client = RetryableTwitterClient(accounts=accounts, api_base_url=api_base_url)
+    if not client.clients:
+        logger.error(f"工作进程 {worker_id} 没有可用的账号")
+        return 0
+    queue = open_work_queue(queue_address)
+    store = TweetStore(store_path)
+    done = [0]
+    done_lock = threading.Lock()
+    active = {}   # 执行中的任务ID -> 工作线程名
+    stop_renewing = threading.Event()
+
+    def renew_leases():
+        # 任务内部可能因速率限制等待超过租约时长，定期续约，避免任务被其他进程重复领取
+        while not stop_renewing.wait(LEASE_RENEW_INTERVAL):
+            with done_lock:
+                leases = list(active.items())
+            for task_id, name in leases:
+                try:
+                    if not queue.renew(task_id, name):
+                        logger.warning(f"{name} 的任务 #{task_id} 租约已被其他工作进程领取")
+                except Exception as e:
+                    logger.error(f"任务 #{task_id} 续约失败: {str(e)}")
+
+    def loop(name):
+        while True:
+            task = queue.lease(name)
+            if task is None:
+                if exit_when_drained and queue.is_drained():
+                    return
+                time.sleep(IDLE_POLL_SECONDS)
+                continue
+            with done_lock:
+                active[task.id] = name
+            try:
+                handle_task(client, store, queue, task)
+                if queue.complete(task.id, name):
+                    with done_lock:
+                        done[0] += 1
+                else:
+                    logger.warning(f"{name} 完成任务 {task.kind}#{task.id} 时租约已失效，结果以新的领取者为准")
+            except Exception as e:
+                logger.error(f"{name} 执行任务 {task.kind}#{task.id} 失败(第 {task.attempts} 次): {str(e)}")
+                queue.fail(task.id, e, name)
+            finally:
+                with done_lock:
+                    active.pop(task.id, None)
+
+    threads = threads or len(client.clients)
+    names = [f'{worker_id}/{i}' for i in range(threads)]
+    workers = [threading.Thread(target=loop, args=(name,), name=name) for name in names]
+    renewer = threading.Thread(target=renew_leases, name=f'{worker_id}/lease', daemon=True)
+    renewer.start()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    stop_renewing.set()
+    renewer.join()
+
+    queue.close()
+    store.close()
+    logger.info(f"工作进程 {worker_id} 退出，完成 {done[0]} 个任务")
+    return done[0]
+
+def run_cluster(usernames, workers, queue_address=QUEUE_FILE, store_path=STORE_FILE, accounts=None,
+                incremental=False, api_base_url=API_BASE_URL):
+    """
+    协调进程：添加任务，按账号启动工作进程并等待队列清空
+    :param usernames: 用户名列表
+    :param workers: 工作进程数(不超过账号数)
+    :return: 队列最终的 {状态: 任务数}
+    """
+    account_groups = split_accounts(accounts or TWITTER_ACCOUNTS, workers)
+    run_id = datetime.now().strftime('%Y%m%d%H%M%S')
+    queue = open_work_queue(queue_address)
+    enqueue_users(queue, usernames, run_id, incremental)
+    logger.info(f"已添加 {len(usernames)} 个用户任务，启动 {len(account_groups)} 个工作进程")
+
+    # 使用 spawn，避免在已有日志线程和连接池的进程里 fork
+    context = multiprocessing.get_context('spawn')
+    processes = [
+        context.Process(target=run_worker, name=f'worker-{i}',
+                        args=(queue_address, store_path, group, f'worker-{i}'),
+                        kwargs={'api_base_url': api_base_url})
+        for i, group in enumerate(account_groups)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    stats = queue.stats()
+    queue.close()
+    logger.info(f"分片抓取完成，任务状态: {stats}")
+    return stats
+
+def parse_args(argv=None):
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description='多进程分片抓取')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    coordinator = subparsers.add_parser('run', help='添加任务并在本机启动工作进程')
+    coordinator.add_argument('-u', '--users', nargs='+', help='要抓取的用户名')
+    coordinator.add_argument('-f', '--users-file', help='用户名列表文件，每行一个，# 之后为注释')
+    coordinator.add_argument('-w', '--workers', type=int, default=None, help='工作进程数(默认等于账号数)')
+    coordinator.add_argument('--incremental', action='store_true', help='只抓取库中最新推文之后的推文')
+
+    worker = subparsers.add_parser('worker', help='只启动一个工作进程，例如在另一台机器上')
+    worker.add_argument('--accounts', nargs='+', help='本进程使用的账号名，默认全部')
+    worker.add_argument('--threads', type=int, default=None, help='同时执行的任务数')
+    worker.add_argument('--keep-running', action='store_true', help='队列清空后继续等待新任务')
+
+    for sub in (coordinator, worker):
+        sub.add_argument('--queue', default=QUEUE_FILE, help='任务队列地址')
+        sub.add_argument('--store', default=STORE_FILE, help='写入的 SQLite 推文库')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """分片抓取入口"""
+    args = parse_args(argv)
+    if args.command == 'worker':
+        accounts = [account for account in TWITTER_ACCOUNTS if not args.accounts or account['name'] in args.accounts]
+        run_worker(args.queue, args.store, accounts, threads=args.threads, exit_when_drained=not args.keep_running)
+        return 0
+
+    usernames = load_usernames(args.users, args.users_file)
+    if not usernames:
+        logger.error("没有需要抓取的用户名")
+        return 2
+    workers = max(1, min(args.workers or len(TWITTER_ACCOUNTS), len(TWITTER_ACCOUNTS)))
+    stats = run_cluster(usernames, workers, args.queue, args.store, incremental=args.incremental)
+    return 1 if stats.get('failed') else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
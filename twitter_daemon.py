@@ -0,0 +1,231 @@
+# 常驻服务模式：在一个进程里持续轮询关注列表中的用户和首页时间线
+# 每个目标有自己的轮询间隔，有新推文时缩短、没有时逐步拉长；
+# 整个进程复用同一个 RetryableTwitterClient、缓存和检查点，每次只抓取 since_id 之后的新推文
+import sys
+import time
+import heapq
+import signal
+import argparse
+import threading
+
+from twitter_scraper import (
+    logger, perf_timer, CONFIG, RetryableTwitterClient, TweetCache, CheckpointStore,
+    load_usernames, resolve_user_id, iter_user_tweet_pages, iter_home_timeline_pages,
+    refresh_stale_replies, METRICS
+)
+from tweet_store import TweetStore
+
+DAEMON_MIN_INTERVAL = CONFIG.get('daemon_min_interval', 60)        # 活跃目标的最短轮询间隔(秒)
+DAEMON_MAX_INTERVAL = CONFIG.get('daemon_max_interval', 3600)      # 安静目标的最长轮询间隔(秒)
+DAEMON_DEFAULT_INTERVAL = CONFIG.get('daemon_default_interval', 300)  # 新目标的初始轮询间隔(秒)
+DAEMON_BACKOFF = CONFIG.get('daemon_backoff', 1.5)                 # 没有新推文时间隔的放大倍数
+
+METRICS.describe('twitter_daemon_polls_total', 'counter', '常驻模式的轮询次数')
+
+class WatchTarget:
+    """轮询目标：一个用户或首页时间线"""
+
+    def __init__(self, name, kind='user', interval=DAEMON_DEFAULT_INTERVAL):
+        self.name = name
+        self.kind = kind
+        self.interval = interval
+        self.user_id = None
+        self.activity = 0.0   # 最近新推文数的指数滑动平均，越大越活跃
+        self.polls = 0
+        self.failures = 0
+
+    @property
+    def key(self):
+        return 'home' if self.kind == 'home' else f'user:{self.name}'
+
+    def adjust(self, new_tweets, min_interval=DAEMON_MIN_INTERVAL, max_interval=DAEMON_MAX_INTERVAL,
+               backoff=DAEMON_BACKOFF):
+        """
+        根据本次新推文数调整轮询间隔
+        :param new_tweets: 本次抓取到的新推文数
+        """
+        self.polls += 1
+        self.failures = 0
+        self.activity = self.activity * 0.5 + new_tweets * 0.5
+        if new_tweets:
+            self.interval = max(min_interval, self.interval / 2)
+        else:
+            self.interval = min(max_interval, self.interval * backoff)
+
+class PollingScheduler:
+    """按下次轮询时间排序的优先队列，时间相同时优先活跃的目标"""
+
+    def __init__(self):
+        self._heap = []
+        self._seq = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def schedule(self, target, run_at):
+        """
+        安排目标在 run_at 时刻轮询
+        :param target: WatchTarget
+        :param run_at: time.time() 时间戳
+        """
+        self._seq += 1
+        heapq.heappush(self._heap, (run_at, -target.activity, self._seq, target))
+
+    def next_due(self):
+        """
+        :return: (最早的轮询时间, 目标)，队列为空时返回 (None, None)
+        """
+        if not self._heap:
+            return None, None
+        run_at, _, _, target = self._heap[0]
+        return run_at, target
+
+    def pop(self):
+        """取出最早到期的目标"""
+        return heapq.heappop(self._heap)[3]
+
+class TwitterDaemon:
+    """常驻轮询服务"""
+
+    def __init__(self, targets, client=None, checkpoints=None, store=None,
+                 min_interval=DAEMON_MIN_INTERVAL, max_interval=DAEMON_MAX_INTERVAL):
+        self.client = client or RetryableTwitterClient(cache=TweetCache())
+        self.checkpoints = checkpoints or CheckpointStore()
+        self.store = store
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.scheduler = PollingScheduler()
+        self.stop_event = threading.Event()
+        self.targets = list(targets)
+        now = time.time()
+        for target in targets:
+            self.scheduler.schedule(target, now)
+
+    def poll(self, target):
+        """
+        抓取一个目标自上次以来的新推文
+        :param target: WatchTarget
+        :return: 新推文数
+        """
+        if target.kind == 'home':
+            pages = iter_home_timeline_pages(self.client, self.checkpoints)
+            source = 'home'
+        else:
+            if target.user_id is None:
+                target.user_id = resolve_user_id(self.client, target.name)
+                if target.user_id is None:
+                    raise LookupError(f"未找到用户: {target.name}")
+                if self.store:
+                    self.store.upsert_user(target.user_id, target.name)
+            pages = iter_user_tweet_pages(self.client, target.user_id, self.checkpoints)
+            source = f'user:{target.user_id}'
+
+        count = 0
+        for page in pages:
+            count += len(page)
+            if self.store:
+                self.store.write_page(page, source=source)
+
+        if target.kind == 'user':
+            replies_by_id = refresh_stale_replies(self.client, self.checkpoints, target.user_id)
+            if replies_by_id and self.store:
+                self.store.upsert_replies(replies_by_id)
+        return count
+
+    def run_once(self):
+        """
+        等到最早的目标到期并轮询它
+        :return: 是否执行了轮询(收到停止信号时为 False)
+        """
+        run_at, target = self.scheduler.next_due()
+        if target is None:
+            return False
+        delay = run_at - time.time()
+        if delay > 0 and self.stop_event.wait(delay):
+            return False
+
+        target = self.scheduler.pop()
+        try:
+            with perf_timer(f"轮询 {target.key}"):
+                count = self.poll(target)
+            target.adjust(count, self.min_interval, self.max_interval)
+            METRICS.inc('twitter_daemon_polls_total', {'target': target.key, 'status': 'ok'})
+            logger.info(f"{target.key} 新推文 {count} 条，{target.interval:.0f} 秒后再次轮询")
+        except Exception as e:
+            target.failures += 1
+            target.interval = min(self.max_interval, self.min_interval * (2 ** target.failures))
+            METRICS.inc('twitter_daemon_polls_total', {'target': target.key, 'status': 'error'})
+            logger.error(f"轮询 {target.key} 失败: {str(e)}，{target.interval:.0f} 秒后重试")
+        finally:
+            if self.client.cache:
+                self.client.cache.save()
+        self.scheduler.schedule(target, time.time() + target.interval)
+        return True
+
+    def run(self, max_polls=None):
+        """
+        持续轮询直到收到停止信号
+        :param max_polls: 可选的轮询次数上限
+        :return: 执行的轮询次数
+        """
+        polls = 0
+        logger.info(f"常驻模式已启动，关注 {len(self.scheduler)} 个目标")
+        usernames = [target.name for target in self.targets if target.kind == 'user']
+        try:
+            self.client.user_resolver.resolve_many(usernames)
+        except Exception as e:
+            logger.error(f"批量解析用户名失败: {str(e)}")
+        while not self.stop_event.is_set() and (max_polls is None or polls < max_polls):
+            if not self.run_once():
+                break
+            polls += 1
+        self.checkpoints.save()
+        logger.info(f"常驻模式已停止，共轮询 {polls} 次")
+        return polls
+
+    def stop(self, *args):
+        """停止轮询(可作为信号处理函数)"""
+        self.stop_event.set()
+
+def parse_args(argv=None):
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description='常驻模式：持续轮询关注列表中的用户和首页时间线')
+    parser.add_argument('-u', '--users', nargs='+', help='关注的用户名')
+    parser.add_argument('-f', '--users-file', help='用户名列表文件，每行一个，# 之后为注释')
+    parser.add_argument('--home', action='store_true', help='同时轮询首页时间线')
+    parser.add_argument('--store', default=CONFIG.get('store_file', 'tweets.db'), help='写入的 SQLite 推文库')
+    parser.add_argument('--min-interval', type=float, default=DAEMON_MIN_INTERVAL, help='最短轮询间隔(秒)')
+    parser.add_argument('--max-interval', type=float, default=DAEMON_MAX_INTERVAL, help='最长轮询间隔(秒)')
+    parser.add_argument('--metrics-file', help='停止时写出指标')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """常驻模式入口"""
+    args = parse_args(argv)
+    targets = [WatchTarget(name) for name in load_usernames(args.users, args.users_file)]
+    if args.home:
+        targets.append(WatchTarget('home', kind='home'))
+    if not targets:
+        logger.error("关注列表为空")
+        return 2
+
+    client = RetryableTwitterClient(cache=TweetCache())
+    if not client.clients:
+        logger.error("API客户端初始化失败")
+        return 1
+
+    store = TweetStore(args.store)
+    daemon = TwitterDaemon(targets, client=client, store=store,
+                           min_interval=args.min_interval, max_interval=args.max_interval)
+    signal.signal(signal.SIGINT, daemon.stop)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    try:
+        daemon.run()
+    finally:
+        store.close()
+        if args.metrics_file:
+            METRICS.dump(args.metrics_file)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,15 +1,26 @@
 import os
+import sys
 import time
+import argparse
 import json
 import logging
+import threading
 import tweepy
 import urllib3
 import ssl
+import tempfile
+import bisect
+from collections import OrderedDict
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, Future
+from requests.adapters import HTTPAdapter
 from requests.exceptions import SSLError
 from urllib3.exceptions import SSLError as URLLibSSLError
 import logging.handlers
+import queue
+import atexit
+from contextlib import contextmanager
 import colorama
 from colorama import Fore, Style
 
@@ -29,29 +40,116 @@ def load_config():
         logger.error(f"加载配置文件时发生错误: {str(e)}")
         raise
 
+# 日志文件(日志系统在读取配置之前初始化，这些参数不放在 config.json 中)
+LOG_FILE = 'twitter_scraper.log'
+PERF_LOG_FILE = 'twitter_scraper.perf.log'
+ERROR_LOG_FILE = 'twitter_scraper.error.log'
+LOG_MAX_BYTES = 10 * 1024 * 1024  # 主日志和错误日志按大小轮转
+LOG_BACKUP_COUNT = 5              # 保留的历史日志文件数
+PERF_LOG_BACKUP_DAYS = 14         # 性能日志按天轮转，保留天数
+
+_log_listeners = []
+
+def _start_queue_listener(target_logger, handlers):
+    """
+    让日志记录只放入内存队列，由后台线程写入文件和控制台，调用方不等待磁盘和终端I/O
+    :param target_logger: 要接入队列的 logger
+    :param handlers: 后台线程使用的实际处理器
+    """
+    log_queue = queue.SimpleQueue()
+    target_logger.handlers = [logging.handlers.QueueHandler(log_queue)]
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    _log_listeners.append(listener)
+
+def stop_logging():
+    """写完队列中剩余的日志并停止后台线程"""
+    while _log_listeners:
+        _log_listeners.pop().stop()
+
 # 配置日志
 def setup_logging():
-    """配置日志系统"""
+    """
+    配置日志系统：主日志、错误日志和控制台经由队列异步写入，
+    性能日志使用独立的 performance logger 写入 .perf.log
+    :return: 根 logger
+    """
+    stop_logging()
     formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-    
-    # 只保留主日志和控制台输出
-    handlers = [
-        logging.FileHandler('twitter_scraper.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-    
-    for handler in handlers:
-        handler.setFormatter(formatter)
-        handler.setLevel(logging.INFO)
-    
+    detail_formatter = logging.Formatter('%(asctime)s - %(levelname)s - [%(name)s] - %(message)s',
+                                         datefmt='%Y-%m-%d %H:%M:%S')
+
+    main_handler = logging.handlers.RotatingFileHandler(
+        LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8')
+    main_handler.setFormatter(formatter)
+    main_handler.setLevel(logging.INFO)
+
+    error_handler = logging.handlers.RotatingFileHandler(
+        ERROR_LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8')
+    error_handler.setFormatter(detail_formatter)
+    error_handler.setLevel(logging.ERROR)
+
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(formatter)
+    console_handler.setLevel(logging.INFO)
+
     logger = logging.getLogger()
     logger.setLevel(logging.INFO)
-    logger.handlers = handlers
-    
+    _start_queue_listener(logger, [main_handler, error_handler, console_handler])
+
+    perf_handler = logging.handlers.TimedRotatingFileHandler(
+        PERF_LOG_FILE, when='midnight', backupCount=PERF_LOG_BACKUP_DAYS, encoding='utf-8')
+    perf_handler.setFormatter(detail_formatter)
+    perf_logger = logging.getLogger('performance')
+    perf_logger.setLevel(logging.INFO)
+    perf_logger.propagate = False
+    _start_queue_listener(perf_logger, [perf_handler])
+
     return logger
 
 # 初始化日志系统
 logger = setup_logging()
+perf_logger = logging.getLogger('performance')
+atexit.register(stop_logging)
+
+@contextmanager
+def perf_timer(name):
+    """
+    记录一段操作的耗时到性能日志
+    :param name: 操作名称
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        perf_logger.info(f"{name} 耗时: {time.perf_counter() - started:.2f}秒")
+
+class ProgressReporter:
+    """把逐条/逐页的进度合并成定期汇总，最多每 interval 秒输出一次"""
+
+    def __init__(self, label, interval=None):
+        self.label = label
+        self.interval = LOG_PROGRESS_INTERVAL if interval is None else interval
+        self.tweets = 0
+        self.replies = 0
+        self._last_report = time.monotonic()
+
+    def update(self, tweets, replies=0):
+        """
+        累加进度，距离上次输出超过间隔时输出一次汇总
+        :param tweets: 新增推文数
+        :param replies: 新增评论数
+        """
+        self.tweets += tweets
+        self.replies += replies
+        now = time.monotonic()
+        if now - self._last_report >= self.interval:
+            self._last_report = now
+            logger.info(f"{self.label}: 已获取 {self.tweets} 条推文, {self.replies} 条评论")
+
+    def done(self):
+        """输出最终汇总"""
+        logger.info(f"{self.label}: 共获取 {self.tweets} 条推文, {self.replies} 条评论")
 
 # 加载环境变量和配置
 load_dotenv()
@@ -62,22 +160,888 @@ MIN_RESULTS_PER_REQUEST = CONFIG['min_results_per_request']  # 每次请求最
 MAX_RESULTS_PER_REQUEST = 100   # Twitter API支持最大100条
 RATE_LIMIT_WINDOW = CONFIG['rate_limit_window']  # 速率限制窗口(秒)
 TWITTER_ACCOUNTS = CONFIG['twitter_accounts']     # Twitter账号配置
-EXPORT_FORMATS = ['json', 'csv']            # 支持的导出格式
+EXPORT_FORMATS = ['json', 'jsonl', 'csv', 'parquet']  # 支持的导出格式
+MAX_CONCURRENT_PER_CLIENT = CONFIG.get('max_concurrent_requests_per_client', 4)  # 每个客户端同时进行的请求数
+REPLY_FETCH_WORKERS = CONFIG.get('reply_fetch_workers', 8)  # 并发获取评论的线程数
+SEARCH_QUERY_MAX_LENGTH = CONFIG.get('search_query_max_length', 512)  # 搜索查询字符串最大长度
+CACHE_FILE = CONFIG.get('cache_file', 'twitter_cache.json')        # 缓存文件路径
+CACHE_EXPIRE_HOURS = CONFIG.get('cache_expire_hours', 24)          # 缓存过期时间(小时)
+MAX_CACHE_SIZE = CONFIG.get('max_cache_size', 100 * 1024 * 1024)   # 缓存最大字节数
+CACHEABLE_TIMELINES = ('get_users_tweets',)  # 可缓存的时间线端点(首页时间线需要实时数据)
+CHECKPOINT_FILE = CONFIG.get('checkpoint_file', 'twitter_checkpoints.json')  # 增量抓取检查点文件
+REPLY_REFRESH_HOURS = CONFIG.get('reply_refresh_hours', 6)  # 已抓取会话的评论刷新间隔(小时)
+SEARCH_RECENT_DAYS = 7  # search_recent_tweets 只能搜索最近7天的推文
+CRAWL_STATE_DIR = CONFIG.get('crawl_state_dir', 'crawl_state')  # 可续抓的抓取日志目录
+PAGE_DELAY = CONFIG.get('page_delay', 2)  # 翻页之间的等待时间(秒)
+API_BASE_URL = CONFIG.get('api_base_url')  # 可选的API地址，例如指向 mock_twitter_api.py 启动的本地模拟服务
+PARQUET_COMPRESSION = CONFIG.get('parquet_compression', 'zstd')  # Parquet 压缩算法
+PARQUET_BATCH_SIZE = CONFIG.get('parquet_batch_size', 10000)    # 每个 Parquet 行组的行数
+LOG_PROGRESS_INTERVAL = CONFIG.get('log_progress_interval', 5)  # 抓取进度汇总的输出间隔(秒)
+USER_CACHE_HOURS = CONFIG.get('user_cache_hours', 24)            # 用户名->用户ID 缓存有效期(小时)
+USER_NOT_FOUND_CACHE_HOURS = CONFIG.get('user_not_found_cache_hours', 1)  # 不存在的用户名的缓存有效期(小时)
+REPLY_MAX_CONVERSATIONS = CONFIG.get('reply_max_conversations_per_page', 0)  # 每页最多搜索评论的会话数，0 表示不限制
+USER_LOOKUP_BATCH_SIZE = 100  # get_users 每次最多查询100个用户名
+# 评论搜索请求的字段，referenced_tweets/in_reply_to_user_id 用于重建回复树
+REPLY_TWEET_FIELDS = ['created_at', 'text', 'author_id', 'conversation_id', 'public_metrics', 'referenced_tweets',
+                      'in_reply_to_user_id']
 
 # 禁用SSL警告
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 # 初始化colorama
 colorama.init()
 
-class RetryableTwitterClient:
+def _optional_int(value):
+    return int(value) if value is not None else None
+
+class TweetRecord:
+    """
+    只保留抓取和导出用到的字段的紧凑推文记录，API响应到达后立即转换，
+    不在内存中保留 tweepy.Tweet 及其原始数据字典
+    """
+    __slots__ = ('id', 'created_at', 'text', 'author_id', 'conversation_id', 'reply_count',
+                 'referenced_tweets', 'in_reply_to_user_id', 'replies')
+
+    def __init__(self, id, text, created_at=None, author_id=None, conversation_id=None, replies=(),
+                 reply_count=None, referenced_tweets=(), in_reply_to_user_id=None):
+        self.id = id
+        self.text = text
+        self.created_at = created_at
+        self.author_id = author_id
+        self.conversation_id = conversation_id
+        self.reply_count = reply_count              # public_metrics.reply_count，未请求该字段时为 None
+        self.referenced_tweets = referenced_tweets  # ((类型, 推文ID), ...)
+        self.in_reply_to_user_id = in_reply_to_user_id
+        self.replies = replies
+
+    @classmethod
+    def from_tweet(cls, tweet):
+        """
+        从 tweepy.Tweet 转换
+        :param tweet: tweepy.Tweet 对象
+        :return: TweetRecord
+        """
+        metrics = tweet.public_metrics or {}
+        return cls(tweet.id, tweet.text, tweet.created_at, _optional_int(tweet.author_id),
+                   _optional_int(tweet.conversation_id),
+                   reply_count=metrics.get('reply_count'),
+                   referenced_tweets=tuple((ref.type, ref.id) for ref in tweet.referenced_tweets or ()),
+                   in_reply_to_user_id=_optional_int(tweet.in_reply_to_user_id))
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        从 API 格式的字典转换(缓存、抓取日志和本地库都使用这种格式)
+        :param data: 字典，时间为 API 的时间字符串
+        :return: TweetRecord
+        """
+        created_at = data.get('created_at')
+        return cls(
+            int(data['id']),
+            data['text'],
+            tweepy.utils.parse_datetime(created_at) if created_at else None,
+            _optional_int(data.get('author_id')),
+            _optional_int(data.get('conversation_id')),
+            tuple(cls.from_dict(reply) for reply in data.get('replies') or ()),
+            (data.get('public_metrics') or {}).get('reply_count'),
+            tuple((ref['type'], int(ref['id'])) for ref in data.get('referenced_tweets') or ()),
+            _optional_int(data.get('in_reply_to_user_id'))
+        )
+
+    def to_dict(self):
+        """
+        转换为 API 格式的字典
+        :return: 可JSON序列化的字典(评论递归转换)
+        """
+        data = {'id': str(self.id), 'text': self.text}
+        if self.created_at:
+            data['created_at'] = self.created_at.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+        if self.author_id is not None:
+            data['author_id'] = str(self.author_id)
+        if self.conversation_id is not None:
+            data['conversation_id'] = str(self.conversation_id)
+        if self.reply_count is not None:
+            data['public_metrics'] = {'reply_count': self.reply_count}
+        if self.referenced_tweets:
+            data['referenced_tweets'] = [{'type': kind, 'id': str(tweet_id)} for kind, tweet_id in self.referenced_tweets]
+        if self.in_reply_to_user_id is not None:
+            data['in_reply_to_user_id'] = str(self.in_reply_to_user_id)
+        if self.replies:
+            data['replies'] = [reply.to_dict() for reply in self.replies]
+        return data
+
+    @property
+    def may_have_replies(self):
+        """
+        是否需要搜索评论：转推和评论本身不是会话根推文，按 conversation_id 搜不到属于它的评论；
+        已知评论数为 0 时也不需要搜索
+        """
+        if any(kind == 'retweeted' for kind, _ in self.referenced_tweets):
+            return False
+        if self.conversation_id is not None and self.conversation_id != self.id:
+            return False
+        return self.reply_count is None or self.reply_count > 0
+
+    @property
+    def in_reply_to_id(self):
+        """直接回复的推文ID，不是回复时为 None"""
+        for kind, tweet_id in self.referenced_tweets:
+            if kind == 'replied_to':
+                return tweet_id
+        return None
+
+    def __repr__(self):
+        return f"TweetRecord(id={self.id}, text={self.text!r})"
+
+def to_records(tweets):
+    """
+    把API响应中的推文转换为 TweetRecord 列表
+    :param tweets: tweepy.Tweet 列表，可以为 None
+    :return: TweetRecord 列表
+    """
+    return [TweetRecord.from_tweet(tweet) for tweet in tweets or []]
+
+class ConversationIndex:
+    """
+    会话评论树：按回复关系维护 父推文ID -> 子评论ID 的有序列表，评论可以分批加入。
+    子评论按ID插入排序(推文ID随发布时间递增)，导出时按树的先序遍历输出，不需要对整个会话重新排序
+    """
+
+    def __init__(self):
+        self.nodes = {}          # 评论ID -> TweetRecord
+        self.children = {}       # 父推文ID -> 有序的子评论ID列表
+        self.conversations = {}  # 会话ID -> 有序的评论ID列表，用于找出父评论缺失的分支
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, tweet_id):
+        return tweet_id in self.nodes
+
+    @staticmethod
+    def parent_of(reply):
+        """回复的推文ID，没有 referenced_tweets 时(例如旧缓存)挂到会话根推文下"""
+        return reply.in_reply_to_id or reply.conversation_id
+
+    def add(self, reply):
+        """
+        加入一条评论，已存在时只更新内容
+        :param reply: 评论的 TweetRecord
+        :return: 是否为新评论
+        """
+        is_new = reply.id not in self.nodes
+        self.nodes[reply.id] = reply
+        if is_new:
+            bisect.insort(self.children.setdefault(self.parent_of(reply), []), reply.id)
+            bisect.insort(self.conversations.setdefault(reply.conversation_id, []), reply.id)
+        return is_new
+
+    def add_many(self, replies):
+        """
+        加入多条评论
+        :return: 新评论数
+        """
+        return sum(self.add(reply) for reply in replies)
+
+    def get_children(self, tweet_id):
+        """
+        :param tweet_id: 推文或评论ID
+        :return: 直接回复它的评论列表，按发布先后排列
+        """
+        return [self.nodes[child_id] for child_id in self.children.get(tweet_id, ())]
+
+    def walk(self, root_id):
+        """
+        先序遍历会话，父评论不在索引中的分支挂在根推文下
+        :param root_id: 会话根推文ID
+        :return: (深度, 评论) 生成器，根推文的直接回复深度为 1
+        """
+        visited = set()
+        stack = [(1, child_id) for child_id in reversed(self.children.get(root_id, ()))]
+        orphans = (reply_id for reply_id in self.conversations.get(root_id, ())
+                   if self.parent_of(self.nodes[reply_id]) not in self.nodes
+                   and self.parent_of(self.nodes[reply_id]) != root_id)
+        while True:
+            if not stack:
+                orphan_id = next((reply_id for reply_id in orphans if reply_id not in visited), None)
+                if orphan_id is None:
+                    return
+                stack.append((1, orphan_id))
+            depth, reply_id = stack.pop()
+            visited.add(reply_id)
+            yield depth, self.nodes[reply_id]
+            stack.extend((depth + 1, child_id) for child_id in reversed(self.children.get(reply_id, ())))
+
+    def thread(self, root_id):
+        """
+        :param root_id: 会话根推文ID
+        :return: 按先序遍历排列的评论列表
+        """
+        return [reply for _, reply in self.walk(root_id)]
+
+def serialize_tweet(tweet):
+    """
+    将推文记录转换为可JSON序列化的字典
+    :param tweet: TweetRecord
+    :return: API 格式的字典(评论递归转换)
+    """
+    return tweet.to_dict()
+
+def deserialize_tweet(data):
+    """
+    将缓存中的字典还原为推文记录
+    :param data: serialize_tweet 生成的字典，兼容旧版缓存中的原始API数据
+    :return: TweetRecord
+    """
+    return TweetRecord.from_dict(data)
+
+def write_json_atomic(path, data):
+    """
+    原子写入JSON文件：先写同目录临时文件并落盘，再替换目标文件
+    :param path: 目标文件路径
+    :param data: 可JSON序列化的数据
+    """
+    target_dir = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp_', suffix='.json', dir=target_dir)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+class TweetCache:
+    """带过期时间和按大小LRU淘汰的磁盘缓存"""
+
+    def __init__(self, cache_file=CACHE_FILE, expire_hours=CACHE_EXPIRE_HOURS, max_size=MAX_CACHE_SIZE):
+        self.cache_file = cache_file
+        self.expire_seconds = expire_hours * 3600
+        self.max_size = max_size
+        self.entries = OrderedDict()  # 按最近使用顺序排列，最早使用的在前
+        self.total_size = 0
+        self.dirty = False
+        self._lock = threading.RLock()
+        self._save_lock = threading.Lock()  # 保证并发保存时后写入的总是较新的快照
+        self.load()
+
+    def _is_expired(self, entry):
+        return time.time() - entry['timestamp'] > self.expire_seconds
+
+    def load(self):
+        """从缓存文件加载未过期的数据"""
+        if not os.path.exists(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.error(f"加载缓存文件失败: {str(e)}")
+            return
+
+        with self._lock:
+            for key, entry in data.items():
+                # 跳过旧格式或损坏的条目
+                if not isinstance(entry, dict) or 'value' not in entry or not isinstance(entry.get('timestamp'), (int, float)):
+                    self.dirty = True
+                    continue
+                if self._is_expired(entry):
+                    self.dirty = True
+                    continue
+                entry['size'] = len(json.dumps(entry['value'], ensure_ascii=False))
+                self.entries[key] = entry
+                self.total_size += entry['size']
+            self._evict()
+        logger.info(f"已加载 {len(self.entries)} 条缓存数据")
+
+    def get(self, key):
+        """
+        读取缓存
+        :param key: 缓存键
+        :return: 缓存值，不存在或已过期时返回 None
+        """
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if self._is_expired(entry):
+                self._remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry['value']
+
+    def set(self, key, value):
+        """
+        写入缓存，超出大小限制时淘汰最久未使用的条目
+        :param key: 缓存键
+        :param value: 可JSON序列化的值
+        """
+        try:
+            size = len(json.dumps(value, ensure_ascii=False))
+        except (TypeError, ValueError) as e:
+            logger.error(f"添加缓存数据失败: {str(e)}")
+            return
+
+        with self._lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = {'value': value, 'timestamp': time.time(), 'size': size}
+            self.total_size += size
+            self.dirty = True
+            self._evict()
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        self.total_size -= entry['size']
+        self.dirty = True
+
+    def _evict(self):
+        while self.entries and self.total_size > self.max_size:
+            key = next(iter(self.entries))
+            self._remove(key)
+
+    def save(self):
+        """原子写入缓存文件，避免崩溃时留下损坏的文件"""
+        with self._save_lock:
+            with self._lock:
+                if not self.dirty:
+                    return
+                data = {key: {'value': entry['value'], 'timestamp': entry['timestamp']}
+                        for key, entry in self.entries.items()}
+                self.dirty = False
+
+            try:
+                write_json_atomic(self.cache_file, data)
+            except Exception as e:
+                logger.error(f"保存缓存文件失败: {str(e)}")
+                with self._lock:
+                    self.dirty = True
+
+class CheckpointStore:
+    """按用户ID记录已抓取的最大推文ID及各会话评论的刷新时间，用于增量抓取"""
+
+    def __init__(self, checkpoint_file=CHECKPOINT_FILE):
+        self.checkpoint_file = checkpoint_file
+        self.users = {}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """从检查点文件加载数据"""
+        if not os.path.exists(self.checkpoint_file):
+            return
+        try:
+            with open(self.checkpoint_file, 'r', encoding='utf-8') as f:
+                self.users = json.load(f)
+        except Exception as e:
+            logger.error(f"加载检查点文件失败: {str(e)}")
+
+    def save(self):
+        """原子写入检查点文件"""
+        with self._save_lock:
+            with self._lock:
+                data = json.loads(json.dumps(self.users))
+            try:
+                write_json_atomic(self.checkpoint_file, data)
+            except Exception as e:
+                logger.error(f"保存检查点文件失败: {str(e)}")
+
+    def get_since_id(self, user_id):
+        """
+        获取用户已抓取的最大推文ID
+        :param user_id: 用户ID
+        :return: 推文ID，没有检查点时返回 None
+        """
+        with self._lock:
+            since_id = self.users.get(str(user_id), {}).get('since_id')
+        return int(since_id) if since_id else None
+
+    def update(self, user_id, tweets):
+        """
+        记录本次抓取到的推文，推进 since_id 并登记会话以便之后刷新评论
+        :param user_id: 用户ID
+        :param tweets: 推文列表
+        """
+        if not tweets:
+            return
+        # tweets 包含多页推文，每页的搜索上限不适用于整体
+        self.record_conversations(user_id, tweets, max_conversations=0)
+        self.advance(user_id, max(tweet.id for tweet in tweets))
+
+    def record_conversations(self, user_id, tweets, max_conversations=REPLY_MAX_CONVERSATIONS, candidates_only=True):
+        """
+        登记已抓取的会话，之后按刷新间隔更新其评论；与抓取时一样只登记需要搜索评论的推文，
+        转推、评论和没有评论的推文不登记，避免刷新时为它们消耗搜索配额
+        :param user_id: 用户ID
+        :param tweets: 推文列表
+        :param max_conversations: 最多登记的会话数，0 表示不限制
+        :param candidates_only: 为 False 时登记全部推文(例如流式收到的新推文，评论数还没有意义)
+        """
+        if candidates_only:
+            tweets = rank_reply_candidates(tweets, max_conversations)
+        now = time.time()
+        with self._lock:
+            checkpoint = self.users.setdefault(str(user_id), {'since_id': None, 'conversations': {}})
+            for tweet in tweets:
+                checkpoint['conversations'][str(tweet.id)] = {
+                    'created_at': tweet.created_at.timestamp() if tweet.created_at else now,
+                    'refreshed_at': now
+                }
+
+    def advance(self, user_id, max_id):
+        """
+        推进用户的 since_id
+        :param user_id: 用户ID
+        :param max_id: 本次抓取到的最大推文ID
+        """
+        if not max_id:
+            return
+        with self._lock:
+            checkpoint = self.users.setdefault(str(user_id), {'since_id': None, 'conversations': {}})
+            if not checkpoint['since_id'] or max_id > int(checkpoint['since_id']):
+                checkpoint['since_id'] = str(max_id)
+            checkpoint['updated_at'] = time.time()
+
+    def get_stale_conversations(self, user_id, refresh_hours=REPLY_REFRESH_HOURS):
+        """
+        获取需要刷新评论的会话，同时清理超出搜索时间范围的会话
+        :param user_id: 用户ID
+        :param refresh_hours: 刷新间隔(小时)
+        :return: 推文ID列表
+        """
+        now = time.time()
+        oldest = now - SEARCH_RECENT_DAYS * 86400
+        with self._lock:
+            conversations = self.users.get(str(user_id), {}).get('conversations', {})
+            for tweet_id in [tid for tid, info in conversations.items() if info['created_at'] < oldest]:
+                del conversations[tweet_id]
+            return [int(tweet_id) for tweet_id, info in conversations.items()
+                    if now - info['refreshed_at'] >= refresh_hours * 3600]
+
+    def mark_refreshed(self, user_id, tweet_ids):
+        """
+        记录会话评论的刷新时间
+        :param user_id: 用户ID
+        :param tweet_ids: 推文ID列表
+        """
+        now = time.time()
+        with self._lock:
+            conversations = self.users.get(str(user_id), {}).get('conversations', {})
+            for tweet_id in tweet_ids:
+                if str(tweet_id) in conversations:
+                    conversations[str(tweet_id)]['refreshed_at'] = now
+
+class CrawlJournal:
+    """
+    追加写入的抓取日志(JSON Lines)，记录目标已完成的页、待获取评论的推文和下一页令牌，
+    每页完成时落盘，中断后重新运行可从日志续抓，不再为已有的页消耗API调用；
+    评论获取失败的推文记为待获取，续抓时只重新获取这些会话
+    """
+
+    def __init__(self, target, params, state_dir=CRAWL_STATE_DIR):
+        os.makedirs(state_dir, exist_ok=True)
+        self.path = os.path.join(state_dir, f'{target}.jsonl')
+        self.params = json.loads(json.dumps(
+            {key: value for key, value in params.items() if key != 'pagination_token'},
+            sort_keys=True, default=str
+        ))
+        # [{'page': 页号, 'next_token': 下一页令牌, 'offset': 该页在日志中的位置, 'replies': [评论记录的位置],
+        #   'pending': 待获取评论的推文ID集合，还没获取过评论时为 None}]
+        self.pages = []
+        self._load()
+        self.file = open(self.path, 'a', encoding='utf-8')
+        if not os.path.getsize(self.path):
+            self._append({'type': 'start', 'params': self.params})
+
+    def _load(self):
+        """校验并索引已有日志，丢弃参数不一致的日志和崩溃时写了一半的末行"""
+        if not os.path.exists(self.path):
+            return
+        good_end = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    break
+                if not line.endswith(b'\n'):
+                    break
+                if event['type'] == 'start' and event['params'] != self.params:
+                    logger.info(f"抓取参数已变化，丢弃旧的抓取日志: {self.path}")
+                    self.pages = []
+                    good_end = 0
+                    break
+                if event['type'] == 'page':
+                    self.pages.append({'page': event['page'], 'next_token': event['next_token'],
+                                       'offset': good_end, 'replies': [], 'pending': None})
+                elif event['type'] == 'replies' and 0 < event['page'] <= len(self.pages):
+                    entry = self.pages[event['page'] - 1]
+                    entry['replies'].append(good_end)
+                    entry['pending'] = set(event.get('pending', ()))
+                good_end += len(line)
+        with open(self.path, 'r+b') as f:
+            f.truncate(good_end)
+        if self.pages:
+            logger.info(f"从抓取日志恢复 {len(self.pages)} 页: {self.path}")
+
+    def _append(self, event):
+        """
+        追加一条记录并落盘
+        :return: 记录在日志中的位置
+        """
+        offset = os.fstat(self.file.fileno()).st_size
+        self.file.write(json.dumps(event, ensure_ascii=False) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return offset
+
+    @property
+    def next_token(self):
+        """最后一页记录的下一页令牌"""
+        return self.pages[-1]['next_token'] if self.pages else None
+
+    @property
+    def reached_end(self):
+        """日志中的最后一页已经是时间线的最后一页"""
+        return bool(self.pages) and not self.pages[-1]['next_token']
+
+    @property
+    def pending_replies(self):
+        """评论还没获取或获取失败的推文数(还没获取过评论的页按 1 计)"""
+        return sum(1 if entry['pending'] is None else len(entry['pending']) for entry in self.pages)
+
+    def replay(self):
+        """
+        按页号读出打开日志时已有的页，同一页多次记录的评论合并在一起
+        :return: 生成 (页号, 推文列表, {推文ID: 评论列表} 或 None, 待获取评论的推文ID集合) 的生成器
+        """
+        # 重放过程中会为重新获取的评论追加记录，只读取快照中的位置
+        snapshot = [(entry['page'], entry['offset'], tuple(entry['replies']), set(entry['pending'] or ()))
+                    for entry in self.pages]
+        with open(self.path, 'rb') as f:
+            for page, offset, reply_offsets, pending_ids in snapshot:
+                f.seek(offset)
+                tweets = [deserialize_tweet(tweet) for tweet in json.loads(f.readline())['tweets']]
+                replies_by_id = {} if reply_offsets else None
+                for reply_offset in reply_offsets:
+                    f.seek(reply_offset)
+                    for tweet_id, replies in json.loads(f.readline())['replies'].items():
+                        replies_by_id[int(tweet_id)] = [deserialize_tweet(reply) for reply in replies]
+                yield page, tweets, replies_by_id, pending_ids
+
+    def record_page(self, tweets, next_token):
+        """
+        记录一页推文(评论待获取)
+        :param tweets: 推文列表
+        :param next_token: 下一页令牌
+        :return: 页号
+        """
+        page = len(self.pages) + 1
+        offset = self._append({
+            'type': 'page',
+            'page': page,
+            'next_token': next_token,
+            'tweets': [serialize_tweet(tweet) for tweet in tweets]
+        })
+        self.pages.append({'page': page, 'next_token': next_token, 'offset': offset, 'replies': [], 'pending': None})
+        return page
+
+    def record_replies(self, page, tweets, failed_ids=()):
+        """
+        记录一页推文的评论，获取失败的推文不记录评论，记为待获取
+        :param page: 页号
+        :param tweets: 已挂上评论的推文列表(可以只是该页的一部分)
+        :param failed_ids: 评论获取失败的推文ID
+        """
+        failed_ids = set(failed_ids)
+        offset = self._append({
+            'type': 'replies',
+            'page': page,
+            'replies': {str(tweet.id): [serialize_tweet(reply) for reply in tweet.replies]
+                        for tweet in tweets if tweet.id not in failed_ids},
+            'pending': sorted(failed_ids)
+        })
+        entry = self.pages[page - 1]
+        entry['replies'].append(offset)
+        entry['pending'] = failed_ids
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+    def complete(self):
+        """
+        目标抓取完成，删除日志；仍有评论待获取时保留日志，下次运行重新获取
+        :return: 是否已删除日志
+        """
+        self.close()
+        pending = self.pending_replies
+        if pending:
+            logger.warning(f"{pending} 条推文的评论获取失败，保留抓取日志，下次运行重新获取: {self.path}")
+            return False
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        return True
+
+def make_cache_key(endpoint, params):
+    """
+    根据端点和请求参数生成缓存键
+    :param endpoint: API端点名称
+    :param params: 请求参数
+    :return: 缓存键字符串
+    """
+    return f"{endpoint}:{json.dumps(params, sort_keys=True, default=str)}"
+
+class MetricsRegistry:
+    """进程内指标注册表：计数器、仪表和直方图，可导出为 Prometheus 文本或 JSON"""
+
+    DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
     def __init__(self):
+        self._lock = threading.Lock()
+        self.descriptions = {}  # 指标名 -> (类型, 说明)
+        self.values = {}        # 指标名 -> {标签元组: 值}
+
+    def describe(self, name, metric_type, help_text):
+        """
+        登记指标
+        :param name: 指标名
+        :param metric_type: counter/gauge/histogram
+        :param help_text: 说明
+        """
+        self.descriptions[name] = (metric_type, help_text)
+        self.values.setdefault(name, {})
+
+    @staticmethod
+    def _key(labels):
+        return tuple(sorted((labels or {}).items()))
+
+    def inc(self, name, labels=None, value=1):
+        """计数器累加"""
+        key = self._key(labels)
+        with self._lock:
+            series = self.values.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name, labels=None, value=0):
+        """设置仪表值"""
+        with self._lock:
+            self.values.setdefault(name, {})[self._key(labels)] = value
+
+    def observe(self, name, labels=None, value=0):
+        """直方图记录一次观测值"""
+        key = self._key(labels)
+        with self._lock:
+            series = self.values.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = {'buckets': [0] * len(self.DEFAULT_BUCKETS), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.DEFAULT_BUCKETS):
+                if value <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def reset(self):
+        """清空所有指标值"""
+        with self._lock:
+            for series in self.values.values():
+                series.clear()
+
+    @staticmethod
+    def _format_labels(key, extra=None):
+        labels = list(key) + list(extra or [])
+        if not labels:
+            return ''
+        return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}'
+
+    def to_prometheus(self):
+        """导出为 Prometheus 文本格式"""
+        lines = []
+        with self._lock:
+            for name, series in self.values.items():
+                metric_type, help_text = self.descriptions.get(name, ('untyped', ''))
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {metric_type}')
+                for key, value in series.items():
+                    if metric_type == 'histogram':
+                        for bound, count in zip(self.DEFAULT_BUCKETS, value['buckets']):
+                            lines.append(f'{name}_bucket{self._format_labels(key, [("le", bound)])} {count}')
+                        lines.append(f'{name}_bucket{self._format_labels(key, [("le", "+Inf")])} {value["count"]}')
+                        lines.append(f'{name}_sum{self._format_labels(key)} {value["sum"]:.6f}')
+                        lines.append(f'{name}_count{self._format_labels(key)} {value["count"]}')
+                    else:
+                        lines.append(f'{name}{self._format_labels(key)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def to_dict(self):
+        """导出为可JSON序列化的字典"""
+        with self._lock:
+            return {
+                name: [{'labels': dict(key), 'value': value} for key, value in series.items()]
+                for name, series in self.values.items()
+            }
+
+    def dump(self, filename):
+        """
+        写入指标文件，.json 后缀写JSON，其他写 Prometheus 文本
+        :param filename: 文件名
+        """
+        with open(filename, 'w', encoding='utf-8') as f:
+            if filename.endswith('.json'):
+                json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+            else:
+                f.write(self.to_prometheus())
+
+METRICS = MetricsRegistry()
+METRICS.describe('twitter_requests_total', 'counter', '按端点、账号和结果统计的API请求数')
+METRICS.describe('twitter_request_duration_seconds', 'histogram', 'API请求耗时')
+METRICS.describe('twitter_retries_total', 'counter', '重试次数')
+METRICS.describe('twitter_rate_limited_total', 'counter', '429 响应次数')
+METRICS.describe('twitter_sleep_seconds_total', 'counter', '因退避、配额等待和翻页间隔而休眠的总时间')
+METRICS.describe('twitter_quota_remaining', 'gauge', '最近一次响应报告的剩余配额')
+METRICS.describe('twitter_quota_limit', 'gauge', '最近一次响应报告的配额上限')
+METRICS.describe('twitter_quota_reset_timestamp', 'gauge', '配额重置时间戳')
+METRICS.describe('twitter_reply_searches_skipped_total', 'counter', '根据评论数和引用关系跳过的评论搜索')
+
+def record_quota(endpoint, account, headers):
+    """
+    把响应头中的速率限制信息记录到指标
+    :param endpoint: API端点名称
+    :param account: 客户端名
+    :param headers: HTTP响应头
+    """
+    if not headers or 'x-rate-limit-remaining' not in headers:
+        return
+    labels = {'endpoint': endpoint, 'account': account}
+    METRICS.set('twitter_quota_remaining', labels, int(headers.get('x-rate-limit-remaining', 0)))
+    METRICS.set('twitter_quota_limit', labels, int(headers.get('x-rate-limit-limit', 0)))
+    METRICS.set('twitter_quota_reset_timestamp', labels, int(headers.get('x-rate-limit-reset', 0)))
+
+def metered_sleep(seconds, reason, endpoint=''):
+    """
+    休眠并记录休眠时间
+    :param seconds: 秒数
+    :param reason: 休眠原因(quota_wait/error_backoff/rate_limit/page_delay)
+    :param endpoint: API端点名称
+    """
+    METRICS.inc('twitter_sleep_seconds_total', {'reason': reason, 'endpoint': endpoint}, seconds)
+    time.sleep(seconds)
+
+class RateLimitScheduler:
+    """跟踪每个客户端在各端点上的剩余配额，把请求分配给余量最多的客户端"""
+
+    def __init__(self, client_names):
+        self.client_names = list(client_names)
+        self.quotas = {}      # (客户端名, 端点) -> {'limit', 'remaining', 'reset'}
+        self.in_flight = {name: 0 for name in self.client_names}
+        self.inactive = set()
+        self._lock = threading.Lock()
+
+    def _headroom(self, name, endpoint, now):
+        quota = self.quotas.get((name, endpoint))
+        if quota is None:
+            # 尚未获取到配额信息，视为余量充足
+            return float('inf')
+        if quota['reset'] <= now:
+            return quota['limit'] or float('inf')
+        return quota['remaining']
+
+    def acquire(self, endpoint):
+        """
+        为请求选择客户端并预占一次配额
+        :param endpoint: API端点名称
+        :return: (客户端名, 等待秒数)；所有客户端配额用完时客户端名为 None
+        """
+        now = time.time()
+        with self._lock:
+            candidates = [name for name in self.client_names if name not in self.inactive]
+            if not candidates:
+                raise Exception("所有API客户端都不可用")
+
+            best = max(candidates, key=lambda name: (self._headroom(name, endpoint, now), -self.in_flight[name]))
+            if self._headroom(best, endpoint, now) > 0:
+                quota = self.quotas.get((best, endpoint))
+                if quota and quota['reset'] <= now and not quota['limit']:
+                    # mark_exhausted 记录的配额不知道上限，窗口重置后删除，等响应头给出真实配额
+                    del self.quotas[(best, endpoint)]
+                elif quota:
+                    if quota['reset'] <= now:
+                        quota['remaining'] = quota['limit']
+                        quota['reset'] = now + RATE_LIMIT_WINDOW
+                    quota['remaining'] -= 1
+                self.in_flight[best] += 1
+                return best, 0
+
+            earliest_reset = min(self.quotas[(name, endpoint)]['reset'] for name in candidates)
+            return None, max(1, int(earliest_reset - now) + 1)
+
+    def release(self, name):
+        """请求结束后释放客户端"""
+        with self._lock:
+            self.in_flight[name] -= 1
+
+    def update(self, name, endpoint, headers):
+        """
+        根据响应头更新客户端在端点上的配额
+        :param name: 客户端名
+        :param endpoint: API端点名称
+        :param headers: HTTP响应头
+        """
+        if not headers or 'x-rate-limit-remaining' not in headers:
+            return
+        with self._lock:
+            self.quotas[(name, endpoint)] = {
+                'limit': int(headers.get('x-rate-limit-limit', 0)),
+                'remaining': int(headers.get('x-rate-limit-remaining', 0)),
+                'reset': int(headers.get('x-rate-limit-reset', 0))
+            }
+
+    def mark_exhausted(self, name, endpoint, reset_time):
+        """
+        标记客户端在端点上的配额已用完
+        :param name: 客户端名
+        :param endpoint: API端点名称
+        :param reset_time: 配额重置的时间戳
+        """
+        with self._lock:
+            quota = self.quotas.setdefault((name, endpoint), {'limit': 0, 'remaining': 0, 'reset': reset_time})
+            quota['remaining'] = 0
+            quota['reset'] = reset_time
+
+    def deactivate(self, name):
+        """停用客户端(例如认证失败)"""
+        with self._lock:
+            self.inactive.add(name)
+
+class ApiRedirectAdapter(HTTPAdapter):
+    """把发往 api.twitter.com 的请求转发到其他地址(如本地模拟服务)"""
+
+    def __init__(self, base_url, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = base_url.rstrip('/')
+
+    def send(self, request, **kwargs):
+        request.url = request.url.replace('https://api.twitter.com', self.base_url, 1)
+        return super().send(request, **kwargs)
+
+class RetryableTwitterClient:
+    def __init__(self, cache=None, accounts=None, api_base_url=API_BASE_URL):
         self.clients = []
-        self.current_index = 0
-        self.initialize_clients()
+        self.cache = cache
+        self.api_base_url = api_base_url
+        self._local = threading.local()
+        self.initialize_clients(accounts or TWITTER_ACCOUNTS)
+        self.clients_by_name = {client['name']: client for client in self.clients}
+        self.scheduler = RateLimitScheduler(self.clients_by_name)
+        self.user_resolver = UserResolver(self)
 
-    def initialize_clients(self):
+    def initialize_clients(self, accounts):
         """初始化多个Twitter API客户端"""
-        for account in TWITTER_ACCOUNTS:
+        for account in accounts:
             try:
                 client = tweepy.Client(
                     bearer_token=account['bearer_token'],
@@ -86,17 +1050,27 @@ class RetryableTwitterClient:
                     access_token=account['access_token'],
                     access_token_secret=account['access_token_secret']
                 )
+                # tweepy.Response 不携带HTTP头，通过会话钩子记录本线程最近一次响应的速率限制信息
+                client.session.hooks['response'].append(self._capture_headers)
+                if self.api_base_url:
+                    client.session.mount('https://api.twitter.com', ApiRedirectAdapter(self.api_base_url))
                 self.clients.append({
                     'name': account['name'],
                     'client': client,
-                    'is_active': True
+                    'is_active': True,
+                    'semaphore': threading.BoundedSemaphore(MAX_CONCURRENT_PER_CLIENT)
                 })
             except Exception as e:
                 logger.error(f"客户端 {account['name']} 初始化失败: {str(e)}")
 
+    def _capture_headers(self, response, *args, **kwargs):
+        """requests响应钩子，保存最近一次响应头"""
+        self._local.headers = response.headers
+
     def make_request(self, func, endpoint, *args, **kwargs):
         """
         发送API请求并处理速率限制
+        请求被分配给该端点剩余配额最多的客户端，只有所有客户端配额都用完时才等待
         :param func: API调用函数
         :param endpoint: API端点名称
         :return: API响应
@@ -105,68 +1079,222 @@ class RetryableTwitterClient:
         max_retries = 3
         
         while retries < max_retries:
-            current_client = self.clients[self.current_index]
-            
+            name, wait_time = self.scheduler.acquire(endpoint)
+            if name is None:
+                logger.warning(f"所有客户端的 {endpoint} 配额都已用完，等待 {wait_time} 秒")
+                metered_sleep(wait_time, 'quota_wait', endpoint)
+                continue
+
+            current_client = self.clients_by_name[name]
+            labels = {'endpoint': endpoint, 'account': name}
+            if retries:
+                METRICS.inc('twitter_retries_total', {'endpoint': endpoint})
+            started = time.perf_counter()
             try:
-                response = func(current_client['client'])
+                self._local.headers = None
+                with current_client['semaphore']:
+                    response = func(current_client['client'], *args, **kwargs)
+                METRICS.observe('twitter_request_duration_seconds', labels, time.perf_counter() - started)
+                METRICS.inc('twitter_requests_total', dict(labels, status='ok'))
                 
-                if hasattr(response, 'response') and hasattr(response.response, 'headers'):
-                    headers = response.response.headers
+                headers = self._local.headers
+                if headers:
+                    self.scheduler.update(name, endpoint, headers)
+                    record_quota(endpoint, name, headers)
                     limit = int(headers.get('x-rate-limit-limit', 0))
                     remaining = int(headers.get('x-rate-limit-remaining', 0))
                     reset_time = int(headers.get('x-rate-limit-reset', 0))
                     
-                    logger.info(f"API限制信息 - 限制: {limit}, 剩余: {remaining}, 重置时间: {reset_time}")
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(f"API限制信息 - 客户端: {name}, 端点: {endpoint}, 限制: {limit}, 剩余: {remaining}, 重置时间: {reset_time}")
                     
                     if limit > 0 and remaining < limit * 0.2:
-                        logger.warning(f"API请求次数即将用完，剩余: {remaining}/{limit}")
+                        logger.warning(f"客户端 {name} 的 {endpoint} 请求次数即将用完，剩余: {remaining}/{limit}")
                 
                 return response
                 
             except tweepy.TooManyRequests as e:
                 retries += 1
-                
+                METRICS.observe('twitter_request_duration_seconds', labels, time.perf_counter() - started)
+                METRICS.inc('twitter_requests_total', dict(labels, status='rate_limited'))
+                METRICS.inc('twitter_rate_limited_total', labels)
+                current_time = int(time.time())
+                reset_time = 0
                 if hasattr(e, 'response') and hasattr(e.response, 'headers'):
                     reset_time = int(e.response.headers.get('x-rate-limit-reset', 0))
-                    current_time = int(time.time())
-                    
-                    if reset_time > current_time:
-                        wait_time = reset_time - current_time
-                        logger.warning(f"遇到速率限制，等待 {wait_time} 秒后重试")
-                        time.sleep(wait_time)
-                    else:
-                        wait_time = min(300, (2 ** retries) * 5)
-                        logger.warning(f"未获取到重置时间，等待 {wait_time} 秒后重试")
-                        time.sleep(wait_time)
-                else:
-                    wait_time = min(300, (2 ** retries) * 5)
-                    logger.warning(f"无法获取速率限制信息，等待 {wait_time} 秒后重试")
-                    time.sleep(wait_time)
-                
-                if retries < max_retries:
-                    self.current_index = (self.current_index + 1) % len(self.clients)
-                    logger.info(f"切换到下一个客户端: {self.clients[self.current_index]['name']}")
+                    record_quota(endpoint, name, e.response.headers)
+                if reset_time <= current_time:
+                    reset_time = current_time + min(300, (2 ** retries) * 5)
+                    logger.warning(f"未获取到重置时间，客户端 {name} 暂停 {reset_time - current_time} 秒")
+
+                # 不在这里等待：下一轮会切换到其他有余量的客户端，全部用完时才按最早的重置时间等待
+                self.scheduler.mark_exhausted(name, endpoint, reset_time)
+                logger.warning(f"客户端 {name} 在 {endpoint} 遇到速率限制，切换客户端重试")
                 
+            except tweepy.Unauthorized as e:
+                retries += 1
+                METRICS.inc('twitter_requests_total', dict(labels, status='unauthorized'))
+                logger.error(f"客户端 {name} 认证失败，已停用: {str(e)}")
+                current_client['is_active'] = False
+                self.scheduler.deactivate(name)
+                if retries >= max_retries:
+                    raise
+
             except Exception as e:
                 retries += 1
+                METRICS.observe('twitter_request_duration_seconds', labels, time.perf_counter() - started)
+                METRICS.inc('twitter_requests_total', dict(labels, status='error'))
                 logger.error(f"请求失败: {str(e)}")
                 if retries >= max_retries:
                     raise
-                time.sleep(5)
+                metered_sleep(5, 'error_backoff', endpoint)
+
+            finally:
+                self.scheduler.release(name)
         
         raise Exception(f"达到最大重试次数 ({max_retries})")
 
+class UserResolver:
+    """
+    用户名->用户ID 解析：通过 get_users 每次批量查询最多100个用户名，
+    结果按有效期缓存在内存和磁盘缓存中，并发查询同一用户名时只发一次请求
+    """
+
+    def __init__(self, client, ttl_hours=USER_CACHE_HOURS, not_found_ttl_hours=USER_NOT_FOUND_CACHE_HOURS,
+                 batch_size=USER_LOOKUP_BATCH_SIZE):
+        self.client = client
+        self.ttl = ttl_hours * 3600
+        self.not_found_ttl = not_found_ttl_hours * 3600
+        self.batch_size = batch_size
+        self._resolved = {}   # 小写用户名 -> {'id': 用户ID 或 None, 'resolved_at': 时间戳}
+        self._inflight = {}   # 小写用户名 -> Future
+        self._lock = threading.Lock()
+
+    def _cached(self, key):
+        """读取未过期的解析结果，内存中没有时读取磁盘缓存"""
+        entry = self._resolved.get(key)
+        if entry is None and self.client.cache:
+            entry = self.client.cache.get(f'get_user:{key}')
+            if entry is not None and 'resolved_at' not in entry:
+                entry = None  # 旧版缓存没有解析时间，重新解析
+        if entry is None:
+            return None
+        ttl = self.ttl if entry['id'] is not None else self.not_found_ttl
+        if time.time() - entry['resolved_at'] > ttl:
+            return None
+        self._resolved[key] = entry
+        return entry
+
+    def _store(self, key, user_id):
+        entry = {'id': user_id, 'resolved_at': time.time()}
+        self._resolved[key] = entry
+        if self.client.cache:
+            self.client.cache.set(f'get_user:{key}', entry)
+
+    def _lookup(self, keys):
+        """
+        批量查询用户名
+        :param keys: 小写用户名列表
+        :return: {小写用户名: 用户ID 或 None}
+        """
+        found = {}
+        for start in range(0, len(keys), self.batch_size):
+            chunk = keys[start:start + self.batch_size]
+            response = self.client.make_request(tweepy.Client.get_users, 'get_users', usernames=chunk)
+            for user in (response.data or []) if response else []:
+                found[user.username.lower()] = int(user.id)
+        return {key: found.get(key) for key in keys}
+
+    def resolve_many(self, usernames):
+        """
+        解析多个用户名
+        :param usernames: 用户名列表
+        :return: {用户名: 用户ID，不存在时为 None}
+        """
+        keys = {username: username.lstrip('@').lower() for username in usernames}
+        results = {}
+        waiting = {}
+        owned = []
+        with self._lock:
+            for key in dict.fromkeys(keys.values()):
+                entry = self._cached(key)
+                if entry is not None:
+                    results[key] = entry['id']
+                elif key in self._inflight:
+                    # 其他线程正在查询这个用户名，等待它的结果
+                    waiting[key] = self._inflight[key]
+                else:
+                    self._inflight[key] = Future()
+                    owned.append(key)
+
+        if owned:
+            try:
+                found = self._lookup(owned)
+            except Exception as e:
+                with self._lock:
+                    for key in owned:
+                        self._inflight.pop(key).set_exception(e)
+                raise
+            with self._lock:
+                for key, user_id in found.items():
+                    self._store(key, user_id)
+                    self._inflight.pop(key).set_result(user_id)
+            results.update(found)
+            logger.info(f"批量解析 {len(owned)} 个用户名，找到 {sum(1 for user_id in found.values() if user_id)} 个")
+
+        for key, future in waiting.items():
+            results[key] = future.result()
+        return {username: results[key] for username, key in keys.items()}
+
+    def resolve(self, username):
+        """
+        解析单个用户名
+        :param username: 用户名
+        :return: 用户ID，不存在时返回 None
+        """
+        return self.resolve_many([username])[username]
+
 def get_tweet_params():
     """返回推文API请求参数"""
     return {
         'tweet_fields': [
             'created_at',
             'text',
-            'conversation_id'
+            'author_id',
+            'conversation_id',
+            'public_metrics',
+            'referenced_tweets'
         ],
         'max_results': MAX_RESULTS_PER_REQUEST
     }
 
+def rank_reply_candidates(tweets, max_conversations=REPLY_MAX_CONVERSATIONS):
+    """
+    挑选需要搜索评论的推文：跳过没有评论的推文、转推和评论，按评论数从多到少排序
+    :param tweets: TweetRecord 列表
+    :param max_conversations: 最多保留的会话数，0 表示不限制
+    :return: TweetRecord 列表
+    """
+    candidates = [tweet for tweet in tweets if tweet.may_have_replies]
+    # 评论数未知(旧缓存数据)的排在已知有评论的推文之后
+    candidates.sort(key=lambda tweet: -1 if tweet.reply_count is None else tweet.reply_count, reverse=True)
+    if max_conversations:
+        candidates = candidates[:max_conversations]
+    return candidates
+
+def select_reply_candidates(tweets, max_conversations=REPLY_MAX_CONVERSATIONS):
+    """
+    挑选一页推文中需要搜索评论的推文，并统计跳过的推文数
+    :param tweets: TweetRecord 列表
+    :param max_conversations: 每页最多搜索的会话数，0 表示不限制
+    :return: 推文ID列表
+    """
+    candidates = rank_reply_candidates(tweets, max_conversations)
+    skipped = len(tweets) - len(candidates)
+    if skipped:
+        METRICS.inc('twitter_reply_searches_skipped_total', value=skipped)
+    return [tweet.id for tweet in candidates]
+
 def handle_rate_limit(e, retry_count):
     """
     处理API速率限制
@@ -189,88 +1317,253 @@ def handle_rate_limit(e, retry_count):
         logger.warning("无法获取API重置时间，使用默认等待时间")
         return 300  # 等待5分钟
 
-def get_tweet_replies(client, tweet_id):
+def build_conversation_queries(tweet_ids, max_length=SEARCH_QUERY_MAX_LENGTH):
+    """
+    将多个会话ID用 OR 合并成不超过长度限制的搜索查询
+    :param tweet_ids: 推文ID列表
+    :param max_length: 单条查询的最大长度
+    :return: (查询字符串, 该查询包含的推文ID列表) 的列表
+    """
+    batches = []
+    query = ''
+    ids = []
+    for tweet_id in tweet_ids:
+        term = f'conversation_id:{tweet_id}'
+        candidate = f'{query} OR {term}' if query else term
+        if query and len(candidate) > max_length:
+            batches.append((query, ids))
+            query, ids = term, [tweet_id]
+        else:
+            query = candidate
+            ids.append(tweet_id)
+    if query:
+        batches.append((query, ids))
+    return batches
+
+def get_conversation_replies(client, query, tweet_ids):
     """
-    获取推文的评论
+    分页执行一条合并后的会话查询，每页结果加入回复树，并按 conversation_id 把评论分配给原推文
     :param client: Twitter客户端
-    :param tweet_id: 推文ID
-    :return: 评论列表
+    :param query: 合并后的查询字符串
+    :param tweet_ids: 查询中包含的推文ID列表
+    :return: {推文ID: 按回复树先序排列的评论列表}，任何一页请求失败时抛出异常，不返回不完整的结果
     """
-    try:
-        params = {
-            'query': f'conversation_id:{tweet_id}',
-            'tweet_fields': ['created_at', 'text', 'author_id'],
-            'max_results': 100
-        }
-        
-        replies = client.make_request(
-            lambda client: client.search_recent_tweets(**params),
-            'search_recent_tweets'
-        )
-        
-        if not replies or not hasattr(replies, 'data'):
-            return []
-            
-        return replies.data
-    except Exception as e:
-        logger.error(f"获取推文评论失败: {str(e)}")
+    index = ConversationIndex()
+    wanted = set(tweet_ids)
+    params = {
+        'query': query,
+        'tweet_fields': REPLY_TWEET_FIELDS,
+        'max_results': 100
+    }
+    while True:
+        replies = client.make_request(tweepy.Client.search_recent_tweets, 'search_recent_tweets', **params)
+        index.add_many(reply for reply in to_records(replies.data if replies else None)
+                       if reply.id != reply.conversation_id and reply.conversation_id in wanted)
+
+        next_token = replies.meta.get('next_token') if replies and replies.meta else None
+        if not next_token:
+            break
+        params['next_token'] = next_token
+    return {tweet_id: index.thread(tweet_id) for tweet_id in tweet_ids}
+
+def fetch_conversation_batches(client, tweet_ids, thread_name_prefix='replies'):
+    """
+    合并会话查询并用有界线程池并发执行
+    :param client: Twitter客户端
+    :param tweet_ids: 推文ID列表
+    :param thread_name_prefix: 线程名前缀
+    :return: {推文ID: 评论列表}，只包含成功完成的批次，失败批次的推文ID不在结果中
+    """
+    replies_by_id = {}
+    batches = build_conversation_queries(tweet_ids)
+    if not batches:
+        return replies_by_id
+    workers = max(1, min(REPLY_FETCH_WORKERS, len(batches)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=thread_name_prefix) as executor:
+        futures = [(executor.submit(get_conversation_replies, client, query, ids), ids) for query, ids in batches]
+        for future, ids in futures:
+            try:
+                replies_by_id.update(future.result())
+            except Exception as e:
+                logger.error(f"批量获取 {len(ids)} 个会话的评论失败，下次重新获取: {str(e)}")
+    return replies_by_id
+
+def fetch_replies_concurrently(client, tweets, failed=None):
+    """
+    批量合并会话查询，并使用有界线程池并发获取一页推文的评论，只搜索可能有评论的推文
+    :param client: Twitter客户端
+    :param tweets: 推文列表
+    :param failed: 可选集合，写入评论获取失败的推文ID
+    :return: 与推文顺序一致的评论列表
+    """
+    if not tweets:
         return []
 
+    replies_by_id = {}
+    pending_ids = []
+    for tweet_id in select_reply_candidates(tweets):
+        cached = client.cache.get(f'replies:{tweet_id}') if client.cache else None
+        if cached is not None:
+            replies_by_id[tweet_id] = [deserialize_tweet(reply) for reply in cached]
+        else:
+            pending_ids.append(tweet_id)
+
+    if pending_ids:
+        # 失败的批次不写缓存，否则一次临时错误会让这些会话在缓存有效期内都显示为没有评论
+        result = fetch_conversation_batches(client, pending_ids)
+        replies_by_id.update(result)
+        if failed is not None:
+            failed.update(tweet_id for tweet_id in pending_ids if tweet_id not in result)
+        if client.cache:
+            for tweet_id, replies in result.items():
+                client.cache.set(f'replies:{tweet_id}', [serialize_tweet(reply) for reply in replies])
+    # 按原推文顺序返回结果，获取失败的推文本次没有评论
+    return [replies_by_id.get(tweet.id, []) for tweet in tweets]
+
+def get_reply_data(reply):
+    """
+    提取评论的核心数据
+    :param reply: 评论的 TweetRecord
+    :return: 包含ID、时间、作者、回复对象和内容的字典
+    """
+    return {
+        'id': reply.id,
+        'created_at': reply.created_at.isoformat() if reply.created_at else '',
+        'author_id': reply.author_id,
+        'in_reply_to_id': ConversationIndex.parent_of(reply),
+        'in_reply_to_user_id': reply.in_reply_to_user_id,
+        'text': reply.text
+    }
+
 def get_tweet_data(tweet):
     """
-    提取推文的核心数据
-    :param tweet: 推文对象
+    提取推文的核心数据，评论已按回复树先序排列，depth 为评论在树中的深度
+    :param tweet: TweetRecord
     :return: 包含ID、时间、内容和评论的字典
     """
+    depths = {tweet.id: 0}
+    replies = []
+    for reply in tweet.replies:
+        data = get_reply_data(reply)
+        # 先序排列保证父评论先出现，父评论缺失的分支深度为 1
+        data['depth'] = depths[reply.id] = depths.get(data['in_reply_to_id'], 0) + 1
+        replies.append(data)
     return {
         'id': tweet.id,
-        'created_at': tweet.created_at.isoformat() if hasattr(tweet, 'created_at') else '',
+        'created_at': tweet.created_at.isoformat() if tweet.created_at else '',
         'text': tweet.text,
-        'replies': getattr(tweet, 'replies', [])
+        'replies': replies
     }
 
-def get_tweets_with_pagination(client, get_tweets_func, params):
+def request_timeline_page(client, get_tweets_func, params):
     """
-    分页获取推文及其评论
+    获取一页推文，可缓存的时间线优先读取缓存
     :param client: Twitter客户端
-    :param get_tweets_func: 获取推文的函数
+    :param get_tweets_func: 获取推文的函数(tweepy.Client 的未绑定方法)
     :param params: API参数
-    :return: 推文列表
+    :return: (data 已转换为 TweetRecord 的API响应, 是否来自缓存)
+    """
+    endpoint = get_tweets_func.__name__
+    cache_key = None
+    if client.cache and endpoint in CACHEABLE_TIMELINES:
+        cache_key = make_cache_key(endpoint, params)
+        cached = client.cache.get(cache_key)
+        if cached is not None:
+            data = [deserialize_tweet(tweet) for tweet in cached['data']]
+            return tweepy.Response(data, {}, [], cached['meta']), True
+
+    tweets = client.make_request(get_tweets_func, endpoint, **params)
+    if tweets and tweets.data:
+        tweets = tweets._replace(data=to_records(tweets.data))
+    if cache_key and tweets and tweets.data:
+        client.cache.set(cache_key, {
+            'data': [serialize_tweet(tweet) for tweet in tweets.data],
+            'meta': tweets.meta or {}
+        })
+    return tweets, False
+
+def attach_replies(client, tweets, failed=None):
+    """
+    获取一页推文的评论并挂到推文上
+    :param client: Twitter客户端
+    :param tweets: 推文列表
+    :param failed: 可选集合，写入评论获取失败的推文ID
+    :return: 本页获取到的评论总数
+    """
+    page_replies = fetch_replies_concurrently(client, tweets, failed)
+    for tweet, replies in zip(tweets, page_replies):
+        tweet.replies = tuple(replies)
+    return sum(len(replies) for replies in page_replies)
+
+def iter_tweet_pages(client, get_tweets_func, params, status=None, journal=None):
+    """
+    分页获取推文及其评论，每获取一页就产出一页，不在内存中累积
+    :param client: Twitter客户端
+    :param get_tweets_func: 获取推文的函数(tweepy.Client 的未绑定方法)
+    :param params: API参数
+    :param status: 可选字典，分页全部完成时写入 status['complete'] = True(抓取日志中仍有评论待获取时不写入)
+    :param journal: 可选的 CrawlJournal，先重放已完成的页并重新获取失败的评论，再从记录的令牌续抓
+    :return: 逐页产出推文列表的生成器
     """
-    tweets_data = []
     pagination_token = None
     retry_count = 0
     max_retries = 3
+    progress = ProgressReporter(get_tweets_func.__name__)
 
-    while retry_count < max_retries:
-        try:
-            if pagination_token:
-                params['pagination_token'] = pagination_token
-            
-            logger.info(f"正在获取 {params['max_results']} 条推文")
-            tweets = client.make_request(get_tweets_func, get_tweets_func.__name__, **params)
+    def mark_complete():
+        # 有评论待获取时保留抓取日志且不标记完成，下次运行只重新获取这些会话
+        if (journal is None or journal.complete()) and status is not None:
+            status['complete'] = True
 
-            if not tweets or not hasattr(tweets, 'data') or not tweets.data:
-                logger.warning("未获取到推文数据")
-                break
+    if journal:
+        for page, tweets, replies_by_id, pending_ids in journal.replay():
+            for tweet in tweets:
+                tweet.replies = tuple((replies_by_id or {}).get(tweet.id, ()))
+            # 上次中断时这一页的评论还没获取完，或者有会话的评论获取失败
+            retry = tweets if replies_by_id is None else [tweet for tweet in tweets if tweet.id in pending_ids]
+            if retry:
+                failed = set()
+                attach_replies(client, retry, failed)
+                journal.record_replies(page, retry, failed)
+            progress.update(len(tweets), sum(len(tweet.replies) for tweet in tweets))
+            yield tweets
+        if journal.reached_end:
+            mark_complete()
+            progress.done()
+            return
+        pagination_token = journal.next_token
 
-            for tweet in tweets.data:
-                tweet.replies = get_tweet_replies(client, tweet.id)
-                print(f"已获取推文 {tweet.id} 的 {len(tweet.replies)} 条评论")
+    pending = None  # 已获取但评论尚未获取的页
+    while retry_count < max_retries:
+        try:
+            if pending is None:
+                if pagination_token:
+                    params['pagination_token'] = pagination_token
+                
+                logger.debug(f"正在获取 {params['max_results']} 条推文")
+                tweets, from_cache = request_timeline_page(client, get_tweets_func, params)
 
-            tweets_data.extend(tweets.data)
-            print(f"已获取 {len(tweets_data)} 条推文")
+                if not tweets or not hasattr(tweets, 'data') or not tweets.data:
+                    logger.warning("未获取到推文数据")
+                    mark_complete()
+                    break
 
-            if hasattr(tweets, 'meta') and tweets.meta and tweets.meta.get('next_token'):
-                pagination_token = tweets.meta['next_token']
-                time.sleep(2)
-            else:
-                break
+                next_token = tweets.meta.get('next_token') if hasattr(tweets, 'meta') and tweets.meta else None
+                page = journal.record_page(tweets.data, next_token) if journal else None
+                pending = (tweets.data, next_token, from_cache, page)
 
+            page_tweets, next_token, from_cache, page = pending
+            failed = set()
+            reply_count = attach_replies(client, page_tweets, failed)
+            if journal:
+                journal.record_replies(page, page_tweets, failed)
+            pending = None
+            progress.update(len(page_tweets), reply_count)
+        
         except tweepy.TooManyRequests as e:
             wait_time = handle_rate_limit(e, retry_count)
             if wait_time > 0:
-                time.sleep(wait_time)
+                metered_sleep(wait_time, 'rate_limit', get_tweets_func.__name__)
             retry_count += 1
             continue
             
@@ -279,41 +1572,129 @@ def get_tweets_with_pagination(client, get_tweets_func, params):
             retry_count += 1
             if retry_count >= max_retries:
                 break
-            time.sleep(5)
+            metered_sleep(5, 'error_backoff', get_tweets_func.__name__)
+            continue
 
+        yield page_tweets
+
+        if next_token:
+            pagination_token = next_token
+            if not from_cache and PAGE_DELAY:
+                metered_sleep(PAGE_DELAY, 'page_delay', get_tweets_func.__name__)
+        else:
+            mark_complete()
+            break
+
+    progress.done()
+    if journal:
+        journal.close()
+
+def get_tweets_with_pagination(client, get_tweets_func, params, status=None):
+    """
+    分页获取推文及其评论
+    :param client: Twitter客户端
+    :param get_tweets_func: 获取推文的函数(tweepy.Client 的未绑定方法)
+    :param params: API参数
+    :param status: 可选字典，分页全部完成时写入 status['complete'] = True
+    :return: 推文列表
+    """
+    tweets_data = []
+    for page in iter_tweet_pages(client, get_tweets_func, params, status):
+        tweets_data.extend(page)
     return tweets_data
 
-def get_user_tweets(client, username):
+def resolve_user_id(client, username):
+    """
+    根据用户名获取用户ID，通过客户端的 UserResolver 读取缓存或批量查询
+    :param client: Twitter客户端
+    :param username: 用户名
+    :return: 用户ID，未找到或出错时返回 None
+    """
+    try:
+        user_id = client.user_resolver.resolve(username)
+        if not user_id:
+            logger.warning(f"未找到用户: {username}")
+            return None
+        logger.info(f"找到用户 {username} 的ID: {user_id}")
+        return user_id
+    except Exception as e:
+        logger.error(f"获取用户信息时发生错误: {str(e)}")
+        return None
+
+def iter_user_tweet_pages(client, user_id, checkpoints=None, resume=False, status=None):
+    """
+    逐页获取用户推文
+    :param client: Twitter客户端
+    :param user_id: 用户ID
+    :param checkpoints: 可选的 CheckpointStore，提供时只抓取上次之后的新推文
+    :param resume: 是否记录抓取日志，并从上次中断的位置续抓
+    :param status: 可选字典，分页全部完成时写入 status['complete'] = True
+    :return: 逐页产出推文列表的生成器
+    """
+    tweet_params = get_tweet_params()
+    tweet_params['id'] = user_id
+    since_id = checkpoints.get_since_id(user_id) if checkpoints else None
+    if since_id:
+        tweet_params['since_id'] = since_id
+        logger.info(f"增量抓取用户 {user_id}，since_id: {since_id}")
+
+    status = {} if status is None else status
+    max_id = None
+    journal = CrawlJournal(f'user_{user_id}', tweet_params) if resume else None
+    for page in iter_tweet_pages(client, tweepy.Client.get_users_tweets, tweet_params, status, journal):
+        if checkpoints:
+            checkpoints.record_conversations(user_id, page)
+        max_id = max(max_id or 0, max(tweet.id for tweet in page))
+        yield page
+
+    # 分页中断时不推进检查点，避免漏掉中间未抓取的推文
+    if checkpoints and status.get('complete'):
+        checkpoints.advance(user_id, max_id)
+        checkpoints.save()
+
+HOME_TIMELINE_KEY = 'home'  # 首页时间线在检查点中使用的键
+
+def iter_home_timeline_pages(client, checkpoints=None):
+    """
+    逐页获取首页时间线推文
+    :param client: Twitter客户端
+    :param checkpoints: 可选的 CheckpointStore，提供时只抓取上次之后的新推文
+    :return: 逐页产出推文列表的生成器
+    """
+    tweet_params = get_tweet_params()
+    since_id = checkpoints.get_since_id(HOME_TIMELINE_KEY) if checkpoints else None
+    if since_id:
+        tweet_params['since_id'] = since_id
+
+    status = {}
+    max_id = None
+    for page in iter_tweet_pages(client, tweepy.Client.get_home_timeline, tweet_params, status):
+        max_id = max(max_id or 0, max(tweet.id for tweet in page))
+        yield page
+
+    if checkpoints and status.get('complete'):
+        checkpoints.advance(HOME_TIMELINE_KEY, max_id)
+        checkpoints.save()
+
+@perf_timer('获取用户推文')
+def get_user_tweets(client, username, checkpoints=None):
     """
     获取指定用户的推文
     :param client: Twitter客户端
     :param username: 用户名
+    :param checkpoints: 可选的 CheckpointStore，提供时只抓取上次之后的新推文
     :return: 推文列表
     """
     try:
         print(f"\n正在获取用户 {username} 的推文...")
         
-        try:
-            logger.info(f"正在获取用户 {username} 的信息")
-            user = client.make_request(
-                lambda client: client.get_user(username=username),
-                'get_user'
-            )
-            
-            if not user or not user.data:
-                logger.warning(f"未找到用户: {username}")
-                return []
-            
-            user_id = user.data.id
-            logger.info(f"找到用户ID: {user_id}")
-        except Exception as e:
-            logger.error(f"获取用户信息时发生错误: {str(e)}")
+        user_id = resolve_user_id(client, username)
+        if not user_id:
             return []
 
-        tweet_params = get_tweet_params()
-        tweet_params['id'] = user_id
-
-        tweets_data = get_tweets_with_pagination(client, client.get_users_tweets, tweet_params)
+        tweets_data = []
+        for page in iter_user_tweet_pages(client, user_id, checkpoints):
+            tweets_data.extend(page)
         print(f"\n成功获取 {len(tweets_data)} 条推文")
         return tweets_data
         
@@ -321,8 +1702,37 @@ def get_user_tweets(client, username):
         print(f"\n获取推文过程中发生错误: {str(e)}")
         return []
     finally:
+        if client.cache:
+            client.cache.save()
         logger.info(f"完成获取用户 {username} 的推文")
 
+def refresh_stale_replies(client, checkpoints, user_id, refresh_hours=REPLY_REFRESH_HOURS):
+    """
+    按刷新间隔重新获取已抓取会话的评论，与新推文的抓取分开调度
+    :param client: Twitter客户端
+    :param checkpoints: CheckpointStore
+    :param user_id: 用户ID
+    :param refresh_hours: 刷新间隔(小时)
+    :return: {推文ID: 评论列表}，只包含刷新成功的会话
+    """
+    tweet_ids = checkpoints.get_stale_conversations(user_id, refresh_hours)
+    if not tweet_ids:
+        return {}
+
+    logger.info(f"刷新用户 {user_id} 的 {len(tweet_ids)} 个会话评论")
+    # 只处理成功的批次：失败的会话保留原有缓存，也不标记为已刷新，下次继续刷新
+    replies_by_id = fetch_conversation_batches(client, tweet_ids, thread_name_prefix='refresh')
+    if len(replies_by_id) < len(tweet_ids):
+        logger.warning(f"用户 {user_id} 有 {len(tweet_ids) - len(replies_by_id)} 个会话的评论刷新失败")
+
+    if client.cache:
+        for tweet_id, replies in replies_by_id.items():
+            client.cache.set(f'replies:{tweet_id}', [serialize_tweet(reply) for reply in replies])
+    checkpoints.mark_refreshed(user_id, replies_by_id.keys())
+    checkpoints.save()
+    return replies_by_id
+
+@perf_timer('获取首页时间线')
 def get_home_timeline(client):
     """
     获取首页时间线推文
@@ -332,7 +1742,7 @@ def get_home_timeline(client):
     try:
         print(f"\n正在获取首页时间线推文...")
         tweet_params = get_tweet_params()
-        tweets_data = get_tweets_with_pagination(client, client.get_home_timeline, tweet_params)
+        tweets_data = get_tweets_with_pagination(client, tweepy.Client.get_home_timeline, tweet_params)
         print(f"\n成功获取 {len(tweets_data)} 条推文")
         return tweets_data
         
@@ -340,13 +1750,250 @@ def get_home_timeline(client):
         print(f"\n获取推文过程中发生错误: {str(e)}")
         return []
     finally:
+        if client.cache:
+            client.cache.save()
         logger.info("完成获取首页时间线推文")
 
+class TweetFileWriter:
+    """文本格式流式导出写入器的基类：打开文件、统计已写入的推文数，子类实现 write_page"""
+    newline = None  # 传给 open 的换行参数
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.count = 0
+        self.file = open(filename, 'w', encoding='utf-8', newline=self.newline)
+
+    def write_page(self, tweets):
+        raise NotImplementedError
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+class JsonLinesWriter(TweetFileWriter):
+    """逐页写入 JSON Lines，每条推文一行，中途崩溃时已写入的行仍然可用"""
+
+    def write_page(self, tweets):
+        for tweet in tweets:
+            self.file.write(json.dumps(get_tweet_data(tweet), ensure_ascii=False) + '\n')
+        self.count += len(tweets)
+        self.file.flush()
+
+class JsonArrayWriter(TweetFileWriter):
+    """逐页写入 JSON 数组，每个元素占一行，中途崩溃时补上 ] 即可恢复"""
+
+    def __init__(self, filename):
+        super().__init__(filename)
+        self.file.write('[')
+
+    def write_page(self, tweets):
+        for tweet in tweets:
+            separator = ',\n' if self.count else '\n'
+            self.file.write(separator + json.dumps(get_tweet_data(tweet), ensure_ascii=False))
+            self.count += 1
+        self.file.flush()
+
+    def close(self):
+        self.file.write('\n]\n')
+        self.file.close()
+
+class CsvTweetWriter(TweetFileWriter):
+    """逐页写入 CSV"""
+    newline = ''
+
+    def __init__(self, filename):
+        import csv
+        super().__init__(filename)
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(['推文ID', '发布时间', '内容', '评论数', '评论内容'])
+
+    def write_page(self, tweets):
+        for tweet in tweets:
+            data = get_tweet_data(tweet)
+            replies = data['replies']
+            # 按深度缩进，保留回复结构
+            reply_texts = '\n'.join('  ' * (reply['depth'] - 1) + reply['text'] for reply in replies)
+            self.writer.writerow([
+                data['id'],
+                data['created_at'],
+                data['text'],
+                len(replies),
+                reply_texts
+            ])
+        self.count += len(tweets)
+        self.file.flush()
+
+class ParquetTweetWriter:
+    """
+    按批写入 Parquet：推文表写入 filename，评论表写入 *.replies.parquet，
+    两表通过评论的 tweet_id/conversation_id 与推文 id 关联
+    """
+
+    def __init__(self, filename, replies_filename=None):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("导出 parquet 格式需要安装 pyarrow: pip install pyarrow")
+
+        self.pa = pa
+        self.pq = pq
+        self.filename = filename
+        self.replies_filename = replies_filename or f"{os.path.splitext(filename)[0]}.replies.parquet"
+        self.count = 0
+        timestamp_type = pa.timestamp('ms', tz='UTC')
+        self.tweet_schema = pa.schema([
+            ('id', pa.int64()),
+            ('conversation_id', pa.int64()),
+            ('author_id', pa.int64()),
+            ('created_at', timestamp_type),
+            ('text', pa.string()),
+            ('reply_count', pa.int32())
+        ])
+        self.reply_schema = pa.schema([
+            ('id', pa.int64()),
+            ('tweet_id', pa.int64()),
+            ('conversation_id', pa.int64()),
+            ('in_reply_to_id', pa.int64()),
+            ('in_reply_to_user_id', pa.int64()),
+            ('author_id', pa.int64()),
+            ('created_at', timestamp_type),
+            ('text', pa.string())
+        ])
+        self.tweet_rows = self._empty_rows(self.tweet_schema)
+        self.reply_rows = self._empty_rows(self.reply_schema)
+        self.tweet_writer = None
+        self.reply_writer = None
+
+    @staticmethod
+    def _empty_rows(schema):
+        return {name: [] for name in schema.names}
+
+    def write_page(self, tweets):
+        for tweet in tweets:
+            rows = self.tweet_rows
+            rows['id'].append(tweet.id)
+            rows['conversation_id'].append(tweet.conversation_id)
+            rows['author_id'].append(tweet.author_id)
+            rows['created_at'].append(tweet.created_at)
+            rows['text'].append(tweet.text)
+            rows['reply_count'].append(len(tweet.replies))
+            self.add_replies(tweet.id, tweet.replies)
+        self.count += len(tweets)
+        if len(self.tweet_rows['id']) >= PARQUET_BATCH_SIZE:
+            self._flush_tweets()
+
+    def add_replies(self, tweet_id, replies):
+        """
+        追加一条推文的评论
+        :param tweet_id: 推文ID
+        :param replies: 评论列表
+        """
+        rows = self.reply_rows
+        for reply in replies:
+            rows['id'].append(reply.id)
+            rows['tweet_id'].append(int(tweet_id))
+            rows['conversation_id'].append(reply.conversation_id or int(tweet_id))
+            rows['in_reply_to_id'].append(ConversationIndex.parent_of(reply) or int(tweet_id))
+            rows['in_reply_to_user_id'].append(reply.in_reply_to_user_id)
+            rows['author_id'].append(reply.author_id)
+            rows['created_at'].append(reply.created_at)
+            rows['text'].append(reply.text)
+        if len(rows['id']) >= PARQUET_BATCH_SIZE:
+            self._flush_replies()
+
+    def _flush_tweets(self):
+        if not self.tweet_rows['id']:
+            return
+        table = self.pa.Table.from_pydict(self.tweet_rows, schema=self.tweet_schema)
+        if self.tweet_writer is None:
+            self.tweet_writer = self.pq.ParquetWriter(self.filename, self.tweet_schema, compression=PARQUET_COMPRESSION)
+        self.tweet_writer.write_table(table)
+        self.tweet_rows = self._empty_rows(self.tweet_schema)
+
+    def _flush_replies(self):
+        if not self.reply_rows['id']:
+            return
+        table = self.pa.Table.from_pydict(self.reply_rows, schema=self.reply_schema)
+        if self.reply_writer is None:
+            self.reply_writer = self.pq.ParquetWriter(self.replies_filename, self.reply_schema, compression=PARQUET_COMPRESSION)
+        self.reply_writer.write_table(table)
+        self.reply_rows = self._empty_rows(self.reply_schema)
+
+    def close(self):
+        self._flush_tweets()
+        self._flush_replies()
+        if self.tweet_writer:
+            self.tweet_writer.close()
+        if self.reply_writer:
+            self.reply_writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+EXPORT_WRITERS = {
+    'json': JsonArrayWriter,
+    'jsonl': JsonLinesWriter,
+    'csv': CsvTweetWriter,
+    'parquet': ParquetTweetWriter
+}
+
+def open_export_writer(format_type, filename):
+    """
+    创建流式导出写入器
+    :param format_type: 导出格式
+    :param filename: 文件名
+    :return: 支持 write_page/close 的写入器
+    """
+    if format_type not in EXPORT_WRITERS:
+        raise ValueError(f"不支持的导出格式: {format_type}")
+    return EXPORT_WRITERS[format_type](filename)
+
+@perf_timer('流式导出用户推文')
+def export_user_tweets_streaming(client, username, format_type, filename, checkpoints=None, resume=False, store=None):
+    """
+    边抓取边导出用户推文，每页到达后立即写入文件，内存占用与时间线长度无关
+    :param client: Twitter客户端
+    :param username: 用户名
+    :param format_type: 导出格式
+    :param filename: 文件名
+    :param checkpoints: 可选的 CheckpointStore
+    :param resume: 是否从上次中断的抓取日志续抓
+    :param store: 可选的 TweetStore，每页同时按ID去重写入本地库
+    :return: (用户ID, 导出的推文数)，找不到用户时用户ID为 None
+    """
+    user_id = resolve_user_id(client, username)
+    if not user_id:
+        return None, 0
+    if store:
+        store.upsert_user(user_id, username)
+
+    with open_export_writer(format_type, filename) as writer:
+        for page in iter_user_tweet_pages(client, user_id, checkpoints, resume):
+            writer.write_page(page)
+            if store:
+                store.write_page(page, source=f'user:{user_id}')
+        count = writer.count
+
+    if count == 0 and os.path.exists(filename):
+        os.remove(filename)
+    logger.info(f"用户 {username} 已流式导出 {count} 条推文到 {filename}")
+    return user_id, count
+
+@perf_timer('导出推文')
 def export_tweets(tweets, format_type=None, filename=None):
     """
     导出推文数据到文件
     :param tweets: 推文列表
-    :param format_type: 导出格式(json/csv)
+    :param format_type: 导出格式(json/jsonl/csv/parquet)
     :param filename: 文件名
     :return: 导出文件路径
     """
@@ -381,28 +2028,8 @@ def export_tweets(tweets, format_type=None, filename=None):
             
         print(f"\n正在导出 {len(tweets)} 条推文到 {filename}...")
         
-        if format_type == 'json':
-            data = [get_tweet_data(tweet) for tweet in tweets]
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-                
-        elif format_type == 'csv':
-            import csv
-            with open(filename, 'w', encoding='utf-8', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow(['推文ID', '发布时间', '内容', '评论数', '评论内容'])
-                
-                for tweet in tweets:
-                    data = get_tweet_data(tweet)
-                    replies = data['replies']
-                    reply_texts = '\n'.join([reply.text for reply in replies])
-                    writer.writerow([
-                        data['id'],
-                        data['created_at'],
-                        data['text'],
-                        len(replies),
-                        reply_texts
-                    ])
+        with open_export_writer(format_type, filename) as writer:
+            writer.write_page(tweets)
                         
         print(f"\n数据已成功导出到: {filename}")
         return filename
@@ -412,7 +2039,182 @@ def export_tweets(tweets, format_type=None, filename=None):
         logger.error(f"导出数据时出错: {str(e)}")
         return None
 
-def handle_get_tweets(twitter_client):
+def export_replies(replies_by_id, format_type, filename):
+    """
+    导出按会话刷新的评论
+    :param replies_by_id: {推文ID: 评论列表}
+    :param format_type: 导出格式(json/jsonl/csv/parquet)
+    :param filename: 文件名
+    :return: 导出文件路径
+    """
+    try:
+        if format_type == 'csv':
+            import csv
+            with open(filename, 'w', encoding='utf-8', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['推文ID', '评论ID', '回复的推文ID', '发布时间', '作者ID', '内容'])
+                for tweet_id, replies in replies_by_id.items():
+                    for reply in replies:
+                        data = get_reply_data(reply)
+                        writer.writerow([tweet_id, data['id'], data['in_reply_to_id'], data['created_at'],
+                                         data['author_id'], data['text']])
+        elif format_type == 'parquet':
+            with ParquetTweetWriter(filename, replies_filename=filename) as writer:
+                for tweet_id, replies in replies_by_id.items():
+                    writer.add_replies(tweet_id, replies)
+        elif format_type == 'jsonl':
+            with open(filename, 'w', encoding='utf-8') as f:
+                for tweet_id, replies in replies_by_id.items():
+                    for reply in replies:
+                        f.write(json.dumps({'tweet_id': tweet_id, **get_reply_data(reply)}, ensure_ascii=False) + '\n')
+        else:
+            data = {str(tweet_id): [get_reply_data(reply) for reply in replies]
+                    for tweet_id, replies in replies_by_id.items()}
+            with open(filename, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+        return filename
+    except Exception as e:
+        logger.error(f"导出评论时出错: {str(e)}")
+        return None
+
+def load_usernames(users=None, users_file=None):
+    """
+    从命令行参数和文件读取用户名，去掉@前缀、空行、注释并去重
+    :param users: 命令行给出的用户名列表
+    :param users_file: 用户名文件路径，每行一个
+    :return: 用户名列表
+    """
+    names = list(users or [])
+    if users_file:
+        with open(users_file, 'r', encoding='utf-8') as f:
+            names.extend(line.split('#', 1)[0] for line in f)
+
+    usernames = []
+    seen = set()
+    for name in names:
+        name = name.strip().lstrip('@')
+        if name and name.lower() not in seen:
+            seen.add(name.lower())
+            usernames.append(name)
+    return usernames
+
+@perf_timer('批量抓取')
+def run_batch(client, usernames, format_type, output_dir, workers=None, checkpoints=None, resume=True, store=None):
+    """
+    非交互地并行抓取多个用户并分别导出
+    :param client: Twitter客户端
+    :param usernames: 用户名列表
+    :param format_type: 导出格式
+    :param output_dir: 导出目录
+    :param workers: 并行抓取的用户数，默认等于账号数
+    :param checkpoints: 可选的 CheckpointStore，提供时增量抓取并刷新旧会话评论
+    :param resume: 是否记录抓取日志，重新运行时从中断处续抓
+    :param store: 可选的 TweetStore，抓取结果同时写入本地库
+    :return: {用户名: 导出文件路径或 None}
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    try:
+        # 先批量解析所有用户名，之后各线程直接命中缓存
+        client.user_resolver.resolve_many(usernames)
+    except Exception as e:
+        logger.error(f"批量解析用户名失败: {str(e)}")
+
+    def scrape(username):
+        try:
+            filename = os.path.join(output_dir, f"{username}_{timestamp}.{format_type}")
+            user_id, count = export_user_tweets_streaming(client, username, format_type, filename, checkpoints,
+                                                          resume, store)
+            if not user_id:
+                return username, None
+            if checkpoints:
+                replies_by_id = refresh_stale_replies(client, checkpoints, user_id)
+                if replies_by_id and store:
+                    store.upsert_replies(replies_by_id)
+                if replies_by_id:
+                    export_replies(replies_by_id, format_type,
+                                   os.path.join(output_dir, f"{username}_replies_{timestamp}.{format_type}"))
+            # 增量模式下没有新推文也算成功
+            return username, filename if count else ''
+        except Exception as e:
+            logger.error(f"批量抓取用户 {username} 失败: {str(e)}", exc_info=True)
+            return username, None
+        finally:
+            if client.cache:
+                client.cache.save()
+
+    workers = workers or max(1, len(client.clients))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='batch') as executor:
+        results = dict(executor.map(scrape, usernames))
+
+    failed = [username for username, filename in results.items() if filename is None]
+    logger.info(f"批量抓取完成: 成功 {len(results) - len(failed)} 个, 失败 {len(failed)} 个")
+    if failed:
+        logger.warning(f"抓取失败的用户: {', '.join(failed)}")
+    return results
+
+def parse_args(argv=None):
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description='Twitter爬虫工具，不带参数时进入交互式菜单')
+    parser.add_argument('-u', '--users', nargs='+', help='要抓取的用户名')
+    parser.add_argument('-f', '--users-file', help='用户名列表文件，每行一个，# 之后为注释')
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='json', help='导出格式')
+    parser.add_argument('-o', '--output-dir', default='exports', help='导出目录')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='并行抓取的用户数(默认: threads 引擎等于账号数，async 引擎为 async_user_concurrency)')
+    parser.add_argument('--engine', choices=['threads', 'async'], default='threads',
+                        help='抓取引擎：threads 为线程池；async 在单个事件循环里并发，不支持续抓日志和旧会话评论刷新')
+    parser.add_argument('--incremental', action='store_true', help='使用检查点只抓取新推文')
+    parser.add_argument('--no-cache', action='store_true', help='不使用本地缓存')
+    parser.add_argument('--no-resume', action='store_true', help='不记录抓取日志，不从上次中断处续抓')
+    parser.add_argument('--store', nargs='?', const=CONFIG.get('store_file', 'tweets.db'),
+                        help='同时按ID去重写入 SQLite 推文库(默认使用配置中的 store_file)')
+    parser.add_argument('--metrics-file', help='结束时写出指标，.json 后缀为JSON，否则为 Prometheus 文本')
+    return parser.parse_args(argv)
+
+def run_batch_cli(args):
+    """
+    命令行批量模式入口
+    :param args: parse_args 的结果
+    :return: 进程退出码
+    """
+    usernames = load_usernames(args.users, args.users_file)
+    if not usernames:
+        logger.error("没有需要抓取的用户名")
+        return 2
+
+    cache = None if args.no_cache else TweetCache()
+    client = None
+    if args.engine == 'threads':
+        client = RetryableTwitterClient(cache=cache)
+        if not client.clients:
+            logger.error("API客户端初始化失败")
+            return 1
+
+    checkpoints = CheckpointStore() if args.incremental else None
+    store = None
+    if args.store:
+        from tweet_store import TweetStore
+        store = TweetStore(args.store)
+    try:
+        if client:
+            results = run_batch(client, usernames, args.format, args.output_dir, args.workers, checkpoints,
+                                resume=not args.no_resume, store=store)
+        else:
+            import asyncio
+            from twitter_async import run_batch_async, ASYNC_USER_CONCURRENCY
+            results = asyncio.run(run_batch_async(usernames, args.format, args.output_dir, cache, checkpoints, store,
+                                                  args.workers or ASYNC_USER_CONCURRENCY))
+    finally:
+        if cache:
+            cache.save()
+        if store:
+            store.close()
+        if args.metrics_file:
+            METRICS.dump(args.metrics_file)
+    return 1 if any(filename is None for filename in results.values()) else 0
+
+def handle_get_tweets(twitter_client, store=None):
     """处理用户推文获取请求"""
     try:
         target_username = input("请输入要爬取的Twitter用户名（不包含@符号）: ").strip()
@@ -421,6 +2223,8 @@ def handle_get_tweets(twitter_client):
             return
 
         tweets = get_user_tweets(twitter_client, target_username)
+        if tweets and store:
+            store.write_page(tweets, source=f'user:{tweets[0].author_id}')
         if tweets:
             export_tweets(tweets)
 
@@ -428,23 +2232,39 @@ def handle_get_tweets(twitter_client):
         print(f"操作失败: {str(e)}")
         logger.error(f"获取推文操作失败: {str(e)}", exc_info=True)
 
-def handle_get_home_timeline(twitter_client):
+def handle_get_home_timeline(twitter_client, store=None):
     """处理首页时间线推文获取请求"""
     try:
         tweets = get_home_timeline(twitter_client)
+        if tweets and store:
+            store.write_page(tweets, source='home')
         if tweets:
             export_tweets(tweets)
     except Exception as e:
         print(f"操作失败: {str(e)}")
         logger.error(f"获取首页时间线推文操作失败: {str(e)}", exc_info=True)
 
-def main():
-    """程序入口，提供交互式菜单"""
+def main(argv=None):
+    """程序入口，带用户参数时运行批量模式，否则提供交互式菜单"""
+    args = parse_args(argv)
+    if args.users or args.users_file:
+        try:
+            return run_batch_cli(args)
+        except KeyboardInterrupt:
+            logger.warning("批量抓取已终止")
+            return 130
+        finally:
+            colorama.deinit()
+
+    store = None
     try:
-        client = RetryableTwitterClient()
+        client = RetryableTwitterClient(cache=TweetCache())
         if not client.clients:
             print("API客户端初始化失败")
             return
+        if args.store:
+            from tweet_store import TweetStore
+            store = TweetStore(args.store)
 
         while True:
             print("\n=== Twitter爬虫工具 ===")
@@ -457,9 +2277,9 @@ def main():
             if choice == 'q':
                 break
             elif choice == '1':
-                handle_get_tweets(client)
+                handle_get_tweets(client, store)
             elif choice == '2':
-                handle_get_home_timeline(client)
+                handle_get_home_timeline(client, store)
             else:
                 print("无效的选择")
 
@@ -468,7 +2288,9 @@ def main():
     except Exception as e:
         print(f"程序错误: {str(e)}")
     finally:
+        if store:
+            store.close()
         colorama.deinit()
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    sys.exit(main()) 
\ No newline at end of file
@@ -0,0 +1,405 @@
+# 过滤流接入模式：用 StreamingClient 接收关注作者的新推文及其会话中的评论，
+# 代替轮询 get_users_tweets 和 search_recent_tweets。
+# 推文到达后转换为 TweetRecord，按批写入本地库或导出文件；
+# 新的根推文到达后立即添加会话规则，规则生效后再搜索一次该会话，补上规则生效前发布的评论；
+# 连接断开后 tweepy 自动重连，每次连上后按检查点用 REST 接口补抓断线期间漏掉的推文，
+# 流中收到的推文在该作者补抓完成后推进 since_id
+import sys
+import time
+import signal
+import argparse
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+import tweepy
+
+from twitter_scraper import (
+    logger, CONFIG, TWITTER_ACCOUNTS, API_BASE_URL, EXPORT_FORMATS, METRICS, ApiRedirectAdapter,
+    RetryableTwitterClient, TweetCache, CheckpointStore, TweetRecord, build_conversation_queries,
+    REPLY_TWEET_FIELDS, load_usernames, open_export_writer, iter_user_tweet_pages, fetch_conversation_batches
+)
+from tweet_store import TweetStore
+
+STREAM_RULE_MAX_LENGTH = CONFIG.get('stream_rule_max_length', 512)      # 单条规则的最大长度
+STREAM_MAX_CONVERSATIONS = CONFIG.get('stream_max_conversations', 200)  # 同时跟踪评论的会话数
+STREAM_FLUSH_SIZE = CONFIG.get('stream_flush_size', 100)                # 缓冲多少条后写入
+STREAM_FLUSH_INTERVAL = CONFIG.get('stream_flush_interval', 5)          # 最长缓冲时间(秒)
+STREAM_RECONNECT_DELAY = CONFIG.get('stream_reconnect_delay', 5)        # 连接彻底失败后重新连接的等待时间(秒)
+STREAM_BACKFILL_MINUTES = CONFIG.get('stream_backfill_minutes', 0)      # 服务端回补分钟数(需要相应的API级别)
+
+AUTHOR_RULE_TAG = 'authors'
+CONVERSATION_RULE_TAG = 'conversations'
+
+METRICS.describe('twitter_stream_tweets_total', 'counter', '过滤流收到的推文数')
+METRICS.describe('twitter_stream_connects_total', 'counter', '过滤流连接次数')
+
+def build_author_rules(usernames, max_length=STREAM_RULE_MAX_LENGTH):
+    """
+    将作者条件用 OR 合并成不超过长度限制的规则
+    :param usernames: 用户名列表
+    :param max_length: 单条规则的最大长度
+    :return: 规则字符串列表
+    """
+    rules = []
+    rule = ''
+    for username in usernames:
+        term = f'from:{username}'
+        candidate = f'{rule} OR {term}' if rule else term
+        if rule and len(candidate) > max_length:
+            rules.append(rule)
+            rule = term
+        else:
+            rule = candidate
+    if rule:
+        rules.append(rule)
+    return rules
+
+class TweetStreamIngestor(tweepy.StreamingClient):
+    """
+    过滤流接入：跟踪关注作者的推文和这些推文下的评论，
+    推文写入 sink(TweetStore 或导出写入器)，评论按会话写入 sink 的 upsert_replies 或 add_replies；
+    两者都不支持的 sink 只记录作者的推文，不跟踪评论
+    """
+
+    def __init__(self, bearer_token, sink, usernames, client=None, checkpoints=None,
+                 api_base_url=API_BASE_URL, backfill=True, **kwargs):
+        super().__init__(bearer_token, **kwargs)
+        if api_base_url:
+            self.session.mount('https://api.twitter.com', ApiRedirectAdapter(api_base_url))
+        self.sink = sink
+        self.usernames = list(usernames)
+        self.client = client
+        self.checkpoints = checkpoints
+        self.backfill_enabled = backfill and client is not None and checkpoints is not None
+        self.collect_replies = hasattr(sink, 'upsert_replies') or hasattr(sink, 'add_replies')
+        if not self.collect_replies:
+            logger.warning(f"{type(sink).__name__} 不能按会话追加评论，只记录关注作者的推文")
+        self.user_ids = {}                    # 用户ID -> 用户名
+        self.conversations = OrderedDict()    # 跟踪评论的会话ID -> 已收到的评论ID，按加入顺序淘汰
+        self.rules_dirty = False
+        self.stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._tweets = []
+        self._replies = {}
+        self._last_flush = time.monotonic()
+        self._catch_up = set()                # 规则生效后需要补搜评论的会话
+        self._rules_event = threading.Event()
+        self._rules_thread = None
+        self._stream_max_ids = {}             # 用户ID -> 流中收到的最大推文ID，尚未写入检查点
+        self._backfilled = set()              # 本次连接后已补抓完成的用户ID
+        self._backfill_pending = False         # 补抓线程运行期间又重连过，需要再补抓一轮
+        self._backfill_running = False
+        self._backfill_thread = None
+
+    def resolve_users(self):
+        """解析关注作者的用户ID，并从检查点恢复近期会话"""
+        if not self.client:
+            return
+        user_ids = self.client.user_resolver.resolve_many(self.usernames)
+        for username in self.usernames:
+            user_id = user_ids[username]
+            if user_id is None:
+                logger.warning(f"未找到用户: {username}")
+                continue
+            self.user_ids[user_id] = username
+            if hasattr(self.sink, 'upsert_user'):
+                self.sink.upsert_user(user_id, username)
+            if self.checkpoints:
+                for conversation_id in sorted(self.checkpoints.get_stale_conversations(user_id, refresh_hours=0)):
+                    self.track_conversation(conversation_id)
+        self.rules_dirty = False
+
+    def track_conversation(self, conversation_id, catch_up=False):
+        """
+        开始跟踪一个会话的评论，超过上限时淘汰最早的会话，并通知规则线程立即同步
+        :param conversation_id: 会话ID
+        :param catch_up: 规则生效后是否搜索一次该会话，补上规则生效前发布的评论
+        """
+        if not self.collect_replies or conversation_id in self.conversations:
+            return
+        self.conversations[conversation_id] = set()
+        while len(self.conversations) > STREAM_MAX_CONVERSATIONS:
+            evicted, _ = self.conversations.popitem(last=False)
+            self._catch_up.discard(evicted)
+        if catch_up:
+            self._catch_up.add(conversation_id)
+        self.rules_dirty = True
+        self._rules_event.set()
+
+    def desired_rules(self):
+        """
+        :return: {(规则, 标签)}
+        """
+        rules = {(rule, AUTHOR_RULE_TAG) for rule in build_author_rules(self.usernames)}
+        for query, _ in build_conversation_queries(list(self.conversations), STREAM_RULE_MAX_LENGTH):
+            rules.add((query, CONVERSATION_RULE_TAG))
+        return rules
+
+    def sync_rules(self):
+        """只增删有变化的规则，避免重建全部规则"""
+        # 先清除标记，同步过程中新加入的会话会重新设置标记，留到下一轮同步
+        self.rules_dirty = False
+        desired = self.desired_rules()
+        response = self.get_rules()
+        current = {(rule.value, rule.tag): rule.id for rule in response.data or []}
+        stale = [rule_id for key, rule_id in current.items() if key not in desired]
+        missing = [tweepy.StreamRule(value, tag) for value, tag in desired if (value, tag) not in current]
+        if stale:
+            self.delete_rules(stale)
+        if missing:
+            self.add_rules(missing)
+        if stale or missing:
+            logger.info(f"过滤流规则已更新: 删除 {len(stale)} 条, 添加 {len(missing)} 条")
+
+    def update_conversation_rules(self):
+        """同步会话规则，规则生效后搜索新会话，补上规则生效前已经发布的评论"""
+        # 只补搜本轮同步之前加入的会话，之后加入的会话要等下一轮规则生效
+        with self._lock:
+            conversation_ids, self._catch_up = self._catch_up, set()
+        if self.rules_dirty:
+            try:
+                self.sync_rules()
+            except Exception as e:
+                # 下次写出时重试
+                logger.error(f"更新过滤流规则失败: {str(e)}")
+                self.rules_dirty = True
+                with self._lock:
+                    self._catch_up.update(conversation_ids)
+                return
+        if not conversation_ids or not self.client:
+            return
+        replies_by_id = fetch_conversation_batches(self.client, conversation_ids, thread_name_prefix='stream-catch-up')
+        with self._lock:
+            # 补搜失败的会话下次写出时重试
+            self._catch_up.update(cid for cid in conversation_ids
+                                  if cid not in replies_by_id and cid in self.conversations)
+            for conversation_id, replies in replies_by_id.items():
+                seen = self.conversations.get(conversation_id)
+                if seen is None:
+                    continue
+                # 规则生效后流中已收到的评论不再重复写入
+                missed = [reply for reply in replies if reply.id not in seen]
+                seen.update(reply.id for reply in missed)
+                if missed:
+                    self._replies.setdefault(conversation_id, []).extend(missed)
+        if any(replies_by_id.values()):
+            logger.info(f"补搜 {len(replies_by_id)} 个新会话，得到 "
+                        f"{sum(len(replies) for replies in replies_by_id.values())} 条评论")
+
+    def _rules_loop(self):
+        """规则线程：会话有变化时立即同步规则，不阻塞接收推文的线程"""
+        while not self.stop_event.is_set():
+            if self._rules_event.wait(1):
+                self._rules_event.clear()
+                self.update_conversation_rules()
+
+    def _write(self, tweets, replies_by_id):
+        """写入 sink，调用方持有 _lock"""
+        if tweets:
+            self.sink.write_page(tweets)
+        if replies_by_id:
+            if hasattr(self.sink, 'upsert_replies'):
+                self.sink.upsert_replies(replies_by_id)
+            else:
+                # 导出写入器按推文ID把评论关联到原推文
+                for conversation_id, replies in replies_by_id.items():
+                    self.sink.add_replies(conversation_id, replies)
+
+    def _advance_checkpoints(self):
+        """
+        把已写入的流中推文记入 since_id，调用方持有 _lock。
+        补抓尚未完成的用户暂不推进，否则断线期间漏掉的推文会被跳过
+        :return: 是否推进了检查点
+        """
+        if not self.checkpoints:
+            return False
+        ready = [user_id for user_id in self._stream_max_ids
+                 if user_id in self._backfilled or not self.backfill_enabled]
+        for user_id in ready:
+            self.checkpoints.advance(user_id, self._stream_max_ids.pop(user_id))
+        return bool(ready)
+
+    def flush(self):
+        """写出缓冲的推文和评论，推进检查点；规则同步失败时重新触发"""
+        with self._lock:
+            tweets, self._tweets = self._tweets, []
+            replies_by_id, self._replies = self._replies, {}
+            self._write(tweets, replies_by_id)
+            self._last_flush = time.monotonic()
+            advanced = self._advance_checkpoints()
+        if advanced:
+            self.checkpoints.save()
+        if self.rules_dirty or self._catch_up:
+            self._rules_event.set()
+
+    def _maybe_flush(self):
+        buffered = len(self._tweets) + sum(len(replies) for replies in self._replies.values())
+        if buffered >= STREAM_FLUSH_SIZE or time.monotonic() - self._last_flush >= STREAM_FLUSH_INTERVAL:
+            self.flush()
+
+    def on_tweet(self, tweet):
+        record = TweetRecord.from_tweet(tweet)
+        with self._lock:
+            if record.author_id in self.user_ids:
+                # 作者的推文(包括作者自己的评论)都在其时间线上，写出后推进 since_id
+                self._stream_max_ids[record.author_id] = max(self._stream_max_ids.get(record.author_id, 0), record.id)
+            seen = self.conversations.get(record.conversation_id)
+            if seen is not None and record.id != record.conversation_id:
+                kind = 'reply'
+                if record.id in seen:
+                    kind = 'duplicate'
+                else:
+                    seen.add(record.id)
+                    self._replies.setdefault(record.conversation_id, []).append(record)
+            else:
+                self._tweets.append(record)
+                kind = 'tweet'
+                if record.author_id in self.user_ids and record.id == record.conversation_id:
+                    self.track_conversation(record.id, catch_up=True)
+                    if self.checkpoints:
+                        self.checkpoints.record_conversations(record.author_id, [record], candidates_only=False)
+        METRICS.inc('twitter_stream_tweets_total', {'type': kind})
+        self._maybe_flush()
+
+    def on_keep_alive(self):
+        self._maybe_flush()
+
+    def on_connect(self):
+        METRICS.inc('twitter_stream_connects_total')
+        logger.info("过滤流已连接")
+        if not self.backfill_enabled:
+            return
+        with self._lock:
+            # 断线期间可能有漏掉的推文，所有用户重新补抓完成之前不推进 since_id
+            self._backfilled.clear()
+            self._backfill_pending = True
+            start = not self._backfill_running
+            self._backfill_running = True
+        if start:
+            self._backfill_thread = threading.Thread(target=self.backfill, name='stream-backfill', daemon=True)
+            self._backfill_thread.start()
+
+    def on_closed(self, response):
+        logger.warning("过滤流被服务端关闭，正在重连")
+
+    def on_connection_error(self):
+        logger.warning("过滤流连接出错，正在重连")
+
+    def on_request_error(self, status_code):
+        logger.error(f"过滤流请求失败: HTTP {status_code}")
+
+    def on_errors(self, errors):
+        logger.error(f"过滤流返回错误: {errors}")
+
+    def on_exception(self, exception):
+        logger.error(f"过滤流异常: {str(exception)}", exc_info=True)
+
+    def backfill(self):
+        """
+        按检查点补抓连接建立之前漏掉的推文，本地库按ID去重，与流中推文重复不影响结果。
+        补抓期间再次重连时重新补抓一轮
+        """
+        while True:
+            with self._lock:
+                if not self._backfill_pending or self.stop_event.is_set():
+                    self._backfill_running = False
+                    break
+                self._backfill_pending = False
+            for user_id, username in list(self.user_ids.items()):
+                if self.stop_event.is_set():
+                    break
+                try:
+                    count = 0
+                    status = {}
+                    for page in iter_user_tweet_pages(self.client, user_id, self.checkpoints, status=status):
+                        with self._lock:
+                            self._write(page, {})
+                            for tweet in page:
+                                if tweet.conversation_id in (None, tweet.id):
+                                    self.track_conversation(tweet.id)
+                        count += len(page)
+                    if status.get('complete'):
+                        with self._lock:
+                            self._backfilled.add(user_id)
+                    if count:
+                        logger.info(f"补抓用户 {username} 的 {count} 条推文")
+                except Exception as e:
+                    logger.error(f"补抓用户 {username} 失败: {str(e)}")
+        self.checkpoints.save()
+
+    def run(self):
+        """
+        同步规则并持续接收过滤流，直到调用 stop
+        """
+        if not self.user_ids:
+            self.resolve_users()
+        self.sync_rules()
+        self._rules_thread = threading.Thread(target=self._rules_loop, name='stream-rules', daemon=True)
+        self._rules_thread.start()
+        # 流中同时有推文和评论，按评论的字段请求，保留回复关系
+        filter_params = {'tweet_fields': REPLY_TWEET_FIELDS}
+        if STREAM_BACKFILL_MINUTES:
+            filter_params['backfill_minutes'] = STREAM_BACKFILL_MINUTES
+        while not self.stop_event.is_set():
+            self.filter(**filter_params)
+            self.flush()
+            # filter 返回说明重试次数用完或发生异常，等待后重新连接
+            if self.stop_event.wait(STREAM_RECONNECT_DELAY):
+                break
+        if self._backfill_thread:
+            self._backfill_thread.join()
+        self._rules_thread.join()
+        self.flush()
+
+    def stop(self, *args):
+        """停止接收(可作为信号处理函数)"""
+        self.stop_event.set()
+        self.disconnect()
+
+def parse_args(argv=None):
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description='过滤流接入模式：实时接收关注作者的推文和评论')
+    parser.add_argument('-u', '--users', nargs='+', help='关注的用户名')
+    parser.add_argument('-f', '--users-file', help='用户名列表文件，每行一个，# 之后为注释')
+    parser.add_argument('--store', default=CONFIG.get('store_file', 'tweets.db'), help='写入的 SQLite 推文库')
+    parser.add_argument('--format', choices=EXPORT_FORMATS, help='改为写入导出文件的格式')
+    parser.add_argument('-o', '--output', help='导出文件名(与 --format 一起使用)')
+    parser.add_argument('--account', help='使用的账号名，默认第一个账号')
+    parser.add_argument('--no-backfill', action='store_true', help='重连后不补抓漏掉的推文')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """过滤流接入模式入口"""
+    args = parse_args(argv)
+    usernames = load_usernames(args.users, args.users_file)
+    if not usernames:
+        logger.error("关注列表为空")
+        return 2
+
+    accounts = [account for account in TWITTER_ACCOUNTS if not args.account or account['name'] == args.account]
+    if not accounts:
+        logger.error(f"未找到账号: {args.account}")
+        return 1
+
+    client = RetryableTwitterClient(cache=TweetCache())
+    if args.format:
+        filename = args.output or f"stream_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{args.format}"
+        sink = open_export_writer(args.format, filename)
+    else:
+        sink = TweetStore(args.store, source='stream')
+
+    ingestor = TweetStreamIngestor(accounts[0]['bearer_token'], sink, usernames, client=client,
+                                   checkpoints=CheckpointStore(), backfill=not args.no_backfill)
+    signal.signal(signal.SIGINT, ingestor.stop)
+    signal.signal(signal.SIGTERM, ingestor.stop)
+    try:
+        ingestor.run()
+    finally:
+        sink.close()
+        if client.cache:
+            client.cache.save()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())